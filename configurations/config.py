@@ -24,22 +24,139 @@ SOFTWARE.
 
 import os
 
-from distutils.util import strtobool
+from typing import Dict, Mapping
 
 from configparser import ConfigParser
 
+from configurations.settings import Settings
 
-def get_config() -> ConfigParser:
+CONFIG_DIR = os.path.dirname(os.path.abspath(__file__))
+# Read first if present, so environment configs only need the options they change.
+BASE_CONFIG = 'base'
+# The environment variables file written by hook/maintenance/manage_environment_vars.sh.
+ENVIRONMENT_VARS_PATH = '~/.environment-vars'
+# e.g. CONFIG__POOL__PROCESSES=8 overrides processes in the [Pool] section.
+OVERRIDE_PREFIX = 'CONFIG__'
+
+# Layered options by ACTIVE_CONFIG, so the files are only read once per process.
+_layers: Dict[str, Dict[str, Dict[str, str]]] = {}
+_settings: Dict[str, Settings] = {}
+
+
+def _read_environment_vars(path: str) -> Dict[str, str]:
     """
-    Determine and load the correct config file based on environment variables.
+    This function reads the variables from a file of "export NAME=value" lines.
+    Args:
+        path: The path of the file.
+
+    Returns: A dict of variable name to value, empty if the file doesn't exist.
+
+    """
+    variables = {}
+    path = os.path.expanduser(path)
+    if not os.path.isfile(path):
+        return variables
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('export '):
+                line = line[len('export '):].strip()
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+            name, value = line.split('=', 1)
+            value = value.strip()
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+                value = value[1:-1]
+            variables[name.strip()] = value
+    return variables
+
+
+def _apply_overrides(config: ConfigParser, variables: Mapping[str, str]) -> None:
     """
+    This function sets the config options named by CONFIG__<SECTION>__<OPTION> variables. Section names are matched
+    case insensitively.
+    Args:
+        config: The ConfigParser to override.
+        variables: The environment variables.
+
+    Returns:
+
+    """
+    sections = {section.lower(): section for section in config.sections()}
+    for name, value in variables.items():
+        if not name.upper().startswith(OVERRIDE_PREFIX):
+            continue
+        section, _, option = name[len(OVERRIDE_PREFIX):].partition('__')
+        if not section or not option:
+            continue
+        section = sections.setdefault(section.lower(), section.title())
+        if not config.has_section(section):
+            config.add_section(section)
+        config.set(section, option.lower(), value)
+
+
+def _load_layers(active_config: str) -> Dict[str, Dict[str, str]]:
     config = ConfigParser()
+    base_path = os.path.join(CONFIG_DIR, f'{BASE_CONFIG}.config')
+    active_path = os.path.join(CONFIG_DIR, f'{active_config}.config')
+    assert os.path.isfile(active_path), f"No config file for ACTIVE_CONFIG '{active_config}' at {active_path}!"
+    config.read([base_path, active_path])
 
+    # Variables exported in the running process win over the environment variables file.
+    variables = _read_environment_vars(ENVIRONMENT_VARS_PATH)
+    variables.update(os.environ)
+    _apply_overrides(config, variables)
+
+    return {section: dict(config.items(section, raw=True)) for section in config.sections()}
+
+
+def _active_config() -> str:
     # Retrieve the active config, if it is defined.
     active_config = os.environ['ACTIVE_CONFIG'] if 'ACTIVE_CONFIG' in os.environ else None
 
     # Require an ACTIVE_CONFIG and assume config in configurations dir.
     assert active_config, "A config is required! Define the ACTIVE_CONFIG environment variable!"
-    config.read(f'configurations/{active_config}.config')
+    return active_config
+
 
+def get_config() -> ConfigParser:
+    """
+    Determine and load the correct config file based on environment variables.
+
+    The config is layered: configurations/base.config, if present, then configurations/{ACTIVE_CONFIG}.config, then
+    CONFIG__<SECTION>__<OPTION> overrides from ~/.environment-vars and the environment. The files are read once per
+    process, and every call returns a fresh copy that the caller is free to modify.
+    """
+    active_config = _active_config()
+    if active_config not in _layers:
+        _layers[active_config] = _load_layers(active_config)
+
+    config = ConfigParser()
+    config.read_dict(_layers[active_config])
     return config
+
+
+def get_settings() -> Settings:
+    """
+    Get the typed, validated settings of the active config. They are loaded once per process, and pool workers are
+    handed the main process's settings by install_settings() rather than loading them again.
+    """
+    active_config = _active_config()
+    if active_config not in _settings:
+        _settings[active_config] = Settings.from_config(get_config())
+    return _settings[active_config]
+
+
+def install_settings(settings: Settings) -> None:
+    """
+    Use settings loaded by another process, e.g. in a pool worker initializer, as this process's settings.
+    """
+    _settings[os.environ.get('ACTIVE_CONFIG', '')] = settings
+
+
+def clear_config_cache() -> None:
+    """
+    Forget the loaded configs and settings, so the next call reads the files again.
+    """
+    _layers.clear()
+    _settings.clear()
@@ -0,0 +1,272 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from dataclasses import dataclass, field, fields
+
+from typing import Any, List, Tuple
+
+from configparser import ConfigParser
+
+_TYPE_NAMES = {bool: 'true or false', int: 'an integer', float: 'a number'}
+
+# The levels each compression method accepts, from fastest to smallest.
+_COMPRESSION_LEVELS = {'gzip': (1, 9), 'zstd': (1, 22)}
+
+
+def _option(default: Any, choices: Tuple = (), minimum: Any = None) -> Any:
+    return field(default=default, metadata={'choices': choices, 'minimum': minimum})
+
+
+def _read_section(cls, config: ConfigParser, errors: List[str]):
+    """
+    This function reads the options of a settings section from a config, converting each to the type of its field.
+    Missing options take the field's default.
+    Args:
+        cls: The settings dataclass, whose SECTION names the config section.
+        config: A ConfigParser containing the configuration.
+        errors: Collects a message for every invalid option, so that they can all be reported at once.
+
+    Returns: An instance of cls.
+
+    """
+    values = {}
+    for option in fields(cls):
+        if not config.has_option(cls.SECTION, option.name):
+            continue
+        key = f'[{cls.SECTION}] {option.name}'
+        try:
+            if option.type is bool:
+                value = config.getboolean(cls.SECTION, option.name)
+            elif option.type is int:
+                value = config.getint(cls.SECTION, option.name)
+            elif option.type is float:
+                value = config.getfloat(cls.SECTION, option.name)
+            elif option.type == Tuple[str, ...]:
+                value = tuple(x.strip() for x in config.get(cls.SECTION, option.name).split(',') if x.strip())
+            else:
+                value = config.get(cls.SECTION, option.name).strip()
+        except ValueError:
+            errors.append(f"{key} must be {_TYPE_NAMES[option.type]}, got '{config.get(cls.SECTION, option.name)}'.")
+            continue
+
+        choices, minimum = option.metadata.get('choices'), option.metadata.get('minimum')
+        if choices and value not in choices:
+            errors.append(f"{key} must be one of {', '.join(repr(x) for x in choices)}, got '{value}'.")
+        elif minimum is not None and value < minimum:
+            errors.append(f"{key} must be at least {minimum}, got {value}.")
+        else:
+            values[option.name] = value
+    section = cls(**values)
+    errors.extend(section.check())
+    return section
+
+
+class _Section:
+    SECTION = ''
+
+    def check(self) -> List[str]:
+        """
+        Validate the options which depend on each other, once every option is read.
+        Returns: A message for every invalid option.
+
+        """
+        return []
+
+    @classmethod
+    def from_config(cls, config: ConfigParser):
+        """
+        Read and validate this section of a config.
+        Args:
+            config: A ConfigParser containing the configuration.
+
+        Returns: The typed section.
+
+        """
+        errors: List[str] = []
+        section = _read_section(cls, config, errors)
+        if errors:
+            raise ValueError('Invalid configuration:\n' + '\n'.join(errors))
+        return section
+
+
+@dataclass(frozen=True)
+class LoggerSettings(_Section):
+    SECTION = 'Logger'
+
+    log_dir: str = 'log/logs'
+    max_bytes: int = _option(10000000, minimum=0)
+    backup_count: int = _option(6, minimum=0)
+    pre_purge: bool = False
+    run_history: bool = False
+    runs_dir: str = 'log/runs'
+    keep_runs: int = _option(10, minimum=0)
+    keep_bytes: int = _option(0, minimum=0)
+    transport: str = _option('manager', choices=('manager', 'batched', 'shards'))
+    batch_size: int = _option(512, minimum=1)
+    batch_interval: float = _option(0.05, minimum=0)
+    writer_buffer_size: int = _option(0, minimum=0)
+    writer_flush_interval: float = _option(1.0, minimum=0)
+    max_open_segments: int = _option(0, minimum=0)
+    compression: str = _option('none', choices=('none', 'gzip', 'zstd'))
+    compression_level: int = _option(6, minimum=1)
+    levels: Tuple[str, ...] = ()
+    wire_format: str = _option('full', choices=('full', 'slim'))
+    redirect_buffer_size: int = _option(0, minimum=0)
+    redirect_flush_interval: float = _option(1.0, minimum=0)
+    index_block_seconds: float = _option(0.0, minimum=0)
+    index_block_bytes: int = _option(1048576, minimum=1)
+    queue_capacity: int = _option(0, minimum=0)
+    overflow_policy: str = _option('block', choices=('block', 'drop_oldest', 'drop_below_warning', 'sample'))
+    sample_rate: int = _option(10, minimum=1)
+
+    def check(self) -> List[str]:
+        low, high = _COMPRESSION_LEVELS.get(self.compression, (None, None))
+        if low is not None and not low <= self.compression_level <= high:
+            return [f"[Logger] compression_level must be between {low} and {high} for {self.compression}, "
+                    f"got {self.compression_level}."]
+        return []
+
+
+@dataclass(frozen=True)
+class CheckpointSettings(_Section):
+    SECTION = 'Checkpoint'
+
+    enabled: bool = False
+    path: str = 'checkpoints/scheduled_vm.sqlite'
+    namespace: str = ''
+
+
+@dataclass(frozen=True)
+class PoolSettings(_Section):
+    SECTION = 'Pool'
+
+    processes: int = _option(0, minimum=0)
+    start_method: str = _option('', choices=('', 'spawn', 'forkserver', 'fork'))
+    preload_modules: Tuple[str, ...] = ()
+    chunk_size: int = _option(1, minimum=1)
+    adaptive: bool = False
+    min_processes: int = _option(1, minimum=1)
+    max_processes: int = _option(0, minimum=0)
+    warmup_units: int = _option(8, minimum=1)
+    target_cpu: float = _option(0.9, minimum=0.01)
+    memory_reserve_mb: int = _option(512, minimum=0)
+    worker_memory_mb: int = _option(256, minimum=1)
+    sizing_interval: float = _option(5.0, minimum=0)
+
+
+@dataclass(frozen=True)
+class TelemetrySettings(_Section):
+    SECTION = 'Telemetry'
+
+    enabled: bool = False
+    interval: float = _option(1.0, minimum=0.01)
+    idle_threshold: float = _option(0.1, minimum=0)
+
+
+@dataclass(frozen=True)
+class ProfilingSettings(_Section):
+    SECTION = 'Profiling'
+
+    enabled: bool = False
+    trace_memory: bool = False
+    top_n: int = _option(30, minimum=1)
+
+
+@dataclass(frozen=True)
+class DeadlineSettings(_Section):
+    SECTION = 'Deadlines'
+
+    run_timeout: float = _option(0.0, minimum=0)
+    pool_ready_timeout: float = _option(300.0, minimum=0)
+
+
+@dataclass(frozen=True)
+class BootstrapSettings(_Section):
+    SECTION = 'Bootstrap'
+
+    wheelhouse: str = '~/.cache/scheduled-vm/wheelhouse'
+    state_path: str = '~/.cache/scheduled-vm/bootstrap.json'
+
+
+@dataclass(frozen=True)
+class ResultSettings(_Section):
+    SECTION = 'Results'
+
+    directory: str = 'results'
+
+
+@dataclass(frozen=True)
+class WorkQueueSettings(_Section):
+    SECTION = 'WorkQueue'
+
+    enabled: bool = False
+    backend: str = _option('filesystem', choices=('filesystem', 'sqlite'))
+    path: str = 'work_queue'
+    owner: str = ''
+    lease_seconds: float = _option(300.0, minimum=1)
+    poll_interval: float = _option(5.0, minimum=0.1)
+    namespace: str = '{date}'
+
+
+@dataclass(frozen=True)
+class AsyncioSettings(_Section):
+    SECTION = 'Asyncio'
+
+    enabled: bool = False
+    concurrency: int = _option(100, minimum=1)
+    task_timeout: float = _option(0.0, minimum=0)
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    The typed, validated configuration of a run. It is immutable, so one instance can be shared by the whole process,
+    and small, so it is cheap to pickle into pool workers.
+    """
+    logger: LoggerSettings = LoggerSettings()
+    checkpoint: CheckpointSettings = CheckpointSettings()
+    pool: PoolSettings = PoolSettings()
+    telemetry: TelemetrySettings = TelemetrySettings()
+    profiling: ProfilingSettings = ProfilingSettings()
+    deadlines: DeadlineSettings = DeadlineSettings()
+    bootstrap: BootstrapSettings = BootstrapSettings()
+    asyncio: AsyncioSettings = AsyncioSettings()
+    results: ResultSettings = ResultSettings()
+    work_queue: WorkQueueSettings = WorkQueueSettings()
+
+    @classmethod
+    def from_config(cls, config: ConfigParser) -> 'Settings':
+        """
+        Read and validate every section of a config.
+        Args:
+            config: A ConfigParser containing the configuration.
+
+        Returns: The typed settings.
+
+        """
+        errors: List[str] = []
+        sections = {option.name: _read_section(option.type, config, errors) for option in fields(cls)}
+        if errors:
+            raise ValueError('Invalid configuration:\n' + '\n'.join(errors))
+        return cls(**sections)
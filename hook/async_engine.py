@@ -0,0 +1,394 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import time
+import asyncio
+import threading
+import traceback
+
+from queue import SimpleQueue
+from contextlib import AsyncExitStack
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import logging
+import logging.handlers
+
+import log.globals
+from log.log_setup import get_logger
+from log.transport import LogQueue, LogQueueHandler, ShardTransport
+
+from hook.checkpoint import CheckpointStore
+from hook.job_engine import Task, TaskResult
+
+logger = get_logger(__name__)
+
+
+class LoopLogHandler(logging.Handler):
+    """
+    Replaces the root handlers of the main process while an event loop runs. Records logged on the loop's thread are
+    handed to the logger queue, so the _lt thread writes them and the loop never waits on disk. Records logged on other
+    threads, including the ones the _lt thread dispatches, go to the original handlers as before.
+
+    The loop only puts its records on an in-process queue. The _llf thread forwards them to the logger queue, so the
+    loop doesn't wait on a full logger queue, or on a round trip to the Manager process for every record.
+    """
+
+    def __init__(self, handlers: List[logging.Handler], queue, thread_id: int):
+        super().__init__()
+        self.handlers = handlers
+        self.thread_id = thread_id
+        self.queue_handler = LogQueueHandler(queue) if isinstance(queue, LogQueue) \
+            else logging.handlers.QueueHandler(queue)
+        # None stops the forwarding thread.
+        self.records: 'SimpleQueue[Optional[logging.LogRecord]]' = SimpleQueue()
+        self.forwarder = threading.Thread(target=self._forward, name='_llf', daemon=True)
+        self.forwarder.start()
+
+    def _forward(self) -> None:
+        while True:
+            record = self.records.get()
+            if record is None:
+                return
+            self.queue_handler.handle(record)
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        if threading.get_ident() == self.thread_id:
+            self.records.put(record)
+            return True
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.handle(record)
+
+    def close(self) -> None:
+        """
+        Forward the records still queued, and stop the forwarding thread.
+        """
+        self.records.put(None)
+        self.forwarder.join()
+        super().close()
+
+
+class _CheckpointRecorder:
+    """
+    Records the calls completed on the event loop from a thread of its own, so the loop doesn't wait for the checkpoint
+    to reach the disk. Calls completed while a commit is running are batched into the next commit.
+    """
+
+    def __init__(self, checkpoint: CheckpointStore):
+        self.checkpoint = checkpoint
+        self.lock = threading.Lock()
+        # Units waiting for the next commit, by task.
+        self.pending: Dict[str, List[Tuple[str, Any]]] = {}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='_cr')
+        self.error: Optional[BaseException] = None
+
+    def add(self, task: str, key: str, value: Any) -> None:
+        with self.lock:
+            # A commit is already scheduled if units are pending.
+            schedule = not self.pending
+            self.pending.setdefault(task, []).append((key, value))
+        if schedule:
+            self.executor.submit(self._commit)
+
+    def _commit(self) -> None:
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        try:
+            for task, units in pending.items():
+                self.checkpoint.record(task, units)
+        except Exception as e:
+            self.error = self.error or e
+
+    def close(self) -> None:
+        """
+        Wait for the pending commits, and raise the first error a commit failed with.
+        """
+        self.executor.shutdown(wait=True)
+        if self.error is not None:
+            raise self.error
+
+
+class AsyncTask(Task):
+    """
+    A coroutine function registered with the AsyncEngine. Map tasks await func(item, **dependency_results) for every
+    item, at most concurrency at once.
+    """
+
+    def __init__(self, name: str, func: Callable, concurrency: Optional[int] = None, timeout: Optional[float] = None,
+                 **kwargs):
+        super().__init__(name, func, **kwargs)
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+
+class _CallFailed(Exception):
+    """
+    A call of a task failed on its last attempt. Carries the formatted traceback.
+    """
+
+
+class AsyncEngine:
+    """
+    Runs registered coroutine functions as a DAG on a single event loop, for I/O bound work which would otherwise
+    occupy a pool worker per request. A task starts as soon as all of its dependencies have completed. While the loop
+    runs, the main process logs through the logger queue (see LoopLogHandler).
+
+    e.g.
+    engine = AsyncEngine(concurrency=50, task_timeout=30)
+    engine.add_task('pages', fetch_page, items=urls, concurrency=10, retries=2)
+    engine.add_task('upload', upload_pages, depends_on=['pages'])
+    for result in engine.run():
+        ...
+    """
+
+    def __init__(self, concurrency: int = 100, task_timeout: Optional[float] = None,
+                 checkpoint: Optional[CheckpointStore] = None, logger_queue=None):
+        """
+        Args:
+            concurrency: The most calls awaited at once, across every task.
+            task_timeout: The most seconds each call may take, for tasks registered without a timeout.
+            checkpoint: Records completed calls so that a rerun after an interruption skips them.
+            logger_queue: The queue from logger_init(). Defaults to log.globals.logger_queue.
+        """
+        self.concurrency = concurrency
+        self.task_timeout = task_timeout
+        self.checkpoint = checkpoint
+        self.logger_queue = logger_queue
+
+        self.tasks: Dict[str, AsyncTask] = {}
+        # Whether the last run stopped at its deadline.
+        self.timed_out = False
+        self._recorder: Optional[_CheckpointRecorder] = None
+
+    def add_task(self, name: str, func: Callable, items: Optional[Iterable] = None, depends_on: Sequence[str] = (),
+                 concurrency: Optional[int] = None, timeout: Optional[float] = None, retries: int = 0,
+                 checkpoint_key: Callable[[Any], str] = str) -> AsyncTask:
+        """
+        Register a task. Dependencies must be registered first, which keeps the task graph acyclic.
+        Args:
+            name: A unique name for the task. Dependents receive its result under this keyword.
+            func: The coroutine function to await.
+            items: The items to map func over, or None to await func once.
+            depends_on: The names of the tasks whose results this task needs.
+            concurrency: The most calls of this task awaited at once. The engine's concurrency still applies.
+            timeout: The most seconds each call may take. Defaults to the engine's task_timeout.
+            retries: The number of times a failed call is retried before the task fails.
+            checkpoint_key: Maps an item of a map task to the key it is checkpointed under.
+
+        Returns: The registered AsyncTask.
+
+        """
+        if name in self.tasks:
+            raise ValueError(f"A task named '{name}' is already registered.")
+        for dependency in depends_on:
+            if dependency not in self.tasks:
+                raise ValueError(f"Task '{name}' depends on '{dependency}', which must be registered first.")
+        if not asyncio.iscoroutinefunction(func):
+            raise ValueError(f"Task '{name}' must be a coroutine function (async def).")
+        task = AsyncTask(name, func, concurrency=concurrency, timeout=timeout, items=items, depends_on=depends_on,
+                         retries=retries, checkpoint_key=checkpoint_key)
+        self.tasks[name] = task
+        return task
+
+    def _pending_positions(self, task: AsyncTask) -> List[Optional[int]]:
+        """
+        Load the results completed by an earlier, interrupted run, and list the calls still to make.
+        """
+        completed = self.checkpoint.completed(task.name) if self.checkpoint is not None else {}
+        if not task.is_map:
+            if '' in completed:
+                task.results[0] = completed['']
+                return []
+            return [None]
+        pending: List[Optional[int]] = []
+        for position, item in enumerate(task.items):
+            key = task.checkpoint_key(item)
+            if key in completed:
+                task.results[position] = completed[key]
+            else:
+                pending.append(position)
+        return pending
+
+    @staticmethod
+    def _result(task: AsyncTask) -> Any:
+        if not task.is_map:
+            return task.results.get(0)
+        return [task.results[position] for position in range(len(task.items))]
+
+    async def _call(self, task: AsyncTask, position: Optional[int], kwargs: Dict[str, Any],
+                    limits: List[asyncio.Semaphore]) -> None:
+        timeout = task.timeout if task.timeout is not None else self.task_timeout
+        attempt = 0
+        while True:
+            attempt += 1
+            async with AsyncExitStack() as stack:
+                for limit in limits:
+                    await stack.enter_async_context(limit)
+                task.attempts += 1
+                try:
+                    call = task.func(**kwargs) if position is None else task.func(task.items[position], **kwargs)
+                    value = await asyncio.wait_for(call, timeout=timeout or None)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    error = traceback.format_exc()
+                    if attempt > task.retries:
+                        raise _CallFailed(error)
+                    logger.warning(f"Task '{task.name}' call {position or 0} failed on attempt {attempt}, "
+                                   f"retrying.\n{error}")
+                    continue
+            task.results[0 if position is None else position] = value
+            if self._recorder is not None:
+                key = '' if position is None else task.checkpoint_key(task.items[position])
+                self._recorder.add(task.name, key, value)
+            return
+
+    def _finish(self, task: AsyncTask, results: List[TaskResult], error: Optional[str] = None) -> None:
+        elapsed = time.monotonic() - task.start_time if task.start_time else 0.0
+        if error is None:
+            task.state = 'done'
+            logger.info(f"Task '{task.name}' completed in {elapsed:.3f}s.")
+            results.append(TaskResult(task.name, result=self._result(task), attempts=task.attempts, elapsed=elapsed))
+        else:
+            task.state = 'failed'
+            logger.error(f"Task '{task.name}' failed after {task.attempts} attempt(s).\n{error}")
+            results.append(TaskResult(task.name, error=error, attempts=task.attempts, elapsed=elapsed))
+
+    async def _run_task(self, task: AsyncTask, limit: asyncio.Semaphore, finished: Dict[str, asyncio.Event],
+                        results: List[TaskResult]) -> None:
+        try:
+            for dependency in task.depends_on:
+                await finished[dependency].wait()
+            failed = [x for x in task.depends_on if self.tasks[x].state != 'done']
+            if failed:
+                self._finish(task, results, error=f"Dependency '{failed[0]}' failed.")
+                return
+
+            task.state = 'running'
+            task.start_time = time.monotonic()
+            positions = self._pending_positions(task)
+            if task.results:
+                logger.info(f"Task '{task.name}' resumed from checkpoint with {len(positions)} call(s) remaining.")
+            else:
+                logger.info(f"Task '{task.name}' started with {len(positions)} call(s).")
+
+            kwargs = {dependency: self._result(self.tasks[dependency]) for dependency in task.depends_on}
+            # Take the task's own slot first, so calls waiting on it don't hold slots other tasks could use.
+            limits = ([asyncio.Semaphore(task.concurrency)] if task.concurrency else []) + [limit]
+            pending = iter(positions)
+
+            async def work() -> None:
+                # The workers share the iterator, so each position is called once.
+                for position in pending:
+                    await self._call(task, position, kwargs, limits)
+
+            # No more workers than calls can run at once, rather than a future per item.
+            workers = min(len(positions), task.concurrency or self.concurrency, self.concurrency)
+            calls = [asyncio.ensure_future(work()) for _ in range(workers)]
+            try:
+                if calls:
+                    done, _ = await asyncio.wait(calls, return_when=asyncio.FIRST_EXCEPTION)
+                    errors = [x.exception() for x in done if x.exception() is not None]
+                    if errors:
+                        error = errors[0]
+                        self._finish(task, results, error=str(error) if isinstance(error, _CallFailed) else repr(error))
+                        return
+                self._finish(task, results)
+            finally:
+                # Stop the workers of a failed or cancelled task, and wait for them to unwind.
+                for call in calls:
+                    call.cancel()
+                await asyncio.gather(*calls, return_exceptions=True)
+        finally:
+            finished[task.name].set()
+
+    async def run_async(self, timeout: Optional[float] = None) -> List[TaskResult]:
+        """
+        Run every registered task on the current event loop.
+        Args:
+            timeout: The most seconds the run may take. Tasks unfinished at the deadline are cancelled and returned
+                     as failed, and timed_out is set.
+
+        Returns: A list of TaskResults in completion order. A task whose dependency failed is returned as failed
+                 without running.
+
+        """
+        self.timed_out = False
+        results: List[TaskResult] = []
+        if not self.tasks:
+            return results
+
+        root = logging.getLogger()
+        handlers = list(root.handlers)
+        logger_queue = self.logger_queue if self.logger_queue is not None else log.globals.logger_queue
+        # With the shards transport the loop already writes to a buffered shard, without waiting on a file.
+        loop_handler = None
+        if logger_queue is not None and not isinstance(logger_queue, ShardTransport):
+            loop_handler = LoopLogHandler(handlers, logger_queue, threading.get_ident())
+            root.handlers = [loop_handler]
+        self._recorder = _CheckpointRecorder(self.checkpoint) if self.checkpoint is not None else None
+        try:
+            limit = asyncio.Semaphore(self.concurrency)
+            finished = {name: asyncio.Event() for name in self.tasks}
+            runs = [asyncio.ensure_future(self._run_task(task, limit, finished, results))
+                    for task in self.tasks.values()]
+            _, pending = await asyncio.wait(runs, timeout=timeout or None)
+            if pending:
+                self.timed_out = True
+                logger.error(f"Run deadline of {timeout}s exceeded, cancelling the unfinished tasks.")
+                for run in pending:
+                    run.cancel()
+                # Drain the loop, so nothing is left running once the logger terminates.
+                await asyncio.gather(*pending, return_exceptions=True)
+                for task in self.tasks.values():
+                    if task.state in ['waiting', 'running']:
+                        self._finish(task, results, error=f"Run deadline of {timeout}s exceeded.")
+            return results
+        finally:
+            try:
+                # Every completed call is checkpointed once the run returns.
+                if self._recorder is not None:
+                    self._recorder.close()
+                    self._recorder = None
+            finally:
+                root.handlers = handlers
+                if loop_handler is not None:
+                    loop_handler.close()
+
+    def run(self, timeout: Optional[float] = None) -> List[TaskResult]:
+        """
+        Run every registered task on a new event loop, and close the loop once it is drained.
+        Args:
+            timeout: See run_async().
+
+        Returns: See run_async().
+
+        """
+        return asyncio.run(self.run_async(timeout))
@@ -0,0 +1,172 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+import platform
+import subprocess
+
+from typing import Any, Dict, List, Optional
+
+from configurations.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+def requirements_hash(requirements_path: str) -> str:
+    """
+    This function hashes a requirements file together with the interpreter it is installed into, so that a change
+    to either triggers an install.
+    Args:
+        requirements_path: The path of the requirements file.
+
+    Returns: The hex digest.
+
+    """
+    digest = hashlib.sha256()
+    with open(requirements_path, 'rb') as f:
+        digest.update(f.read())
+    digest.update(f'{sys.executable}\n{sys.version}\n{platform.machine()}'.encode())
+    return digest.hexdigest()
+
+
+def _read_state(state_path: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.expanduser(state_path), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_state(state_path: str, state: Dict[str, Any]) -> None:
+    state_path = os.path.expanduser(state_path)
+    directory = os.path.dirname(state_path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    # Replace atomically so an interrupted boot never leaves a half written state.
+    with open(f'{state_path}.tmp', 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(f'{state_path}.tmp', state_path)
+
+
+def _pip(*args: str) -> bool:
+    started = time.monotonic()
+    result = subprocess.run([sys.executable, '-m', 'pip', *args])
+    logger.info(f"pip {args[0]} finished with exit code {result.returncode} in {time.monotonic() - started:.1f}s.")
+    return result.returncode == 0
+
+
+def bootstrap(requirements_path: str, wheelhouse: str, state_path: str, force: bool = False) -> Dict[str, Any]:
+    """
+    This function installs the requirements, doing as little as possible:
+    1) If the requirements and interpreter are unchanged since the last successful install, skip pip entirely.
+    2) Otherwise install offline from the wheelhouse on the persistent disk.
+    3) If the wheelhouse is missing packages, add only the missing wheels to it and install offline again.
+    4) If that fails too, install from the package index directly.
+    Args:
+        requirements_path: The path of the requirements file.
+        wheelhouse: The directory of cached wheels.
+        state_path: The file recording the last successful install.
+        force: Install even if the requirements are unchanged.
+
+    Returns: A dict of the path taken ('skipped', 'wheelhouse', 'refreshed' or 'index'), the seconds it took and
+             whether it succeeded.
+
+    """
+    started = time.monotonic()
+    wheelhouse = os.path.expanduser(wheelhouse)
+    state = _read_state(state_path)
+    current_hash = requirements_hash(requirements_path)
+
+    def offline_install() -> bool:
+        return _pip('install', '--no-index', '--find-links', wheelhouse, '-r', requirements_path)
+
+    if not force and state.get('hash') == current_hash:
+        path, ok = 'skipped', True
+    else:
+        if not os.path.isdir(wheelhouse):
+            os.makedirs(wheelhouse)
+        if offline_install():
+            path, ok = 'wheelhouse', True
+        # pip wheel reuses the wheels already in the wheelhouse, so only new or changed packages are downloaded.
+        elif _pip('wheel', '--find-links', wheelhouse, '--wheel-dir', wheelhouse, '-r', requirements_path) and \
+                offline_install():
+            path, ok = 'refreshed', True
+        else:
+            logger.warning("Could not install from the wheelhouse, installing from the package index.")
+            path, ok = 'index', _pip('install', '-r', requirements_path)
+
+    run = {'path': path, 'ok': ok, 'seconds': round(time.monotonic() - started, 3), 'time': time.time()}
+    if ok:
+        state['hash'] = current_hash
+    state['last_run'] = run
+    _write_state(state_path, state)
+
+    if path == 'skipped':
+        logger.info(f"Requirements unchanged, skipped pip in {run['seconds']:.3f}s.")
+    elif ok:
+        logger.info(f"Installed requirements ({path}) in {run['seconds']:.1f}s.")
+    else:
+        logger.error(f"Installing requirements failed after {run['seconds']:.1f}s.")
+    return run
+
+
+def log_last_bootstrap(state_path: str, hook_logger: logging.Logger) -> Optional[Dict[str, Any]]:
+    """
+    This function logs how the requirements were installed at boot, so the startup time saved shows up in the run's
+    logs, which are purged after bootstrapping.
+    Args:
+        state_path: The file recording the last install.
+        hook_logger: The logger to log to.
+
+    Returns: The last bootstrap run, or None if there is none.
+
+    """
+    run = _read_state(state_path).get('last_run')
+    if run is not None:
+        hook_logger.info(f"Bootstrap installed requirements by path '{run['path']}' "
+                         f"({'ok' if run['ok'] else 'failed'}) in {run['seconds']:.3f}s.")
+    return run
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Install requirements.txt, skipping pip if nothing changed.")
+    parser.add_argument('--requirements', default='requirements.txt', help="The requirements file.")
+    parser.add_argument('--force', action='store_true', help="Install even if the requirements are unchanged.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s: %(levelname)7s > %(message)s")
+    settings = get_settings().bootstrap
+    run = bootstrap(requirements_path=args.requirements, wheelhouse=settings.wheelhouse,
+                    state_path=settings.state_path, force=args.force)
+    return 0 if run['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -32,6 +32,7 @@ then
 fi
 git pull
 
-pip install -r requirements.txt
+# Skips pip when requirements.txt is unchanged, and installs from the local wheelhouse otherwise.
+python hook/bootstrap.py || pip install -r requirements.txt
 
 . hook/run_hook.sh
@@ -0,0 +1,142 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import time
+import pickle
+import sqlite3
+
+from threading import Lock
+from datetime import datetime
+
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from configparser import ConfigParser
+from configurations.settings import CheckpointSettings
+
+
+class CheckpointStore:
+    """
+    Durably records the work units completed by a scheduled run, along with their results, in a SQLite database on the
+    VM disk. If the VM is preempted or the run crashes, the next run skips the completed units and only processes the
+    rest. Call clear() once a run completes so that the following run starts from scratch.
+
+    Units can be recorded under a namespace, e.g. the date of the run. Only a run in the same namespace resumes from
+    them, so a run which failed doesn't hand its results to a later run on new data. Without one, every run resumes
+    where the last one stopped.
+    """
+
+    def __init__(self, path: str, namespace: str = ''):
+        """
+        Args:
+            path: The SQLite database file.
+            namespace: Scopes the recorded units to a run. Units recorded under other namespaces are deleted.
+        """
+        self.path = path
+        self.namespace = namespace
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # Shared with the thread the AsyncEngine records on, so the event loop doesn't wait on the disk.
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = Lock()
+        # WAL with full sync makes every committed unit survive a crash or power loss, without blocking readers.
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=FULL')
+        columns = [x[1] for x in self.connection.execute('PRAGMA table_info(completed_units)')]
+        if columns and 'namespace' not in columns:
+            # Recorded before units were scoped to a run, so there is no telling which run they belong to.
+            self.connection.execute('DROP TABLE completed_units')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS completed_units ('
+                                'namespace TEXT NOT NULL, '
+                                'task TEXT NOT NULL, '
+                                'unit TEXT NOT NULL, '
+                                'result BLOB, '
+                                'completed_at REAL NOT NULL, '
+                                'PRIMARY KEY (namespace, task, unit))')
+        # Units of other runs can never be resumed.
+        self.connection.execute('DELETE FROM completed_units WHERE namespace != ?', (namespace,))
+        self.connection.commit()
+
+    def completed(self, task: str) -> Dict[str, Any]:
+        """
+        Get the completed units of a task, recorded under this store's namespace.
+        Args:
+            task: The task name.
+
+        Returns: A dict of unit key to the unit's result.
+
+        """
+        with self.lock:
+            rows = self.connection.execute('SELECT unit, result FROM completed_units WHERE namespace = ? AND task = ?',
+                                           (self.namespace, task)).fetchall()
+        return {unit: pickle.loads(result) for unit, result in rows}
+
+    def record(self, task: str, units: Iterable[Tuple[str, Any]]) -> None:
+        """
+        Record units of a task as completed, in a single transaction.
+        Args:
+            task: The task name.
+            units: Pairs of unit key and the unit's result.
+
+        Returns:
+
+        """
+        now = time.time()
+        rows = [(self.namespace, task, unit, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL), now)
+                for unit, result in units]
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO completed_units (namespace, task, unit, result, completed_at) '
+                'VALUES (?, ?, ?, ?, ?)', rows)
+
+    def clear(self) -> None:
+        """
+        Forget every completed unit, so that the next run starts from scratch.
+        Returns:
+
+        """
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM completed_units')
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+def get_checkpoint_store(config: ConfigParser) -> Optional[CheckpointStore]:
+    """
+    This function opens the checkpoint store described by the [Checkpoint] section of the config.
+    Args:
+        config: A ConfigParser containing the configuration.
+
+    Returns: A CheckpointStore, or None if checkpointing is disabled.
+
+    """
+    settings = CheckpointSettings.from_config(config)
+    if not settings.enabled:
+        return None
+    return CheckpointStore(settings.path,
+                           namespace=settings.namespace.format(date=datetime.utcnow().date().isoformat()))
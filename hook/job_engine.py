@@ -0,0 +1,629 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import time
+import queue
+import traceback
+
+from collections import deque
+from contextlib import nullcontext
+
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import multiprocessing as mp
+from multiprocessing.pool import Pool
+from multiprocessing.process import BaseProcess
+
+import log.globals
+from log.log_setup import get_logger, init_worker_logger
+
+from hook.checkpoint import CheckpointStore
+from hook.work_queue import WorkQueue
+from hook.pool_sizer import PoolSizer, UnitUsage, UsageMeter
+from hook.worker_pool import WorkerPool, init_unit_reports, report_unit_started
+from hook.profiling import ProfileCollector, WorkerProfiler
+
+logger = get_logger(__name__)
+
+# The most seconds run() waits for a unit before checking that the pool workers are alive.
+WORKER_CHECK_INTERVAL = 1.0
+
+
+class Task:
+    """
+    A unit of parallel work registered with the JobEngine.
+
+    A task calls func with the results of its dependencies as keyword arguments, named after the dependency tasks.
+    If items is given, the task is a map task: func(item, **dependency_results) is called for every item, in chunks of
+    chunk_size items per pool job, and the task result is the list of results in item order.
+
+    When the engine has a CheckpointStore, each item of a map task is checkpointed under checkpoint_key(item), which
+    must be stable across runs.
+
+    When the engine has a WorkQueue, the items of a distributed map task are split between the instances running the
+    task, and claimed under checkpoint_key(item). The task result is then the list of results of the items processed
+    by this instance, in item order.
+    """
+
+    def __init__(self, name: str, func: Callable, items: Optional[Iterable] = None, depends_on: Sequence[str] = (),
+                 cpus: int = 1, memory_mb: Optional[int] = None, chunk_size: int = 1, retries: int = 0,
+                 checkpoint_key: Callable[[Any], str] = str, distributed: bool = False):
+        self.name = name
+        self.func = func
+        self.items = list(items) if items is not None else None
+        self.depends_on = tuple(depends_on)
+        self.cpus = cpus
+        self.memory_mb = memory_mb
+        self.chunk_size = max(1, chunk_size)
+        self.retries = retries
+        self.checkpoint_key = checkpoint_key
+        self.distributed = distributed
+
+        # Item positions by checkpoint key, for the units claimed from a work queue.
+        self.positions: Dict[str, int] = {}
+        if distributed and self.items is not None:
+            self.positions = {checkpoint_key(item): position for position, item in enumerate(self.items)}
+            if len(self.positions) != len(self.items):
+                raise ValueError(f"The items of distributed task '{name}' must have unique checkpoint keys.")
+        self.claimed_units = 0
+
+        self.state = 'waiting'
+        # Results by item position for map tasks, or under position 0 for single calls.
+        self.results: Dict[int, Any] = {}
+        self.remaining_units = 0
+        self.attempts = 0
+        self.start_time: Optional[float] = None
+
+    @property
+    def is_map(self) -> bool:
+        return self.items is not None
+
+
+class TaskResult:
+    """
+    The outcome of a Task, yielded by JobEngine.run() as tasks complete.
+    """
+
+    def __init__(self, name: str, result: Any = None, error: Optional[str] = None, attempts: int = 0,
+                 elapsed: float = 0.0):
+        self.name = name
+        self.result = result
+        self.error = error
+        self.attempts = attempts
+        self.elapsed = elapsed
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        return f'TaskResult(name={self.name!r}, ok={self.ok}, attempts={self.attempts}, elapsed={self.elapsed:.3f})'
+
+
+class _Unit:
+    """
+    One pool job of a Task: the whole task, or one chunk of a map task.
+    """
+
+    def __init__(self, task: Task, index: int, positions: Optional[List[int]]):
+        self.task = task
+        self.index = index
+        self.positions = positions
+        self.attempt = 0
+
+    @property
+    def items(self) -> Optional[List[Any]]:
+        if self.positions is None:
+            return None
+        return [self.task.items[position] for position in self.positions]
+
+
+def _run_unit(token: int, func: Callable, items: Optional[List[Any]], kwargs: Dict[str, Any],
+              profile: Optional[Tuple[bool, int]] = None,
+              measure: bool = False) -> Tuple[bool, Any, Optional[Dict[str, Any]], Optional[UnitUsage]]:
+    """
+    This function runs a unit of work inside a pool worker.
+    Args:
+        token: The id the unit was dispatched under, reported before the unit runs.
+        func: The task function.
+        items: The chunk of items for a map task, or None for a single call.
+        kwargs: The results of the task's dependencies.
+        profile: The WorkerProfiler arguments if the unit should be profiled, otherwise None.
+        measure: Whether to measure the memory and CPU time the unit uses, for a PoolSizer.
+
+    Returns: A Tuple of (True, result, profile, usage) or (False, formatted traceback, profile, usage). Errors are
+             returned rather than raised so that the traceback survives the trip back to the main process. The profile
+             payload is None unless profiling, and the usage None unless measuring.
+
+    """
+    def call():
+        if items is None:
+            return func(**kwargs)
+        return [func(item, **kwargs) for item in items]
+
+    report_unit_started(token)
+    profiler = WorkerProfiler(*profile) if profile is not None else None
+    meter = UsageMeter() if measure else None
+
+    def payloads():
+        return profiler.payload() if profiler is not None else None, meter.usage if meter is not None else None
+
+    try:
+        with meter if meter is not None else nullcontext():
+            value = profiler.runcall(call) if profiler is not None else call()
+        return (True, value, *payloads())
+    except Exception:
+        return (False, traceback.format_exc(), *payloads())
+
+
+def _init_engine_worker(logger_queue, started_queue) -> None:
+    init_worker_logger(logger_queue)
+    init_unit_reports(started_queue)
+
+
+class _WorkerWatch:
+    """
+    Finds the units lost with a pool worker that died, e.g. killed by the OOM killer. The pool replaces the worker but
+    never calls back for the unit it was running, so without this run() would wait for it forever.
+    """
+
+    def __init__(self, pool: Pool, started_queue, grace: float = WORKER_CHECK_INTERVAL):
+        """
+        Args:
+            pool: The pool the units run on.
+            started_queue: The queue its workers report the units they start on, see report_unit_started().
+            grace: The seconds to wait after a worker is found dead before its unit is lost, for the result of a unit
+                   the worker finished just before dying to arrive.
+        """
+        self.pool = pool
+        self.started_queue = started_queue
+        self.grace = grace
+        # The token of the last unit each worker started, by pid.
+        self.running: Dict[int, int] = {}
+        # The worker processes, by pid, for their exit codes once the pool has dropped them.
+        self.workers: Dict[int, BaseProcess] = {}
+        # When each dead worker was first found dead, by pid.
+        self.dead: Dict[int, float] = {}
+        for process in list(getattr(pool, '_pool', [])):
+            self.workers[process.pid] = process
+
+    def lost(self) -> List[Tuple[int, int, Optional[int]]]:
+        """
+        Returns: A list of (token, pid, exit code) for the units whose worker has died. The exit code is None if the
+                 pool dropped the worker before it was seen. A unit which completed before its worker died may be
+                 included, the caller ignores the tokens it has results for.
+
+        """
+        while not self.started_queue.empty():
+            token, pid = self.started_queue.get()
+            self.running[pid] = token
+        # Pool keeps no public list of its workers. A worker is added to _pool before it starts, so every worker which
+        # reported a unit is either in it, or dead and dropped by the pool.
+        processes = list(getattr(self.pool, '_pool', []))
+        alive = set()
+        for process in processes:
+            self.workers.setdefault(process.pid, process)
+            if process.exitcode is None:
+                alive.add(process.pid)
+
+        lost = []
+        now = time.monotonic()
+        for pid in list(self.running):
+            if pid in alive or now - self.dead.setdefault(pid, now) < self.grace:
+                continue
+            del self.dead[pid]
+            process = self.workers.pop(pid, None)
+            lost.append((self.running.pop(pid), pid, process.exitcode if process is not None else None))
+        for pid in [x for x in self.workers if x not in alive and x not in self.running]:
+            del self.workers[pid]
+        return lost
+
+
+def _total_memory_mb() -> Optional[int]:
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+class JobEngine:
+    """
+    Runs registered tasks as a DAG on a multiprocessing Pool. A task starts as soon as all of its dependencies have
+    completed, as long as the CPU slots and memory it declares are free. Results and failures are yielded by run() in
+    completion order.
+
+    e.g.
+    engine = JobEngine()
+    engine.add_task('load', load_data)
+    engine.add_task('score', score_row, items=range(1000), depends_on=['load'], chunk_size=50, retries=2)
+    engine.add_task('report', write_report, depends_on=['score'], memory_mb=2048)
+    for result in engine.run():
+        ...
+
+    Pool workers log through the queue based logger, so tasks can call get_logger(__name__) directly.
+    """
+
+    def __init__(self, processes: Optional[int] = None, memory_limit_mb: Optional[int] = None,
+                 logger_queue=None, checkpoint: Optional[CheckpointStore] = None, pool: Optional[WorkerPool] = None,
+                 profiler: Optional[ProfileCollector] = None, chunk_size: int = 1,
+                 work_queue: Optional[WorkQueue] = None, sizer: Optional[PoolSizer] = None):
+        """
+        Args:
+            processes: The number of pool workers, which is also the number of CPU slots. Defaults to the size of
+                       pool, or mp.cpu_count().
+            memory_limit_mb: The total memory_mb of tasks allowed to run at once. Defaults to the physical memory.
+            logger_queue: The queue from logger_init(). Defaults to log.globals.logger_queue.
+            checkpoint: Records completed units so that a rerun after an interruption skips them.
+            pool: A WorkerPool to run on, shared with other stages. If None, run() starts and closes its own pool.
+            profiler: Profiles every unit in its worker and merges the profiles. Call profiler.write() after run().
+            chunk_size: The chunk_size of map tasks registered without one.
+            work_queue: Splits the items of distributed map tasks with other instances. Without one, distributed tasks
+                        process every item.
+            sizer: Chooses how many of the CPU slots are used at once, from the memory and CPU time units use.
+        """
+        self.pool = pool
+        self.processes = processes or (pool.processes if pool is not None else mp.cpu_count())
+        self.memory_limit_mb = memory_limit_mb if memory_limit_mb is not None else _total_memory_mb()
+        self.logger_queue = logger_queue
+        self.checkpoint = checkpoint
+        self.profiler = profiler
+        self.chunk_size = chunk_size
+        self.work_queue = work_queue
+        self.sizer = sizer
+
+        self.tasks: Dict[str, Task] = {}
+        # Whether the last run() stopped at its deadline, leaving work running on the pool.
+        self.timed_out = False
+        # The units the last run() lost with a dead worker. The pool waits for them forever, so it can't be closed.
+        self.lost_units = 0
+
+    def add_task(self, name: str, func: Callable, items: Optional[Iterable] = None, depends_on: Sequence[str] = (),
+                 cpus: int = 1, memory_mb: Optional[int] = None, chunk_size: Optional[int] = None, retries: int = 0,
+                 checkpoint_key: Callable[[Any], str] = str, distributed: bool = False) -> Task:
+        """
+        Register a task. Dependencies must be registered first, which keeps the task graph acyclic.
+        Args:
+            name: A unique name for the task. Dependents receive its result under this keyword.
+            func: The function to run. It must be importable by pool workers (defined at module level).
+            items: The items to map func over, or None to call func once.
+            depends_on: The names of the tasks whose results this task needs.
+            cpus: The number of CPU slots the task occupies while running, e.g. for multi-threaded numpy code.
+            memory_mb: The memory the task needs while running, or None if it is negligible.
+            chunk_size: The number of items per pool job for map tasks. Defaults to the engine's chunk_size.
+            retries: The number of times a failed unit of work is retried before the task fails.
+            checkpoint_key: Maps an item of a map task to the key it is checkpointed and claimed under.
+            distributed: Split the items of a map task with the other instances sharing the engine's work queue.
+
+        Returns: The registered Task.
+
+        """
+        if name in self.tasks:
+            raise ValueError(f"A task named '{name}' is already registered.")
+        for dependency in depends_on:
+            if dependency not in self.tasks:
+                raise ValueError(f"Task '{name}' depends on '{dependency}', which must be registered first.")
+        task = Task(name=name, func=func, items=items, depends_on=depends_on, cpus=min(cpus, self.processes),
+                    memory_mb=memory_mb, chunk_size=chunk_size if chunk_size is not None else self.chunk_size,
+                    retries=retries, checkpoint_key=checkpoint_key, distributed=distributed and items is not None)
+        self.tasks[name] = task
+        return task
+
+    def _restore(self, task: Task) -> None:
+        """
+        Load the results of a task's units completed by an earlier, interrupted run.
+        """
+        if self.checkpoint is None:
+            return
+        completed = self.checkpoint.completed(task.name)
+        if not task.is_map:
+            if '' in completed:
+                task.results[0] = completed['']
+            return
+        for position, item in enumerate(task.items):
+            key = task.checkpoint_key(item)
+            if key in completed:
+                task.results[position] = completed[key]
+
+    def _record(self, unit: _Unit, value: Any) -> None:
+        """
+        Store a completed unit's results on the task, and checkpoint them.
+        """
+        task = unit.task
+        if unit.positions is None:
+            task.results[0] = value
+            units = [('', value)]
+        else:
+            task.results.update(zip(unit.positions, value))
+            units = [(task.checkpoint_key(task.items[position]), result)
+                     for position, result in zip(unit.positions, value)]
+        if self.checkpoint is not None:
+            self.checkpoint.record(task.name, units)
+
+    def _is_distributed(self, task: Task) -> bool:
+        return task.distributed and self.work_queue is not None
+
+    def _claim(self, task: Task) -> List[_Unit]:
+        """
+        Claim a pool's worth of a distributed task's items from the work queue.
+        """
+        positions = []
+        while not positions:
+            restored = []
+            for key in self.work_queue.claim(task.name, limit=self.processes * task.chunk_size):
+                position = task.positions.get(key)
+                if position is None:
+                    logger.warning(f"Task '{task.name}' has no item with key '{key}', another instance registered "
+                                   f"different items. Leaving the unit to expire.")
+                elif position in task.results:
+                    # Completed by an earlier, interrupted run of this instance.
+                    restored.append(key)
+                else:
+                    positions.append(position)
+            if not restored:
+                break
+            # Claim again straight away, rather than leave the task waiting for a poll with nothing to run.
+            self.work_queue.complete(task.name, restored)
+
+        units = []
+        for start in range(0, len(positions), task.chunk_size):
+            units.append(_Unit(task, task.claimed_units, positions[start:start + task.chunk_size]))
+            task.claimed_units += 1
+        return units
+
+    def _units(self, task: Task) -> List[_Unit]:
+        if not task.is_map:
+            return [] if 0 in task.results else [_Unit(task, 0, None)]
+        positions = [position for position in range(len(task.items)) if position not in task.results]
+        return [_Unit(task, index, positions[start:start + task.chunk_size])
+                for index, start in enumerate(range(0, len(positions), task.chunk_size))]
+
+    def _dependency_results(self, task: Task) -> Dict[str, Any]:
+        return {dependency: self._result(self.tasks[dependency]) for dependency in task.depends_on}
+
+    def _result(self, task: Task) -> Any:
+        if not task.is_map:
+            return task.results.get(0)
+        if self._is_distributed(task):
+            return [task.results[position] for position in sorted(task.results)]
+        return [task.results[position] for position in range(len(task.items))]
+
+    def run(self, timeout: Optional[float] = None) -> Iterator[TaskResult]:
+        """
+        Run every registered task.
+        Args:
+            timeout: The most seconds the run may take. Tasks unfinished at the deadline are yielded as failed and
+                     timed_out is set. Units still running are abandoned, so a shared pool should be terminated.
+                     A unit whose worker dies fails, and is retried if its task has retries left. lost_units is then
+                     set, and a shared pool should be terminated as well.
+
+        Returns: An iterator of TaskResults in completion order. A task whose dependency failed is yielded as failed
+                 without running.
+
+        """
+        logger_queue = self.logger_queue if self.logger_queue is not None else log.globals.logger_queue
+        events: 'queue.Queue[Tuple[int, bool, Any, Optional[Dict[str, Any]], Optional[UnitUsage]]]' = queue.Queue()
+        # The units running on the pool, by the token they were dispatched under.
+        in_flight: Dict[int, _Unit] = {}
+        next_token = 0
+        profile = self.profiler.worker_settings if self.profiler is not None else None
+        ready: Deque[_Unit] = deque()
+        dependents: Dict[str, List[Task]] = {name: [] for name in self.tasks}
+        for task in self.tasks.values():
+            for dependency in task.depends_on:
+                dependents[dependency].append(task)
+
+        used_cpus = 0
+        used_memory_mb = 0
+        unfinished = len(self.tasks)
+        # Distributed tasks waiting for units other instances hold.
+        polling: List[Task] = []
+        last_poll = time.monotonic()
+        deadline = time.monotonic() + timeout if timeout else None
+        self.timed_out = False
+        self.lost_units = 0
+
+        def fits(task: Task) -> bool:
+            if used_cpus == 0:
+                return True
+            if used_cpus + task.cpus > (min(self.sizer.workers, self.processes) if self.sizer is not None
+                                        else self.processes):
+                return False
+            return not (task.memory_mb and self.memory_limit_mb and
+                        used_memory_mb + task.memory_mb > self.memory_limit_mb)
+
+        def start(task: Task) -> List[TaskResult]:
+            task.state = 'running'
+            task.start_time = time.monotonic()
+            self._restore(task)
+            if self._is_distributed(task):
+                self.work_queue.add(task.name, task.positions)
+                restored = [key for key, position in task.positions.items() if position in task.results]
+                if restored:
+                    # Completed by an earlier, interrupted run of this instance, so claims only return units to run.
+                    self.work_queue.complete(task.name, restored)
+                logger.info(f"Task '{task.name}' started on the work queue with {len(task.items)} unit(s).")
+                return claim(task)
+            units = self._units(task)
+            task.remaining_units = len(units)
+            if task.results:
+                logger.info(f"Task '{task.name}' resumed from checkpoint with {len(units)} unit(s) remaining.")
+            else:
+                logger.info(f"Task '{task.name}' started with {len(units)} unit(s).")
+            if not units:
+                return finish(task)
+            ready.extend(units)
+            return []
+
+        def claim(task: Task) -> List[TaskResult]:
+            # Claim more units of a distributed task, and finish it once every unit is done by some instance.
+            units = self._claim(task)
+            if units:
+                task.remaining_units += len(units)
+                ready.extend(units)
+            if task in polling:
+                polling.remove(task)
+            if task.remaining_units > 0:
+                return []
+            counts = self.work_queue.counts(task.name)
+            if counts['pending'] or counts['leased']:
+                polling.append(task)
+                return []
+            logger.info(f"Task '{task.name}' is done on every instance. {self.work_queue.progress(task.name)}")
+            return finish(task)
+
+        def finish(task: Task, error: Optional[str] = None) -> List[TaskResult]:
+            nonlocal unfinished
+            unfinished -= 1
+            elapsed = time.monotonic() - task.start_time if task.start_time else 0.0
+            if error is None:
+                task.state = 'done'
+                logger.info(f"Task '{task.name}' completed in {elapsed:.3f}s.")
+                finished = [TaskResult(task.name, result=self._result(task), attempts=task.attempts, elapsed=elapsed)]
+                for dependent in dependents[task.name]:
+                    if dependent.state == 'waiting' and \
+                            all(self.tasks[x].state == 'done' for x in dependent.depends_on):
+                        finished.extend(start(dependent))
+                return finished
+
+            task.state = 'failed'
+            if self._is_distributed(task):
+                if task in polling:
+                    polling.remove(task)
+                # Let other instances claim the units this instance won't process.
+                self.work_queue.release(task.name)
+            logger.error(f"Task '{task.name}' failed after {task.attempts} attempt(s).\n{error}")
+            finished = [TaskResult(task.name, error=error, attempts=task.attempts, elapsed=elapsed)]
+            for dependent in dependents[task.name]:
+                if dependent.state == 'waiting':
+                    finished.extend(finish(dependent, error=f"Dependency '{task.name}' failed."))
+            return finished
+
+        def complete(unit: _Unit, ok: bool, value: Any, unit_profile: Optional[Dict[str, Any]],
+                     usage: Optional[UnitUsage]) -> List[TaskResult]:
+            nonlocal used_cpus, used_memory_mb
+            task = unit.task
+            used_cpus -= task.cpus
+            used_memory_mb -= task.memory_mb or 0
+            if unit_profile is not None:
+                self.profiler.add(task.name, unit_profile)
+            if self.sizer is not None:
+                self.sizer.observe(usage)
+
+            # A unit of a task which has already failed.
+            if task.state != 'running':
+                return []
+
+            if ok:
+                self._record(unit, value)
+                task.remaining_units -= 1
+                if self._is_distributed(task):
+                    self.work_queue.complete(task.name, [task.checkpoint_key(x) for x in unit.items])
+                    # Claim the next units while the last ones run, so the workers don't idle.
+                    if task.remaining_units < self.processes:
+                        return claim(task)
+                elif task.remaining_units == 0:
+                    return finish(task)
+                return []
+            if unit.attempt <= task.retries:
+                logger.warning(f"Task '{task.name}' unit {unit.index} failed on attempt {unit.attempt}, "
+                               f"retrying.\n{value}")
+                ready.appendleft(unit)
+                return []
+            return finish(task, error=value)
+
+        if self.pool is not None:
+            pool = self.pool.pool
+            started_queue = self.pool.started_queue
+        else:
+            started_queue = mp.SimpleQueue()
+            pool = mp.Pool(processes=self.processes, initializer=_init_engine_worker,
+                           initargs=(logger_queue, started_queue))
+        watch = _WorkerWatch(pool, started_queue)
+        completed = False
+        try:
+            for task in self.tasks.values():
+                if not task.depends_on:
+                    yield from start(task)
+
+            while unfinished:
+                # Dispatch ready units, in registration order, while their resources are free.
+                while ready and fits(ready[0].task):
+                    unit = ready.popleft()
+                    if unit.task.state != 'running':
+                        continue
+                    unit.attempt += 1
+                    unit.task.attempts += 1
+                    used_cpus += unit.task.cpus
+                    used_memory_mb += unit.task.memory_mb or 0
+                    in_flight[next_token] = unit
+                    pool.apply_async(_run_unit,
+                                     args=(next_token, unit.task.func, unit.items,
+                                           self._dependency_results(unit.task), profile, self.sizer is not None),
+                                     callback=lambda value, t=next_token: events.put((t, *value)),
+                                     error_callback=lambda e, t=next_token: events.put((t, False, repr(e), None, None)))
+                    next_token += 1
+
+                now = time.monotonic()
+                wait = WORKER_CHECK_INTERVAL
+                if deadline is not None:
+                    wait = min(wait, max(0.0, deadline - now))
+                if polling:
+                    wait = min(wait, max(0.0, last_poll + self.work_queue.poll_interval - now))
+                try:
+                    token, ok, value, unit_profile, usage = events.get(timeout=wait)
+                    unit = in_flight.pop(token, None)
+                    # None for the unit of a worker which was found dead, and already failed or retried.
+                    if unit is not None:
+                        yield from complete(unit, ok, value, unit_profile, usage)
+                except queue.Empty:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        self.timed_out = True
+                        logger.error(f"Run deadline of {timeout}s exceeded, failing the unfinished tasks.")
+                        for task in self.tasks.values():
+                            if task.state in ['waiting', 'running']:
+                                yield from finish(task, error=f"Run deadline of {timeout}s exceeded.")
+                        break
+
+                if polling and time.monotonic() >= last_poll + self.work_queue.poll_interval:
+                    last_poll = time.monotonic()
+                    for task in list(polling):
+                        yield from claim(task)
+
+                for token, pid, exitcode in watch.lost():
+                    unit = in_flight.pop(token, None)
+                    if unit is not None:
+                        self.lost_units += 1
+                        error = f"Worker {pid} died while running the unit (exit code {exitcode})."
+                        logger.error(f"Task '{unit.task.name}' unit {unit.index}: {error}")
+                        yield from complete(unit, False, error, None, None)
+            completed = not self.timed_out and not self.lost_units
+        finally:
+            # A shared pool outlives the engine.
+            if self.pool is None:
+                if completed:
+                    pool.close()
+                else:
+                    pool.terminate()
+                pool.join()
@@ -30,19 +30,25 @@ SCRIPT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" &> /dev/null && pwd )"
 
 ### Download the logs from the VM ###
 
-# Zip the logs folder
+# Record what changed in the logs folder since the last download, and zip only that
 gcloud compute ssh "$VM_USERNAME"@"$COMPUTE_INSTANCE_NAME" --zone="$ZONE" \
---command="cd /home/$VM_USERNAME/$REPOSITORY_NAME/log/logs && zip -r /home/$VM_USERNAME/logs.zip ./" \
-|| { echo "ERROR: Failed to zip the logs folder. May not exist... If issue persists, try SSH into VM to inspect."; return 1; }
+--command="cd /home/$VM_USERNAME/$REPOSITORY_NAME && python -m log.shipping ship log/logs --bundle /home/$VM_USERNAME/log_bundle && cd /home/$VM_USERNAME/log_bundle && zip -r /home/$VM_USERNAME/log_bundle.zip ./" \
+|| { echo "ERROR: Failed to bundle the logs folder. May not exist... If issue persists, try SSH into VM to inspect."; return 1; }
 
-# Download the zipped folder from the VM into the hook/logs directory
-gcloud compute scp "$COMPUTE_INSTANCE_NAME":/home/"$VM_USERNAME"/logs.zip "$SCRIPT_DIR"/../../log/logs/vm_logs.zip --zone="$ZONE" \
-|| { echo "ERROR: Failed to copy the logs.zip file off the VM"; return 1; }
+# Download the zipped bundle from the VM
+gcloud compute scp "$COMPUTE_INSTANCE_NAME":/home/"$VM_USERNAME"/log_bundle.zip "$SCRIPT_DIR"/../../log/logs/vm_log_bundle.zip --zone="$ZONE" \
+|| { echo "ERROR: Failed to copy the log_bundle.zip file off the VM"; return 1; }
 
-# Delete the zipped folder on the VM
+# Apply the bundle to the copy of the VM's logs in log/logs/vm_logs
+unzip -o -q "$SCRIPT_DIR"/../../log/logs/vm_log_bundle.zip -d "$SCRIPT_DIR"/../../log/logs/vm_log_bundle \
+&& (cd "$SCRIPT_DIR"/../.. && python -m log.shipping apply log/logs/vm_log_bundle log/logs/vm_logs --remove) \
+&& rm "$SCRIPT_DIR"/../../log/logs/vm_log_bundle.zip \
+|| { echo "ERROR: Failed to apply the log bundle. Delete ~/.cache/scheduled-vm/log_shipping.json on the VM to download everything again."; return 1; }
+
+# Delete the bundle on the VM once it has been applied, later downloads only hold newer changes
 gcloud compute ssh "$VM_USERNAME"@"$COMPUTE_INSTANCE_NAME" --zone="$ZONE" \
---command="rm /home/$VM_USERNAME/logs.zip" \
-|| { echo "ERROR: Failed to delete the logs.zip folder on the VM"; return 1; }
+--command="rm -r /home/$VM_USERNAME/log_bundle /home/$VM_USERNAME/log_bundle.zip" \
+|| { echo "ERROR: Failed to delete the log bundle on the VM"; return 1; }
 
 # Shut down the VM
 . ./common/stop_vm.sh  || { echo "Failed to stop VM. Check your maintenance.config file."; return 1; }
\ No newline at end of file
@@ -0,0 +1,254 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import math
+import time
+
+from collections import deque
+from dataclasses import dataclass
+
+from typing import Deque, Optional
+
+import multiprocessing as mp
+
+from configparser import ConfigParser
+from configurations.settings import PoolSettings
+
+from log.log_setup import get_logger
+
+logger = get_logger(__name__)
+
+PROC = '/proc'
+
+
+@dataclass
+class UnitUsage:
+    """
+    What a unit of work used in its worker: the peak RSS of the worker while it ran, and its CPU and wall time.
+    """
+    peak_rss_bytes: Optional[int]
+    cpu_seconds: float
+    wall_seconds: float
+
+    @property
+    def cpu_fraction(self) -> float:
+        # Below 1 for units waiting on I/O, above 1 for units running threads on several cores.
+        return self.cpu_seconds / self.wall_seconds if self.wall_seconds > 0 else 1.0
+
+
+def _reset_peak_rss() -> None:
+    # Writing 5 to clear_refs resets the peak RSS (VmHWM) of the process. Without it, VmHWM is the worker's lifetime
+    # peak, which only overestimates a unit's memory.
+    try:
+        with open(f'{PROC}/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _read_peak_rss_bytes() -> Optional[int]:
+    try:
+        with open(f'{PROC}/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class UsageMeter:
+    """
+    Measures a unit of work in its worker.
+
+    e.g.
+    with UsageMeter() as meter:
+        run_unit()
+    usage = meter.usage
+    """
+
+    def __init__(self):
+        self.usage: Optional[UnitUsage] = None
+        self._started = (0.0, 0.0)
+
+    def __enter__(self) -> 'UsageMeter':
+        _reset_peak_rss()
+        self._started = (time.monotonic(), time.process_time())
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        wall, cpu = self._started
+        self.usage = UnitUsage(peak_rss_bytes=_read_peak_rss_bytes(), cpu_seconds=time.process_time() - cpu,
+                               wall_seconds=time.monotonic() - wall)
+
+
+def _read_available_memory_bytes() -> Optional[int]:
+    try:
+        with open(f'{PROC}/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _read_swapped_out_pages() -> Optional[int]:
+    try:
+        with open(f'{PROC}/vmstat', 'r') as f:
+            for line in f:
+                if line.startswith('pswpout '):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class PoolSizer:
+    """
+    Sets how many pool workers take units at once, so a run gets the most throughput out of the machine without
+    tipping it into swap. The pool is started with max_workers workers, and the JobEngine dispatches units to the
+    number of workers chosen here.
+
+    After a warm-up of warmup_units units at the initial size, min_workers unless given, the sizer decides every
+    interval seconds from the units measured recently:
+    - CPU: enough workers to keep target_cpu of the cores busy, given the CPU time units use per second. I/O bound
+      units get more workers than cores.
+    - Memory: no more workers than fit in the available memory above reserve_mb, given the peak RSS of a worker.
+    - Swap: one worker fewer whenever the machine swapped out pages since the last decision.
+    The number of workers is kept within min_workers and max_workers, and every change is logged.
+    """
+
+    def __init__(self, min_workers: int, max_workers: int, initial_workers: Optional[int] = None,
+                 warmup_units: int = 8, target_cpu: float = 0.9, reserve_mb: int = 512, interval: float = 5.0,
+                 window: int = 50, cpu_count: Optional[int] = None):
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.cpu_count = cpu_count or mp.cpu_count()
+        # Start small, the memory units need is unknown until they are measured.
+        initial = initial_workers if initial_workers is not None else self.min_workers
+        self.workers = min(max(initial, self.min_workers), self.max_workers)
+        self.warmup_units = warmup_units
+        self.target_cpu = target_cpu
+        self.reserve_bytes = reserve_mb * 1024 * 1024
+        self.interval = interval
+
+        self.units = 0
+        self.recent: Deque[UnitUsage] = deque(maxlen=window)
+        self.decisions = 0
+        self._last_decision = time.monotonic()
+        self._swapped_out = _read_swapped_out_pages()
+
+    def observe(self, usage: Optional[UnitUsage]) -> None:
+        """
+        Add the usage of a completed unit, and resize once the warm-up is over and the interval has passed.
+        """
+        if usage is None:
+            return
+        self.units += 1
+        self.recent.append(usage)
+        if self.units >= self.warmup_units and time.monotonic() - self._last_decision >= self.interval:
+            self.resize()
+
+    def _cpu_limit(self) -> int:
+        cpu_fraction = sum(x.cpu_fraction for x in self.recent) / len(self.recent)
+        return math.ceil(self.cpu_count * self.target_cpu / max(cpu_fraction, 0.01))
+
+    def _memory_limit(self, peak_rss: int, available: int) -> int:
+        # Workers taking units already hold their memory, and idle ones hold less than a unit's peak.
+        return self.workers + math.floor((available - self.reserve_bytes) / peak_rss)
+
+    def resize(self) -> int:
+        """
+        Choose the number of workers from the recent units.
+        Returns: The number of workers.
+        """
+        self._last_decision = time.monotonic()
+        if not self.recent:
+            return self.workers
+
+        target = self._cpu_limit()
+        reasons = [f'CPU {100 * sum(x.cpu_fraction for x in self.recent) / len(self.recent):.0f}% per unit']
+
+        rss = [x.peak_rss_bytes for x in self.recent if x.peak_rss_bytes]
+        available = _read_available_memory_bytes()
+        if rss and available is not None:
+            peak_rss = max(rss)
+            target = min(target, self._memory_limit(peak_rss, available))
+            reasons.append(f'peak RSS {peak_rss / 2 ** 20:.0f} MB per worker, '
+                           f'{available / 2 ** 20:.0f} MB available')
+
+        swapped_out = _read_swapped_out_pages()
+        if swapped_out is not None and self._swapped_out is not None and swapped_out > self._swapped_out:
+            target = min(target, self.workers - 1)
+            reasons.append(f'{swapped_out - self._swapped_out} page(s) swapped out')
+        self._swapped_out = swapped_out
+
+        target = min(max(target, self.min_workers), self.max_workers)
+        if target != self.workers:
+            self.decisions += 1
+            logger.info(f"Pool sizer: {self.workers} -> {target} active workers ({', '.join(reasons)}).")
+            self.workers = target
+        return self.workers
+
+
+def get_pool_sizer(config: ConfigParser) -> Optional[PoolSizer]:
+    """
+    This function creates the pool sizer described by the [Pool] section of the config.
+    Args:
+        config: A ConfigParser containing the configuration.
+
+    Returns: A PoolSizer, or None if adaptive sizing is disabled.
+
+    """
+    settings = PoolSettings.from_config(config)
+    if not settings.adaptive:
+        return None
+    return PoolSizer(min_workers=settings.min_processes, max_workers=max_pool_processes(settings),
+                     initial_workers=settings.processes or None, warmup_units=settings.warmup_units,
+                     target_cpu=settings.target_cpu, reserve_mb=settings.memory_reserve_mb,
+                     interval=settings.sizing_interval)
+
+
+def max_pool_processes(settings: PoolSettings) -> int:
+    """
+    This function gets the number of workers to start the pool with when it is sized adaptively. Every worker holds
+    memory even while idle, so no more are started than fit in the available memory above memory_reserve_mb, at
+    worker_memory_mb each.
+    Args:
+        settings: The [Pool] settings.
+
+    Returns: max_processes, or twice the number of CPUs if it is 0, capped by the available memory and at least
+             min_processes.
+
+    """
+    processes = settings.max_processes or 2 * mp.cpu_count()
+    available = _read_available_memory_bytes()
+    if available is not None:
+        fit = (available - settings.memory_reserve_mb * 2 ** 20) // (settings.worker_memory_mb * 2 ** 20)
+        if fit < processes:
+            processes = max(int(fit), settings.min_processes)
+            logger.info(f"Pool sizer: starting {processes} workers, as many as fit in {available / 2 ** 20:.0f} MB "
+                        f"available at {settings.worker_memory_mb} MB each.")
+    return processes
@@ -0,0 +1,202 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import io
+import os
+import pstats
+import cProfile
+import tracemalloc
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from configparser import ConfigParser
+from configurations.settings import LoggerSettings, ProfilingSettings
+
+from log.log_setup import get_logger
+
+logger = get_logger(__name__)
+
+PROFILE_ENV_VAR = 'SCHEDULED_VM_PROFILE'
+
+
+class WorkerProfiler:
+    """
+    Profiles a unit of work inside a pool worker with cProfile and, optionally, tracemalloc. The payload is plain data
+    so that it can be returned to the main process alongside the unit's result.
+    """
+
+    def __init__(self, trace_memory: bool = False, top_n: int = 30):
+        self.trace_memory = trace_memory
+        self.top_n = top_n
+        self.profiler = cProfile.Profile()
+        self._started_tracing = False
+
+    def runcall(self, func: Callable[[], Any]) -> Any:
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        return self.profiler.runcall(func)
+
+    def payload(self) -> Dict[str, Any]:
+        """
+        Collect the unit's profile. Must be called once, after runcall().
+        Returns: A dict with the cProfile stats, the worker pid and, if tracing memory, the traced peak and the top
+                 allocation sites as (location, size, count).
+
+        """
+        self.profiler.create_stats()
+        payload = {'pid': os.getpid(), 'stats': self.profiler.stats}
+        if self._started_tracing:
+            snapshot = tracemalloc.take_snapshot()
+            payload['memory_peak'] = tracemalloc.get_traced_memory()[1]
+            payload['memory'] = [(str(stat.traceback), stat.size, stat.count)
+                                 for stat in snapshot.statistics('lineno')[:self.top_n]]
+            tracemalloc.stop()
+        return payload
+
+
+class _StatsHolder:
+    """
+    Lets pstats.Stats load a stats dict shipped from a worker, as it would a Profile object.
+    """
+
+    def __init__(self, stats: Dict):
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+class ProfileCollector:
+    """
+    Merges the profiles returned by pool workers into one profile per run, and writes it, with a report of the
+    hottest functions and allocation sites, to the log directory.
+    """
+
+    def __init__(self, output_dir: str, trace_memory: bool = False, top_n: int = 30):
+        """
+        Args:
+            output_dir: The directory the merged profile and report are written to.
+            trace_memory: Whether workers also trace allocations with tracemalloc.
+            top_n: The number of functions and allocation sites in the report.
+        """
+        self.output_dir = output_dir
+        self.trace_memory = trace_memory
+        self.top_n = top_n
+
+        self.stats: Optional[pstats.Stats] = None
+        self.pids = set()
+        # Units, profiled seconds and peak traced memory by task.
+        self.tasks: Dict[str, List[float]] = {}
+        self.memory: Dict[str, List[int]] = {}
+
+    @property
+    def worker_settings(self) -> Tuple[bool, int]:
+        """
+        The arguments of the WorkerProfiler each unit creates in its worker, since profilers can't be pickled.
+        """
+        return self.trace_memory, self.top_n
+
+    def add(self, task_name: str, payload: Dict[str, Any]) -> None:
+        """
+        Merge a unit's profile.
+        Args:
+            task_name: The task the unit belongs to.
+            payload: The payload from WorkerProfiler.payload().
+
+        Returns:
+
+        """
+        unit_stats = pstats.Stats(_StatsHolder(payload['stats']))
+        if self.stats is None:
+            self.stats = unit_stats
+        else:
+            self.stats.add(unit_stats)
+        self.pids.add(payload['pid'])
+
+        task = self.tasks.setdefault(task_name, [0, 0.0, 0])
+        task[0] += 1
+        task[1] += unit_stats.total_tt
+        if 'memory_peak' in payload:
+            task[2] = max(task[2], payload['memory_peak'])
+            for location, size, count in payload['memory']:
+                site = self.memory.setdefault(location, [0, 0])
+                site[0] += size
+                site[1] += count
+
+    def write(self) -> Optional[Tuple[str, str]]:
+        """
+        Write the merged profile, which can be loaded with pstats or snakeviz, and the top-N report.
+        Returns: The paths of the profile and the report, or None if nothing was profiled.
+
+        """
+        if self.stats is None:
+            return None
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        profile_path = os.path.join(self.output_dir, 'profile.prof')
+        report_path = os.path.join(self.output_dir, 'profile_report.txt')
+        self.stats.dump_stats(profile_path)
+
+        report = io.StringIO()
+        units = sum(x[0] for x in self.tasks.values())
+        report.write(f"Profiled {units} unit(s) across {len(self.pids)} worker(s).\n\n")
+        report.write(f"{'task':<40}{'units':>8}{'seconds':>12}{'peak MB':>10}\n")
+        for name, (units, seconds, peak) in sorted(self.tasks.items(), key=lambda x: -x[1][1]):
+            peak_mb = f'{peak / (1024 * 1024):.1f}' if self.trace_memory else '-'
+            report.write(f"{name:<40}{units:>8}{seconds:>12.3f}{peak_mb:>10}\n")
+
+        for sort_key in ['cumulative', 'tottime']:
+            report.write(f"\n==== Top {self.top_n} functions by {sort_key} time ====\n")
+            self.stats.stream = report
+            self.stats.sort_stats(sort_key).print_stats(self.top_n)
+
+        if self.memory:
+            report.write(f"\n==== Top {self.top_n} allocation sites still held at the end of a unit ====\n")
+            sites = sorted(self.memory.items(), key=lambda x: -x[1][0])[:self.top_n]
+            for location, (size, count) in sites:
+                report.write(f"{size / 1024:>12.1f} KiB {count:>10} blocks  {location}\n")
+
+        with open(report_path, 'w') as f:
+            f.write(report.getvalue())
+        logger.info(f"Merged worker profile written to {profile_path}, report in {report_path}")
+        return profile_path, report_path
+
+
+def get_profile_collector(config: ConfigParser) -> Optional[ProfileCollector]:
+    """
+    This function creates a ProfileCollector if profiling is turned on, either with [Profiling] enabled in the config
+    or with the SCHEDULED_VM_PROFILE environment variable. SCHEDULED_VM_PROFILE=memory also traces allocations.
+    Args:
+        config: A ConfigParser containing the configuration.
+
+    Returns: A ProfileCollector writing to the log directory, or None if profiling is off.
+
+    """
+    env = os.environ.get(PROFILE_ENV_VAR, '').strip().lower()
+    settings = ProfilingSettings.from_config(config)
+    if not settings.enabled and env in ['', '0', 'false', 'no']:
+        return None
+    return ProfileCollector(output_dir=LoggerSettings.from_config(config).log_dir,
+                            trace_memory=settings.trace_memory or env == 'memory', top_n=settings.top_n)
@@ -0,0 +1,283 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from configparser import ConfigParser
+from configurations.settings import ResultSettings
+
+from log.log_setup import get_logger
+
+logger = get_logger(__name__)
+
+MANIFEST = 'manifest.json'
+SHARD_DIR = 'shards'
+NAME_REGEX = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+
+def _check_name(kind: str, name: str) -> None:
+    if not NAME_REGEX.match(name) or name.startswith('.'):
+        raise ValueError(f"Invalid {kind} '{name}'. Use letters, digits, '_', '-' and '.', not starting with '.'.")
+
+
+def _write_json(path: str, data: Dict[str, Any]) -> None:
+    # Replace atomically so readers never see a half written file.
+    with open(f'{path}.{uuid.uuid4().hex}.tmp', 'w') as f:
+        json.dump(data, f, indent=2)
+        temp = f.name
+    os.replace(temp, path)
+
+
+class ShardWriter:
+    """
+    Buffers appended rows and writes them to a ResultSink in shards of about chunk_rows rows, keyed
+    '{key_prefix}-000000', '{key_prefix}-000001' and so on. Use it as a context manager so the last shard is written.
+    """
+
+    def __init__(self, sink: 'ResultSink', key_prefix: str, chunk_rows: int):
+        self.sink = sink
+        self.key_prefix = key_prefix
+        self.chunk_rows = chunk_rows
+
+        self.buffer: Dict[str, List[np.ndarray]] = {}
+        self.buffer_rows = 0
+        self.shards = 0
+
+    def append(self, columns: Dict[str, np.ndarray]) -> None:
+        """
+        Append rows, writing a shard once chunk_rows rows are buffered.
+        Args:
+            columns: Arrays of the same length, by column name.
+
+        Returns:
+
+        """
+        rows = _row_count(columns)
+        for name, array in columns.items():
+            self.buffer.setdefault(name, []).append(np.asarray(array))
+        self.buffer_rows += rows
+        if self.buffer_rows >= self.chunk_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.buffer_rows:
+            return
+        columns = {name: np.concatenate(arrays) for name, arrays in self.buffer.items()}
+        self.buffer, self.buffer_rows = {}, 0
+        self.sink.write(f'{self.key_prefix}-{self.shards:06d}', columns)
+        self.shards += 1
+
+    def __enter__(self) -> 'ShardWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            self.flush()
+
+
+def _row_count(columns: Dict[str, np.ndarray]) -> int:
+    lengths = {name: len(array) for name, array in columns.items()}
+    if not lengths:
+        raise ValueError("A shard needs at least one column.")
+    if len(set(lengths.values())) > 1:
+        raise ValueError(f"Columns must have the same number of rows. Found {lengths}.")
+    return next(iter(lengths.values()))
+
+
+class ResultSink:
+    """
+    A directory of columnar results which pool workers write to directly, instead of returning them through the pool.
+    Each shard is a set of .npy files, one per column, and a JSON file listing them which is written last. Readers
+    only see complete shards, so results can be read while the run is still going. The main process writes the
+    manifest once the run ends.
+
+    Shards are named by key. A key that is stable across runs, e.g. the first item of a unit, makes a rerun of the unit
+    replace its shard rather than add another. The shards of an interrupted run are kept for the next run to complete,
+    and cleared once a run has completed.
+
+    The sink is cheap to pickle, so pass it to tasks like any other parameter.
+
+    e.g.
+    sink = ResultSink('results/scores')
+    engine.add_task('score', score_rows, items=[(sink, start) for start in range(0, n, 10000)])
+    ...
+    sink.finalize(complete=True)
+
+    def score_rows(item: Tuple[ResultSink, int]):
+        sink, start = item
+        sink.write(f'{start:012d}', {'id': ids, 'score': scores})
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: The directory of the sink. If the run that last wrote it completed, its results are cleared.
+        """
+        self.path = path
+        manifest = self.manifest()
+        if manifest is not None and manifest['status'] == 'complete':
+            shutil.rmtree(path)
+        os.makedirs(os.path.join(path, SHARD_DIR), exist_ok=True)
+
+    def write(self, key: str, columns: Dict[str, np.ndarray]) -> int:
+        """
+        Write a shard, replacing any earlier shard with the same key.
+        Args:
+            key: The name of the shard. Shards are read in key order.
+            columns: Arrays of the same length, by column name. Object arrays aren't supported.
+
+        Returns: The number of rows written.
+
+        """
+        _check_name('shard key', key)
+        rows = _row_count(columns)
+        shard_dir = os.path.join(self.path, SHARD_DIR)
+        token = uuid.uuid4().hex[:12]
+        files = {}
+        for name, array in columns.items():
+            _check_name('column name', name)
+            array = np.asarray(array)
+            if array.dtype.hasobject:
+                raise ValueError(f"Column '{name}' holds Python objects, use a numeric or fixed size dtype.")
+            file_name = f'{key}.{token}.{name}.npy'
+            np.save(os.path.join(shard_dir, file_name), array, allow_pickle=False)
+            files[name] = {'file': file_name, 'dtype': array.dtype.str, 'shape': list(array.shape[1:])}
+
+        meta_path = os.path.join(shard_dir, f'{key}.json')
+        previous = self._read_shard(meta_path)
+        _write_json(meta_path, {'key': key, 'rows': rows, 'columns': files, 'pid': os.getpid(),
+                                'written': time.time()})
+        # Remove the files of the shard this one replaced.
+        if previous is not None:
+            for column in previous['columns'].values():
+                try:
+                    os.remove(os.path.join(shard_dir, column['file']))
+                except OSError:
+                    pass
+        return rows
+
+    def writer(self, key_prefix: str, chunk_rows: int = 100000) -> ShardWriter:
+        """
+        Create a writer which buffers appended rows into shards of about chunk_rows rows, bounding memory by the
+        chunk size rather than the size of the results.
+        Args:
+            key_prefix: The prefix of the shard keys, stable across runs.
+            chunk_rows: The rows per shard.
+
+        Returns: A ShardWriter, to use as a context manager.
+
+        """
+        return ShardWriter(self, key_prefix=key_prefix, chunk_rows=chunk_rows)
+
+    @staticmethod
+    def _read_shard(meta_path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(meta_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def manifest(self) -> Optional[Dict[str, Any]]:
+        """
+        Read the manifest written by finalize().
+        Returns: The manifest, or None if the sink hasn't been finalised.
+
+        """
+        return self._read_shard(os.path.join(self.path, MANIFEST))
+
+    def shards(self) -> List[Dict[str, Any]]:
+        """
+        List the complete shards, in key order.
+        Returns: The metadata of each shard: its key, rows and column files.
+
+        """
+        shard_dir = os.path.join(self.path, SHARD_DIR)
+        if not os.path.isdir(shard_dir):
+            return []
+        shards = [self._read_shard(os.path.join(shard_dir, x)) for x in sorted(os.listdir(shard_dir))
+                  if x.endswith('.json')]
+        return [x for x in shards if x is not None]
+
+    def read(self, columns: Optional[Sequence[str]] = None) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        Read the complete shards, one at a time, as memory-mapped arrays.
+        Args:
+            columns: The columns to read. Defaults to every column.
+
+        Returns: An iterator of dicts of column name to array, in key order.
+
+        """
+        shard_dir = os.path.join(self.path, SHARD_DIR)
+        for shard in self.shards():
+            names = columns if columns is not None else list(shard['columns'])
+            try:
+                yield {name: np.load(os.path.join(shard_dir, shard['columns'][name]['file']), mmap_mode='r')
+                       for name in names}
+            except FileNotFoundError:
+                # Replaced by a rerun of its unit since it was listed.
+                continue
+
+    def finalize(self, complete: bool = True) -> Dict[str, Any]:
+        """
+        Write the manifest of the sink. Call it in the main process once no worker writes to the sink anymore.
+        Args:
+            complete: Whether every shard was written. An incomplete sink keeps its shards for the next run.
+
+        Returns: The manifest.
+
+        """
+        shards = self.shards()
+        columns: Dict[str, Dict[str, Any]] = {}
+        for shard in shards:
+            for name, column in shard['columns'].items():
+                columns.setdefault(name, {'dtype': column['dtype'], 'shape': column['shape']})
+        manifest = {'status': 'complete' if complete else 'incomplete', 'finalized': time.time(),
+                    'rows': sum(x['rows'] for x in shards), 'columns': columns, 'shards': shards}
+        _write_json(os.path.join(self.path, MANIFEST), manifest)
+        logger.info(f"Result sink '{self.path}' {manifest['status']}: {len(shards)} shards, {manifest['rows']} rows.")
+        return manifest
+
+
+def get_result_sink(config: ConfigParser, name: str) -> ResultSink:
+    """
+    This function opens a result sink in the directory given by the [Results] section of the config.
+    Args:
+        config: A ConfigParser containing the configuration.
+        name: The name of the sink, e.g. the task writing it.
+
+    Returns: The ResultSink.
+
+    """
+    _check_name('result sink name', name)
+    settings = ResultSettings.from_config(config)
+    return ResultSink(os.path.join(settings.directory, name))
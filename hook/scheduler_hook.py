@@ -22,23 +22,35 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-from functools import partial
+import asyncio
 
 from datetime import datetime
 
-from configparser import ConfigParser
-from configurations.config import get_config
+from typing import List, Optional
 
-from multiprocessing import Queue
+from configparser import ConfigParser
+from configurations.config import get_config, get_settings
+from configurations.settings import Settings
 
 import multiprocessing as mp
 
+from hook.job_engine import JobEngine
+from hook.async_engine import AsyncEngine
+from hook.checkpoint import CheckpointStore, get_checkpoint_store
+from hook.worker_pool import WorkerPool, get_worker_pool
+from hook.telemetry import ResourceSampler, get_resource_sampler
+from hook.profiling import ProfileCollector, get_profile_collector
+from hook.bootstrap import log_last_bootstrap
+from hook.shared_arrays import SharedArrayStore
+from hook.result_sink import ResultSink, get_result_sink
+from hook.work_queue import WorkQueue, get_work_queue
+from hook.pool_sizer import get_pool_sizer
+
 """
 Feel free to copy the code below into other files in your project to enable logging to log/logs.
 Remember to use logger.info('Your message') or logger.warning('Your warning').
 """
 from log.log_setup import get_logger, logger_init, LoggerManager
-import log.globals
 logger = get_logger(__name__)
 
 
@@ -46,13 +58,120 @@ class SchedulerHook:
 
     def __init__(self):
         self.config: ConfigParser = get_config()
-        self.logger_manager: LoggerManager = logger_init(self.config)
+        self.settings: Settings = get_settings()
+        self.logger_manager: LoggerManager = logger_init(self.config, settings=self.settings)
+        self.checkpoint: Optional[CheckpointStore] = get_checkpoint_store(self.config)
+        self.profiler: Optional[ProfileCollector] = get_profile_collector(self.config)
+        self.sampler: Optional[ResourceSampler] = get_resource_sampler(self.config)
+        self.work_queue: Optional[WorkQueue] = get_work_queue(self.config)
+        self.shared_arrays: Optional[SharedArrayStore] = None
+        self.result_sinks: List[ResultSink] = []
+        if self.sampler is not None:
+            self.sampler.start()
+
+    def result_sink(self, name: str) -> ResultSink:
+        """
+        This function opens a result sink under the [Results] directory, for tasks to write their outputs to directly
+        instead of returning them. Its manifest is written once the tasks have run.
+
+        e.g.
+        scores = self.result_sink('scores')
+        engine.add_task('score', score_rows, items=[(scores, start) for start in range(0, n, 10000)])
+        """
+        sink = get_result_sink(self.config, name)
+        self.result_sinks.append(sink)
+        return sink
 
     @staticmethod
-    def _test_process(string: str, queue: Queue) -> None:
-        multiprocessing_logger = get_logger(__name__, queue=queue)
+    def _test_process(string: str) -> None:
+        multiprocessing_logger = get_logger(__name__)
         multiprocessing_logger.info(string)
 
+    def register_tasks(self, engine: JobEngine) -> None:
+        """
+        This function registers the parallel tasks of the scheduled run with the job engine. Replace the example task
+        with your own. Tasks run on a process pool as soon as their dependencies complete.
+
+        e.g.
+        engine.add_task('load', load_data)
+        engine.add_task('score', score_row, items=range(1000), depends_on=['load'], chunk_size=50, retries=2)
+        engine.add_task('report', write_report, depends_on=['score'], memory_mb=2048)
+
+        Publish large numpy arrays to self.shared_arrays and pass the handles instead, so workers read them in place
+        rather than each task unpickling a copy.
+
+        e.g.
+        features = self.shared_arrays.publish(np.load('features.npy'))
+        engine.add_task('score', score_rows, items=[(features, start) for start in range(0, n, 10000)])
+
+        To run the hook on several VMs, enable [WorkQueue] and register the map tasks to split with distributed=True.
+        Each VM then processes the items it claims, so write the outputs to shared storage rather than returning them.
+
+        e.g.
+        engine.add_task('score', score_rows, items=range(0, n, 10000), distributed=True)
+        """
+        engine.add_task('test_process', self._test_process, items=['1', '2', '3', '4', '5'])
+
+    @staticmethod
+    async def _test_coroutine(string: str) -> None:
+        await asyncio.sleep(0.01)
+        logger.info(string)
+
+    def register_async_tasks(self, engine: AsyncEngine) -> None:
+        """
+        This function registers the coroutines of the scheduled run with the async engine, used instead of
+        register_tasks() when [Asyncio] enabled = true. Replace the example task with your own. Coroutines run on one
+        event loop in the main process, which suits I/O bound work such as API calls and bucket reads.
+
+        e.g.
+        engine.add_task('pages', fetch_page, items=urls, concurrency=10, timeout=30, retries=2)
+        engine.add_task('upload', upload_pages, depends_on=['pages'])
+        """
+        engine.add_task('test_coroutine', self._test_coroutine, items=['1', '2', '3', '4', '5'])
+
+    def _execute_async(self) -> bool:
+        engine = AsyncEngine(concurrency=self.settings.asyncio.concurrency,
+                             task_timeout=self.settings.asyncio.task_timeout or None, checkpoint=self.checkpoint)
+        self.register_async_tasks(engine)
+        all_ok = True
+        # Returns once the event loop is drained, so nothing logs after the logger terminates.
+        for result in engine.run(timeout=self.settings.deadlines.run_timeout or None):
+            logger.info(f"{result}")
+            all_ok = all_ok and result.ok
+        return all_ok
+
+    def _execute_pool(self) -> bool:
+        # Start the workers once for the whole run. Every parallel stage should reuse this pool.
+        worker_pool: WorkerPool = get_worker_pool(self.config)
+        all_ok = True
+        timed_out = True
+        try:
+            worker_pool.wait_ready(timeout=self.settings.deadlines.pool_ready_timeout or None)
+
+            # Removed once the workers stop, see register_tasks().
+            self.shared_arrays = SharedArrayStore()
+            engine = JobEngine(pool=worker_pool, checkpoint=self.checkpoint, profiler=self.profiler,
+                               chunk_size=self.settings.pool.chunk_size, work_queue=self.work_queue,
+                               sizer=get_pool_sizer(self.config))
+            self.register_tasks(engine)
+            for result in engine.run(timeout=self.settings.deadlines.run_timeout or None):
+                logger.info(f"{result}")
+                all_ok = all_ok and result.ok
+            # A pool which lost units with a dead worker can't be closed either, it would wait for them forever.
+            timed_out = engine.timed_out or engine.lost_units > 0
+        finally:
+            # Past the deadline or after an error, units may still be running. Stop them so the run can shut down.
+            if timed_out:
+                worker_pool.terminate()
+            else:
+                worker_pool.close()
+            if self.shared_arrays is not None:
+                self.shared_arrays.close()
+
+        if self.profiler is not None:
+            self.profiler.write()
+        return all_ok
+
     def execute(self) -> None:
         """
         This function gets called by a chron tab shortly after the virtual machine in GCP wakes up.
@@ -64,6 +183,7 @@ class SchedulerHook:
         """
         logger.info("Scheduled script started.")
         start_time: datetime = datetime.now()
+        log_last_bootstrap(self.settings.bootstrap.state_path, logger)
 
         logger.info("Hello World!")
         """
@@ -71,21 +191,41 @@ class SchedulerHook:
         logger.info("Hello World!")
         """
 
-        pool = mp.Pool(processes=mp.cpu_count())
-        pool.imap_unordered(func=partial(
-            self._test_process,
-            queue=log.globals.logger_queue,
-        ), iterable=['1', '2', '3', '4', '5'])
-        pool.close()
-        pool.join()
-
-        """
-        Example 2
-        from your_code import main
-        main()
-        """
-
-        self.logger_manager.terminate_logger()
+        all_ok = False
+        try:
+            if self.settings.asyncio.enabled:
+                all_ok = self._execute_async()
+            else:
+                all_ok = self._execute_pool()
+
+            """
+            Example 2
+            from your_code import main
+            main()
+            """
+        except Exception:
+            # Logged here, the logger is terminated before the exception propagates.
+            logger.exception("Scheduled script failed.")
+            raise
+        finally:
+            # An incomplete sink keeps its shards for the next run to complete.
+            for sink in self.result_sinks:
+                sink.finalize(complete=all_ok)
+
+            # Once every task has completed, the next scheduled run starts from scratch. Otherwise it resumes.
+            if self.checkpoint is not None:
+                if all_ok:
+                    self.checkpoint.clear()
+                self.checkpoint.close()
+
+            if self.work_queue is not None:
+                self.work_queue.close()
+
+            # Stop sampling while the logger is still running so the summary makes it into the logs.
+            if self.sampler is not None:
+                self.sampler.stop()
+
+            self.logger_manager.terminate_logger()
 
         end_time: datetime = datetime.now()
         elapsed_time = end_time - start_time
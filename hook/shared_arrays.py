@@ -0,0 +1,160 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import uuid
+import shutil
+import weakref
+import tempfile
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from log.log_setup import get_logger
+
+logger = get_logger(__name__)
+
+# The views a process has opened, by path and mode, so a worker maps each array once however many tasks use it.
+_views: Dict[Tuple[str, bool], np.ndarray] = {}
+
+
+def _default_directory() -> str:
+    # /dev/shm is memory backed on Linux, so the arrays never touch the disk.
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+class SharedArray:
+    """
+    A lightweight, picklable handle to a numpy array published by a SharedArrayStore. Pass it to pool tasks in place
+    of the array, and call view() in the worker to map the array without copying it.
+    """
+
+    def __init__(self, path: str, shape: Tuple[int, ...], dtype: np.dtype):
+        self.path = path
+        self.shape = shape
+        # The dtype object pickles with the fields of structured dtypes, which dtype.str would lose.
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape, dtype=np.int64)) * self.dtype.itemsize
+
+    def view(self, writable: bool = False) -> np.ndarray:
+        """
+        Map the array into this process. Mapping is cached, so calling this for every task is cheap.
+        Args:
+            writable: Whether writes to the view should be allowed. Writes are seen by every process.
+
+        Returns: A zero-copy view of the array.
+
+        """
+        key = (self.path, writable)
+        view = _views.get(key)
+        if view is None:
+            if self.nbytes == 0:
+                view = np.empty(self.shape, dtype=self.dtype)
+            else:
+                view = np.memmap(self.path, dtype=self.dtype, mode='r+' if writable else 'r', shape=self.shape)
+            _views[key] = view
+        return view
+
+    def __repr__(self):
+        return f'SharedArray(shape={self.shape}, dtype={self.dtype!r}, path={self.path!r})'
+
+
+def _remove(directory: str) -> None:
+    # Views already mapped stay valid once the files are removed, their memory is freed when they are closed.
+    shutil.rmtree(directory, ignore_errors=True)
+    for key in [x for x in _views if x[0].startswith(directory + os.sep)]:
+        del _views[key]
+
+
+class SharedArrayStore:
+    """
+    Publishes numpy arrays once into memory-mapped files, so pool workers read them in place instead of unpickling a
+    copy with every task. The files are removed when the store is closed, or when the process exits.
+
+    e.g.
+    with SharedArrayStore() as store:
+        features = store.publish(np.load('features.npy'))
+        engine.add_task('score', score_rows, items=[(features, start) for start in range(0, n, 10000)])
+        ...
+
+    def score_rows(item: Tuple[SharedArray, int]):
+        features, start = item
+        rows = features.view()[start:start + 10000]
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        """
+        Args:
+            directory: Where to create the files. Defaults to /dev/shm where available, otherwise the temp directory.
+        """
+        self.directory = tempfile.mkdtemp(prefix='scheduled-vm-arrays-', dir=directory or _default_directory())
+        self.arrays: List[SharedArray] = []
+        self._finalizer = weakref.finalize(self, _remove, self.directory)
+
+    def publish(self, array: np.ndarray, name: Optional[str] = None) -> SharedArray:
+        """
+        Copy an array into shared memory, once.
+        Args:
+            array: The array to publish. Object arrays can't be shared.
+            name: A name for the file, to recognise it while debugging.
+
+        Returns: The handle to pass to workers.
+
+        """
+        array = np.ascontiguousarray(array)
+        if array.dtype.hasobject:
+            raise ValueError("Arrays of Python objects can't be shared, use a numeric or fixed size dtype.")
+        path = os.path.join(self.directory, f'{name or "array"}-{uuid.uuid4().hex}.bin')
+        shared = SharedArray(path, shape=array.shape, dtype=array.dtype)
+        if array.nbytes:
+            target = np.memmap(path, dtype=array.dtype, mode='w+', shape=array.shape)
+            target[...] = array
+            target.flush()
+            del target
+        else:
+            open(path, 'wb').close()
+        self.arrays.append(shared)
+        logger.info(f"Published {shared}, {array.nbytes / (1024 * 1024):.1f}MB.")
+        return shared
+
+    def close(self) -> None:
+        """
+        Remove the published arrays. Workers must not map them again afterwards.
+        Returns:
+
+        """
+        self._finalizer()
+        self.arrays = []
+
+    def __enter__(self) -> 'SharedArrayStore':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
@@ -0,0 +1,328 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import time
+
+from threading import Thread, Event
+
+from typing import Dict, List, Optional, Tuple
+
+from configparser import ConfigParser
+from configurations.settings import LoggerSettings, TelemetrySettings
+
+import log.globals
+from log.log_setup import get_logger
+from log.transport import ShardTransport
+
+logger = get_logger(__name__)
+
+PROC = '/proc'
+
+
+def _read_cpu_times() -> Optional[List[Tuple[int, int]]]:
+    """
+    This function reads the (busy, total) jiffies of each core from /proc/stat.
+    Returns: A list of (busy, total) per core, or None if /proc/stat is unavailable.
+
+    """
+    try:
+        with open(f'{PROC}/stat', 'r') as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    times = []
+    for line in lines:
+        if not line.startswith('cpu') or line.startswith('cpu '):
+            continue
+        values = [int(x) for x in line.split()[1:]]
+        # idle and iowait are the 4th and 5th fields.
+        idle = values[3] + (values[4] if len(values) > 4 else 0)
+        total = sum(values[:8])
+        times.append((total - idle, total))
+    return times
+
+
+def _read_tree_rss_bytes(root_pid: int) -> Optional[int]:
+    """
+    This function sums the resident set size of a process and all of its descendants, which includes pool workers
+    whether they were started by the main process or by a fork server.
+    Args:
+        root_pid: The pid at the root of the process tree.
+
+    Returns: The summed RSS in bytes, or None if /proc is unavailable.
+
+    """
+    try:
+        pids = [int(x) for x in os.listdir(PROC) if x.isdigit()]
+    except OSError:
+        return None
+    children: Dict[int, List[int]] = {}
+    for pid in pids:
+        try:
+            with open(f'{PROC}/{pid}/stat', 'r') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The process name may contain spaces, so parse from the last parenthesis.
+        ppid = int(stat[stat.rfind(')') + 2:].split()[1])
+        children.setdefault(ppid, []).append(pid)
+
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    rss = 0
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        stack.extend(children.get(pid, []))
+        try:
+            with open(f'{PROC}/{pid}/statm', 'r') as f:
+                rss += int(f.read().split()[1]) * page_size
+        except OSError:
+            continue
+    return rss
+
+
+def _read_disk_bytes() -> Optional[Tuple[int, int]]:
+    """
+    This function reads the total bytes read and written by the whole disks of the machine from /proc/diskstats.
+    Returns: A Tuple of (read bytes, written bytes), or None if /proc/diskstats is unavailable.
+
+    """
+    try:
+        disks = set(os.listdir('/sys/block'))
+        with open(f'{PROC}/diskstats', 'r') as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    read = written = 0
+    for line in lines:
+        fields = line.split()
+        # Skip partitions, which would count their disk's I/O twice.
+        if len(fields) < 10 or fields[2] not in disks:
+            continue
+        read += int(fields[5]) * 512
+        written += int(fields[9]) * 512
+    return read, written
+
+
+def _queue_depth() -> Optional[int]:
+    queue = log.globals.logger_queue
+    # The shards transport has no queue.
+    if queue is None or isinstance(queue, ShardTransport):
+        return None
+    try:
+        return queue.qsize()
+    except (NotImplementedError, OSError, EOFError):
+        # multiprocessing.Queue.qsize() isn't implemented on macOS, and the Manager may already be shut down.
+        return None
+
+
+class _Stat:
+    """
+    Running count, mean and peak of a series, so that long runs don't keep every sample in memory.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.peak: Optional[float] = None
+
+    def add(self, value: Optional[float]) -> None:
+        if value is None:
+            return
+        self.count += 1
+        self.total += value
+        self.peak = value if self.peak is None else max(self.peak, value)
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+
+class ResourceSampler:
+    """
+    Samples CPU utilisation per core, RSS summed over the main process and its workers, disk I/O and logger queue
+    depth on a background thread. Samples are appended to a CSV time series, and stop() logs a summary to help choose
+    the machine type.
+    """
+
+    def __init__(self, path: str, interval: float = 1.0, idle_threshold: float = 0.1,
+                 root_pid: Optional[int] = None):
+        """
+        Args:
+            path: The CSV file to write samples to.
+            interval: The seconds between samples.
+            idle_threshold: The utilisation under which a core counts as idle.
+            root_pid: The process whose tree RSS is summed. Defaults to the current process.
+        """
+        self.path = path
+        self.interval = interval
+        self.idle_threshold = idle_threshold
+        self.root_pid = root_pid or os.getpid()
+
+        self.cpu = _Stat()
+        self.idle_cores = _Stat()
+        self.rss_mb = _Stat()
+        self.read_mb_s = _Stat()
+        self.write_mb_s = _Stat()
+        self.queue_depth = _Stat()
+        self.core_utilisation: List[_Stat] = []
+        self.disk_start: Optional[Tuple[int, int]] = None
+
+        self._cpu_times = _read_cpu_times()
+        self._disk_bytes = _read_disk_bytes()
+        self._sample_time = time.monotonic()
+
+        self._file = None
+        self._stop_event = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def start(self) -> 'ResourceSampler':
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._file = open(self.path, 'w', buffering=1)
+        cores = len(self._cpu_times) if self._cpu_times else 0
+        self._file.write(','.join(['time', 'rss_mb', 'read_mb_s', 'write_mb_s', 'queue_depth'] +
+                                  [f'cpu{i}' for i in range(cores)]) + '\n')
+        self.core_utilisation = [_Stat() for _ in range(cores)]
+        self.disk_start = self._disk_bytes
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def sample(self) -> None:
+        """
+        Take one sample and append it to the time series.
+        Returns:
+
+        """
+        now = time.monotonic()
+        elapsed = max(now - self._sample_time, 1e-9)
+        self._sample_time = now
+
+        utilisation: List[Optional[float]] = []
+        cpu_times = _read_cpu_times()
+        if cpu_times and self._cpu_times and len(cpu_times) == len(self._cpu_times):
+            for (busy, total), (previous_busy, previous_total) in zip(cpu_times, self._cpu_times):
+                utilisation.append((busy - previous_busy) / (total - previous_total) if total > previous_total
+                                   else 0.0)
+        self._cpu_times = cpu_times
+        if utilisation:
+            self.cpu.add(sum(utilisation) / len(utilisation))
+            self.idle_cores.add(sum(x < self.idle_threshold for x in utilisation) / len(utilisation))
+            for stat, value in zip(self.core_utilisation, utilisation):
+                stat.add(value)
+
+        rss = _read_tree_rss_bytes(self.root_pid)
+        rss_mb = rss / (1024 * 1024) if rss is not None else None
+        self.rss_mb.add(rss_mb)
+
+        read_mb_s = write_mb_s = None
+        disk_bytes = _read_disk_bytes()
+        if disk_bytes and self._disk_bytes:
+            read_mb_s = (disk_bytes[0] - self._disk_bytes[0]) / elapsed / (1024 * 1024)
+            write_mb_s = (disk_bytes[1] - self._disk_bytes[1]) / elapsed / (1024 * 1024)
+        self._disk_bytes = disk_bytes
+        self.read_mb_s.add(read_mb_s)
+        self.write_mb_s.add(write_mb_s)
+
+        depth = _queue_depth()
+        self.queue_depth.add(depth)
+
+        def fmt(value):
+            return '' if value is None else f'{value:.3f}'.rstrip('0').rstrip('.')
+
+        self._file.write(','.join([f'{time.time():.3f}', fmt(rss_mb), fmt(read_mb_s), fmt(write_mb_s),
+                                   '' if depth is None else str(depth)] + [fmt(x) for x in utilisation]) + '\n')
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        disk_total = None
+        if self.disk_start and self._disk_bytes:
+            disk_total = [(end - start) / (1024 * 1024) for start, end in zip(self.disk_start, self._disk_bytes)]
+        return {
+            'samples': self.cpu.count,
+            'cores': len(self.core_utilisation),
+            'cpu_mean': self.cpu.mean,
+            'cpu_peak': self.cpu.peak,
+            'idle_core_fraction': self.idle_cores.mean,
+            'busiest_core_mean': max((x.mean for x in self.core_utilisation if x.mean is not None), default=None),
+            'rss_mb_mean': self.rss_mb.mean,
+            'rss_mb_peak': self.rss_mb.peak,
+            'read_mb_total': disk_total[0] if disk_total else None,
+            'write_mb_total': disk_total[1] if disk_total else None,
+            'write_mb_s_peak': self.write_mb_s.peak,
+            'queue_depth_mean': self.queue_depth.mean,
+            'queue_depth_peak': self.queue_depth.peak,
+        }
+
+    def stop(self) -> Dict[str, Optional[float]]:
+        """
+        Stop sampling, log a summary and close the time series.
+        Returns: The summary.
+
+        """
+        self._stop_event.set()
+        self._thread.join()
+        # Make sure short runs still get a sample.
+        if self.cpu.count == 0 and self._file is not None:
+            self.sample()
+        if self._file is not None:
+            self._file.close()
+
+        summary = self.summary()
+
+        def fmt(value, scale=1.0, unit=''):
+            return 'n/a' if value is None else f'{value * scale:.1f}{unit}'
+
+        logger.info(f"Resource telemetry over {summary['samples']} samples: "
+                    f"CPU mean {fmt(summary['cpu_mean'], 100, '%')}, peak {fmt(summary['cpu_peak'], 100, '%')}, "
+                    f"idle cores {fmt(summary['idle_core_fraction'], 100, '%')} of {summary['cores']}; "
+                    f"RSS mean {fmt(summary['rss_mb_mean'], unit='MB')}, "
+                    f"peak {fmt(summary['rss_mb_peak'], unit='MB')}; "
+                    f"disk read {fmt(summary['read_mb_total'], unit='MB')}, "
+                    f"written {fmt(summary['write_mb_total'], unit='MB')}; "
+                    f"logger queue depth mean {fmt(summary['queue_depth_mean'])}, "
+                    f"peak {fmt(summary['queue_depth_peak'])}. Samples in {self.path}")
+        return summary
+
+
+def get_resource_sampler(config: ConfigParser) -> Optional[ResourceSampler]:
+    """
+    This function creates the resource sampler described by the [Telemetry] section of the config. The time series is
+    written next to the logs, so download_logs.sh picks it up.
+    Args:
+        config: A ConfigParser containing the configuration.
+
+    Returns: An unstarted ResourceSampler, or None if telemetry is disabled.
+
+    """
+    settings = TelemetrySettings.from_config(config)
+    if not settings.enabled:
+        return None
+    return ResourceSampler(path=f"{LoggerSettings.from_config(config).log_dir}/telemetry.csv",
+                           interval=settings.interval, idle_threshold=settings.idle_threshold)
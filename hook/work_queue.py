@@ -0,0 +1,412 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import time
+import socket
+import sqlite3
+
+from datetime import datetime
+from urllib.parse import quote, unquote
+from threading import Event, Lock, Thread
+
+from typing import Dict, Iterable, List, Optional, Set
+
+from configparser import ConfigParser
+from configurations.settings import WorkQueueSettings
+
+from log.log_setup import get_logger
+
+logger = get_logger(__name__)
+
+
+class WorkQueueBackend:
+    """
+    Where the units of distributed tasks and their leases are coordinated between hook instances, e.g. one per VM.
+    A unit is pending, leased to an owner until its lease expires, or done. A unit whose lease expired, because its
+    owner crashed or was preempted, can be claimed again, so units are processed at least once.
+    """
+
+    def add(self, task: str, keys: Iterable[str]) -> None:
+        """
+        Add the units of a task which are not in the queue yet, as pending.
+        """
+        raise NotImplementedError
+
+    def claim(self, task: str, owner: str, limit: int, lease_seconds: float) -> List[str]:
+        """
+        Lease up to limit pending or expired units of a task to owner.
+        Returns: The keys of the claimed units.
+        """
+        raise NotImplementedError
+
+    def renew(self, owner: str, lease_seconds: float) -> int:
+        """
+        Extend every lease held by owner.
+        Returns: The number of leases renewed.
+        """
+        raise NotImplementedError
+
+    def complete(self, task: str, owner: str, keys: Iterable[str]) -> None:
+        """
+        Mark units of a task as done, even if their lease expired in the meantime.
+        """
+        raise NotImplementedError
+
+    def release(self, task: str, owner: str) -> None:
+        """
+        Return the units of a task leased to owner to pending, so other instances can claim them at once.
+        """
+        raise NotImplementedError
+
+    def counts(self, task: str, lease_seconds: float) -> Dict[str, int]:
+        """
+        Count the units of a task in each state. Leases older than lease_seconds are expired, and counted as pending.
+        Returns: A dict with 'pending', 'leased' and 'done' keys.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteWorkQueue(WorkQueueBackend):
+    """
+    Coordinates through a SQLite database. Claims run in write transactions, so instances sharing the database never
+    claim the same unit at once. SQLite locking isn't reliable over network file systems, so this suits instances on
+    one machine, e.g. local testing, and FileWorkQueue suits several VMs.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        # The heartbeat renews leases from another thread.
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS work_units ('
+                                'task TEXT NOT NULL, '
+                                'unit TEXT NOT NULL, '
+                                'owner TEXT, '
+                                'expires REAL, '
+                                'done INTEGER NOT NULL DEFAULT 0, '
+                                'attempts INTEGER NOT NULL DEFAULT 0, '
+                                'PRIMARY KEY (task, unit))')
+
+    def _write(self, statements) -> List:
+        # BEGIN IMMEDIATE takes the write lock up front, so a claim's read and update are atomic across instances.
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                result = statements(self.connection)
+                self.connection.execute('COMMIT')
+                return result
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+
+    def add(self, task: str, keys: Iterable[str]) -> None:
+        rows = [(task, key) for key in keys]
+        self._write(lambda c: c.executemany('INSERT OR IGNORE INTO work_units (task, unit) VALUES (?, ?)', rows))
+
+    def claim(self, task: str, owner: str, limit: int, lease_seconds: float) -> List[str]:
+        def statements(c):
+            now = time.time()
+            keys = [row[0] for row in c.execute(
+                'SELECT unit FROM work_units WHERE task = ? AND done = 0 AND (owner IS NULL OR expires < ?) '
+                'ORDER BY rowid LIMIT ?', (task, now, limit))]
+            c.executemany('UPDATE work_units SET owner = ?, expires = ?, attempts = attempts + 1 '
+                          'WHERE task = ? AND unit = ?', [(owner, now + lease_seconds, task, key) for key in keys])
+            return keys
+        return self._write(statements)
+
+    def renew(self, owner: str, lease_seconds: float) -> int:
+        return self._write(lambda c: c.execute(
+            'UPDATE work_units SET expires = ? WHERE owner = ? AND done = 0 AND expires >= ?',
+            (time.time() + lease_seconds, owner, time.time())).rowcount)
+
+    def complete(self, task: str, owner: str, keys: Iterable[str]) -> None:
+        rows = [(owner, task, key) for key in keys]
+        self._write(lambda c: c.executemany(
+            'UPDATE work_units SET done = 1, owner = ?, expires = NULL WHERE task = ? AND unit = ?', rows))
+
+    def release(self, task: str, owner: str) -> None:
+        self._write(lambda c: c.execute(
+            'UPDATE work_units SET owner = NULL, expires = NULL WHERE task = ? AND owner = ? AND done = 0',
+            (task, owner)))
+
+    def counts(self, task: str, lease_seconds: float) -> Dict[str, int]:
+        with self.lock:
+            done, leased, total = self.connection.execute(
+                'SELECT COALESCE(SUM(done), 0), COALESCE(SUM(done = 0 AND owner IS NOT NULL AND expires >= ?), 0), '
+                'COUNT(*) FROM work_units WHERE task = ?', (time.time(), task)).fetchone()
+        return {'pending': total - done - leased, 'leased': leased, 'done': done}
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+class FileWorkQueue(WorkQueueBackend):
+    """
+    Coordinates through a shared file system, e.g. an NFS mount or Filestore share, with one file per unit in the
+    pending, leased and done folders of {directory}/{task}. A unit is claimed by renaming its file from pending to
+    leased, which only one instance can do. The modification time of a leased file is the start of its lease, and the
+    owner renews it with a touch, so the clocks of the VMs should agree to well within lease_seconds.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        # The leases held by this instance, by task.
+        self.held: Dict[str, Set[str]] = {}
+        self.lock = Lock()
+
+    def _folder(self, task: str, state: str) -> str:
+        return os.path.join(self.directory, quote(task, safe=''), state)
+
+    def _path(self, task: str, state: str, key: str) -> str:
+        return os.path.join(self._folder(task, state), quote(key, safe=''))
+
+    def _keys(self, task: str, state: str) -> List[str]:
+        folder = self._folder(task, state)
+        return sorted(unquote(x) for x in os.listdir(folder)) if os.path.isdir(folder) else []
+
+    def add(self, task: str, keys: Iterable[str]) -> None:
+        for state in ['pending', 'leased', 'done']:
+            os.makedirs(self._folder(task, state), exist_ok=True)
+        for key in keys:
+            # Units move from pending to leased to done, so check in that order to not miss a unit on the move.
+            if any(os.path.exists(self._path(task, state, key)) for state in ['pending', 'leased', 'done']):
+                continue
+            try:
+                os.close(os.open(self._path(task, 'pending', key), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            except FileExistsError:
+                pass
+
+    def _reclaim_expired(self, task: str, lease_seconds: float) -> None:
+        now = time.time()
+        for key in self._keys(task, 'leased'):
+            path = self._path(task, 'leased', key)
+            try:
+                if now - os.stat(path).st_mtime > lease_seconds:
+                    os.rename(path, self._path(task, 'pending', key))
+                    logger.warning(f"Work unit '{key}' of task '{task}' had an expired lease and was reclaimed.")
+            except FileNotFoundError:
+                continue
+
+    def claim(self, task: str, owner: str, limit: int, lease_seconds: float) -> List[str]:
+        self._reclaim_expired(task, lease_seconds)
+        claimed = []
+        for key in self._keys(task, 'pending'):
+            if len(claimed) >= limit:
+                break
+            pending, leased = self._path(task, 'pending', key), self._path(task, 'leased', key)
+            try:
+                # Start the lease before the rename, so the leased file never looks expired.
+                os.utime(pending)
+                os.rename(pending, leased)
+            except FileNotFoundError:
+                # Claimed by another instance.
+                continue
+            claimed.append(key)
+        with self.lock:
+            self.held.setdefault(task, set()).update(claimed)
+        return claimed
+
+    def renew(self, owner: str, lease_seconds: float) -> int:
+        renewed = 0
+        with self.lock:
+            for task, keys in self.held.items():
+                for key in list(keys):
+                    try:
+                        os.utime(self._path(task, 'leased', key))
+                        renewed += 1
+                    except FileNotFoundError:
+                        # Done, or reclaimed by another instance after the lease expired.
+                        keys.discard(key)
+        return renewed
+
+    def complete(self, task: str, owner: str, keys: Iterable[str]) -> None:
+        for key in keys:
+            done = self._path(task, 'done', key)
+            try:
+                os.rename(self._path(task, 'leased', key), done)
+            except FileNotFoundError:
+                # The lease expired and the unit was reclaimed, it is done all the same.
+                os.close(os.open(done, os.O_CREAT | os.O_WRONLY))
+                for state in ['pending', 'leased']:
+                    try:
+                        os.remove(self._path(task, state, key))
+                    except FileNotFoundError:
+                        pass
+            with self.lock:
+                self.held.get(task, set()).discard(key)
+
+    def release(self, task: str, owner: str) -> None:
+        with self.lock:
+            keys = self.held.pop(task, set())
+        for key in keys:
+            try:
+                os.rename(self._path(task, 'leased', key), self._path(task, 'pending', key))
+            except FileNotFoundError:
+                pass
+
+    def counts(self, task: str, lease_seconds: float) -> Dict[str, int]:
+        now = time.time()
+        leased = 0
+        expired = 0
+        for key in self._keys(task, 'leased'):
+            try:
+                if now - os.stat(self._path(task, 'leased', key)).st_mtime > lease_seconds:
+                    expired += 1
+                else:
+                    leased += 1
+            except FileNotFoundError:
+                continue
+        return {'pending': len(self._keys(task, 'pending')) + expired, 'leased': leased,
+                'done': len(self._keys(task, 'done'))}
+
+
+class WorkQueue:
+    """
+    Splits the map tasks registered with distributed=True between hook instances running the same tasks, e.g. the
+    scheduled hook on several VMs. Each instance claims units through leases with timeouts, renewed by a heartbeat
+    thread while it runs. Units leased by an instance which crashed or was preempted are claimed again once their lease
+    expires, so a unit may be processed more than once and tasks should write their outputs idempotently.
+
+    e.g.
+    queue = WorkQueue(FileWorkQueue('/mnt/shared/work_queue'), namespace='2021-06-01')
+    engine = JobEngine(work_queue=queue)
+    engine.add_task('score', score_rows, items=range(0, n, 10000), distributed=True)
+    """
+
+    def __init__(self, backend: WorkQueueBackend, owner: Optional[str] = None, lease_seconds: float = 300,
+                 poll_interval: float = 5, namespace: str = ''):
+        """
+        Args:
+            backend: Where the units and their leases are coordinated.
+            owner: Identifies this instance in the leases. Defaults to the host name and process id.
+            lease_seconds: How long a claimed unit stays leased without a heartbeat.
+            poll_interval: Seconds between claims while other instances hold the remaining units.
+            namespace: Prefixes the task names, so every run processes the units of its tasks afresh.
+        """
+        self.backend = backend
+        self.owner = owner or f'{socket.gethostname()}-{os.getpid()}'
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.namespace = namespace
+
+        # Units this instance completed, by task.
+        self.completed: Dict[str, int] = {}
+        self._stop_event = Event()
+        self._heartbeat: Optional[Thread] = None
+
+    def _task(self, task: str) -> str:
+        return f'{self.namespace}/{task}' if self.namespace else task
+
+    def _renew_periodically(self) -> None:
+        while not self._stop_event.wait(self.lease_seconds / 3):
+            try:
+                self.backend.renew(self.owner, self.lease_seconds)
+            except Exception as e:
+                logger.warning(f"Failed to renew the work queue leases of {self.owner}: {e!r}")
+
+    def add(self, task: str, keys: Iterable[str]) -> None:
+        """
+        Add the units of a task. Every instance adds the same units, those already in the queue are kept as they are.
+        """
+        self.backend.add(self._task(task), keys)
+
+    def claim(self, task: str, limit: int) -> List[str]:
+        """
+        Claim up to limit units of a task for this instance.
+        Returns: The keys of the claimed units.
+        """
+        # The heartbeat runs from the first claim until close().
+        if self._heartbeat is None:
+            self._heartbeat = Thread(target=self._renew_periodically, daemon=True)
+            self._heartbeat.start()
+        keys = self.backend.claim(self._task(task), self.owner, limit, self.lease_seconds)
+        if keys:
+            logger.info(f"{self.owner} claimed {len(keys)} unit(s) of task '{task}'. {self.progress(task)}")
+        return keys
+
+    def complete(self, task: str, keys: List[str]) -> None:
+        """
+        Mark units of a task as done.
+        """
+        self.backend.complete(self._task(task), self.owner, keys)
+        self.completed[task] = self.completed.get(task, 0) + len(keys)
+
+    def release(self, task: str) -> None:
+        """
+        Return the units of a task this instance holds, so other instances can claim them without waiting for the
+        leases to expire.
+        """
+        self.backend.release(self._task(task), self.owner)
+
+    def counts(self, task: str) -> Dict[str, int]:
+        """
+        Count the units of a task in each state.
+        """
+        return self.backend.counts(self._task(task), self.lease_seconds)
+
+    def progress(self, task: str) -> str:
+        """
+        Describe the progress of a task across every instance, and the share of this instance.
+        """
+        counts = self.counts(task)
+        total = sum(counts.values())
+        return f"{counts['done']} of {total} done, {counts['leased']} leased, {counts['pending']} pending, " \
+               f"{self.completed.get(task, 0)} completed by {self.owner}."
+
+    def close(self) -> None:
+        self._stop_event.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+        self.backend.close()
+
+
+def get_work_queue(config: ConfigParser) -> Optional[WorkQueue]:
+    """
+    This function creates the work queue described by the [WorkQueue] section of the config.
+    Args:
+        config: A ConfigParser containing the configuration.
+
+    Returns: A WorkQueue, or None if work distribution is disabled.
+
+    """
+    settings = WorkQueueSettings.from_config(config)
+    if not settings.enabled:
+        return None
+    if settings.backend == 'sqlite':
+        backend: WorkQueueBackend = SQLiteWorkQueue(settings.path)
+    else:
+        backend = FileWorkQueue(settings.path)
+    return WorkQueue(backend, owner=settings.owner or None, lease_seconds=settings.lease_seconds,
+                     poll_interval=settings.poll_interval,
+                     namespace=settings.namespace.format(date=datetime.utcnow().date().isoformat()))
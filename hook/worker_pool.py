@@ -0,0 +1,211 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import time
+import queue
+import importlib
+
+from typing import Dict, List, Optional, Sequence
+
+from configparser import ConfigParser
+from configurations.settings import Settings
+from configurations.config import install_settings
+
+import multiprocessing as mp
+from multiprocessing.pool import Pool
+
+import log.globals
+from log.log_setup import get_logger, init_worker_logger
+
+from hook.pool_sizer import max_pool_processes
+
+logger = get_logger(__name__)
+
+# The queue a pool worker reports the units it starts on, see report_unit_started().
+_started_queue = None
+
+
+def init_unit_reports(started_queue) -> None:
+    """
+    This function sets the queue a pool worker reports the units it starts on.
+    Args:
+        started_queue: A multiprocessing SimpleQueue, inherited by the worker through the pool initializer.
+
+    Returns:
+
+    """
+    global _started_queue
+    _started_queue = started_queue
+
+
+def report_unit_started(token: int) -> None:
+    """
+    This function reports that this worker is starting a unit, so that the main process can tell which unit was lost
+    if the worker dies. SimpleQueue writes synchronously, so the report isn't lost with the worker.
+    Args:
+        token: The id the main process dispatched the unit under.
+
+    Returns:
+
+    """
+    if _started_queue is not None:
+        _started_queue.put((token, os.getpid()))
+
+
+def _init_worker(logger_queue, preload_modules: Sequence[str], created_at: float, ready_queue,
+                 settings: Optional[Settings] = None, started_queue=None) -> None:
+    """
+    This function initializes a pool worker: it sets up queue logging once, installs the main process's settings,
+    imports the preload modules and reports how long the worker took to become ready.
+    Args:
+        logger_queue: The queue from logger_init().
+        preload_modules: The modules to import before the worker takes any tasks.
+        created_at: The time.time() at which the pool was created.
+        ready_queue: The queue to report (pid, startup seconds) on.
+        settings: The settings for get_settings() to return in the worker, instead of loading the config again.
+        started_queue: The queue to report the units the worker starts on, see report_unit_started().
+
+    Returns:
+
+    """
+    init_worker_logger(logger_queue)
+    init_unit_reports(started_queue)
+    if settings is not None:
+        install_settings(settings)
+    for module in preload_modules:
+        importlib.import_module(module)
+    startup_seconds = time.time() - created_at
+    get_logger(__name__).info(f"Worker {mp.current_process().pid} ready in {startup_seconds:.3f}s.")
+    ready_queue.put((mp.current_process().pid, startup_seconds))
+
+
+def _resolve_start_method(start_method: Optional[str]) -> str:
+    available = mp.get_all_start_methods()
+    if start_method in available:
+        return start_method
+    # forkserver isn't available on every platform (e.g. Windows), spawn always is.
+    fallback = 'spawn'
+    if start_method:
+        logger.warning(f"Start method '{start_method}' is not available on this platform, using '{fallback}'.")
+    return fallback
+
+
+class WorkerPool:
+    """
+    A process pool started once per run and reused by every parallel stage. Workers set up queue logging once and
+    import the preload modules before taking tasks. With the forkserver start method the modules are also imported
+    into the fork server, so each worker is forked with them already loaded instead of importing them again.
+
+    e.g.
+    with WorkerPool(processes=8, preload_modules=['numpy']) as worker_pool:
+        engine = JobEngine(pool=worker_pool)
+        ...
+        worker_pool.pool.imap_unordered(...)
+    """
+
+    def __init__(self, processes: Optional[int] = None, preload_modules: Sequence[str] = (),
+                 start_method: Optional[str] = None, logger_queue=None, settings: Optional[Settings] = None):
+        """
+        Args:
+            processes: The number of workers. Defaults to mp.cpu_count().
+            preload_modules: The modules to import in every worker before it takes tasks.
+            start_method: 'spawn', 'forkserver' or 'fork'. Defaults to the current multiprocessing start method.
+            logger_queue: The queue from logger_init(). Defaults to log.globals.logger_queue.
+            settings: Settings handed to every worker, see configurations.config.get_settings().
+        """
+        self.processes = processes or mp.cpu_count()
+        self.preload_modules = list(preload_modules)
+        self.start_method = _resolve_start_method(start_method or mp.get_start_method())
+        self.context = mp.get_context(self.start_method)
+        if self.start_method == 'forkserver':
+            self.context.set_forkserver_preload(self.preload_modules)
+
+        self.startup_seconds: Dict[int, float] = {}
+        self._ready_queue = self.context.Queue()
+        # Where workers report the units they start, for the JobEngine to find units lost with a dead worker.
+        self.started_queue = self.context.SimpleQueue()
+
+        logger_queue = logger_queue if logger_queue is not None else log.globals.logger_queue
+        self.pool: Pool = self.context.Pool(processes=self.processes, initializer=_init_worker,
+                                            initargs=(logger_queue, self.preload_modules, time.time(),
+                                                      self._ready_queue, settings, self.started_queue))
+
+    def wait_ready(self, timeout: Optional[float] = None) -> Dict[int, float]:
+        """
+        Wait for every worker to finish starting up, and log a summary of their startup times.
+        Args:
+            timeout: The most seconds to wait for each worker. If a worker doesn't report ready in time, e.g. because
+                     a preload module fails to import, the pool is terminated and a TimeoutError raised.
+
+        Returns: A dict of worker pid to startup seconds.
+
+        """
+        while len(self.startup_seconds) < self.processes:
+            try:
+                pid, seconds = self._ready_queue.get(timeout=timeout)
+            except queue.Empty:
+                # Workers which fail to initialize are replaced by the pool, so these may not be the first pids.
+                pending = sorted(x.pid for x in getattr(self.pool, '_pool', []) if x.pid not in self.startup_seconds)
+                self.terminate()
+                raise TimeoutError(f"{self.processes - len(self.startup_seconds)} of {self.processes} pool workers "
+                                   f"did not report ready within {timeout}s, the pool was terminated. Workers not "
+                                   f"ready: {', '.join(str(x) for x in pending) or 'none running'}.") from None
+            self.startup_seconds[pid] = seconds
+        times: List[float] = list(self.startup_seconds.values())
+        logger.info(f"Worker pool of {self.processes} ready ({self.start_method}). Startup mean "
+                    f"{sum(times) / len(times):.3f}s, max {max(times):.3f}s.")
+        return dict(self.startup_seconds)
+
+    def close(self) -> None:
+        self.pool.close()
+        self.pool.join()
+
+    def terminate(self) -> None:
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self) -> 'WorkerPool':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+
+def get_worker_pool(config: ConfigParser) -> WorkerPool:
+    """
+    This function starts the worker pool described by the [Pool] section of the config.
+    Args:
+        config: A ConfigParser containing the configuration.
+
+    Returns: A started WorkerPool. With [Pool] adaptive, it has max_processes workers for a PoolSizer to choose from.
+
+    """
+    settings = Settings.from_config(config)
+    processes = max_pool_processes(settings.pool) if settings.pool.adaptive else settings.pool.processes or None
+    return WorkerPool(processes=processes, preload_modules=settings.pool.preload_modules,
+                      start_method=settings.pool.start_method or None, settings=settings)
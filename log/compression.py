@@ -0,0 +1,138 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import gzip
+import shutil
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from threading import Lock
+
+from typing import Dict, Optional
+
+from configurations.settings import LoggerSettings
+
+
+class RotationCompressor:
+    """
+    Compresses rotated log files on a background thread. Rotating handlers use namer() and rotator() so that a rotated
+    file is renamed into place immediately and compressed afterwards, keeping compression off the logging hot path.
+    """
+
+    suffixes = {'gzip': '.gz', 'zstd': '.zst'}
+
+    def __init__(self, method: str, level: int):
+        if method not in self.suffixes:
+            raise ValueError(f"Unknown log compression '{method}'. Expected 'none', 'gzip' or 'zstd'.")
+        if method == 'zstd':
+            try:
+                import zstandard
+            except ImportError as e:
+                raise ImportError("zstd log compression requires the 'zstandard' package. "
+                                  "Add it to requirements.txt or use gzip.") from e
+            self._zstd_compressor = zstandard.ZstdCompressor(level=level)
+
+        self.method = method
+        self.level = level
+        self.suffix = self.suffixes[method]
+
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='log_compressor')
+        # The most recent compression submitted for each base log file.
+        self.pending: Dict[str, Future] = {}
+        self.pending_lock = Lock()
+
+    def namer(self, default_name: str) -> str:
+        return default_name + self.suffix
+
+    def rotator(self, source: str, dest: str) -> None:
+        """
+        Rename the live log file out of the way and schedule its compression into dest.
+        Args:
+            source: The live log file, e.g. scheduled_vm.log
+            dest: The compressed backup name, e.g. scheduled_vm.log.1.gz
+
+        Returns:
+
+        """
+        if not os.path.exists(source):
+            return
+        uncompressed = dest[:-len(self.suffix)]
+        os.rename(source, uncompressed)
+        with self.pending_lock:
+            self.pending[source] = self.executor.submit(self._compress, uncompressed, dest)
+
+    def wait_for(self, base_filename: str) -> None:
+        """
+        Wait for the pending compression of a log file's last backup. Rotating handlers call this before shifting
+        backups, since a backup which is still being compressed doesn't yet exist under its compressed name.
+        Args:
+            base_filename: The live log file of the rotating handler.
+
+        Returns:
+
+        """
+        with self.pending_lock:
+            future = self.pending.pop(base_filename, None)
+        if future is not None:
+            future.result()
+
+    def shutdown(self) -> None:
+        """
+        Wait for every pending compression to finish.
+        Returns:
+
+        """
+        self.executor.shutdown(wait=True)
+        with self.pending_lock:
+            pending, self.pending = list(self.pending.values()), {}
+        # Surface any error raised while compressing.
+        for future in pending:
+            future.result()
+
+    def _compress(self, source: str, dest: str) -> None:
+        partial_dest = f'{dest}.partial'
+        with open(source, 'rb') as f_in:
+            if self.method == 'gzip':
+                with gzip.open(partial_dest, 'wb', compresslevel=self.level) as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+            else:
+                with open(partial_dest, 'wb') as f_out:
+                    self._zstd_compressor.copy_stream(f_in, f_out)
+        os.replace(partial_dest, dest)
+        os.remove(source)
+
+
+def get_rotation_compressor(settings: LoggerSettings) -> Optional[RotationCompressor]:
+    """
+    This function creates the rotation compressor described by the [Logger] settings.
+    Args:
+        settings: The [Logger] settings.
+
+    Returns: A RotationCompressor, or None if rotated logs are kept uncompressed.
+
+    """
+    if settings.compression == 'none':
+        return None
+    return RotationCompressor(method=settings.compression, level=settings.compression_level)
@@ -0,0 +1,100 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from collections import OrderedDict
+
+from typing import Dict, Set
+
+import logging
+
+
+class SegmentFilePool:
+    """
+    Bounds the number of LOGSEG file handlers holding an open file. The least recently used handler has its stream
+    closed when the limit is exceeded. Its logger and handler are kept, and the handler reopens the file in append
+    mode the next time it writes, so RotatingFileHandler picks the file size (and thus the rollover point) up from
+    disk.
+    """
+
+    def __init__(self, max_open: int):
+        self.max_open = max_open
+        self.open_handlers: 'OrderedDict[str, logging.FileHandler]' = OrderedDict()
+        self.evicted: Set[str] = set()
+
+        self.hits = 0
+        self.evictions = 0
+        self.reopens = 0
+
+    def use(self, name: str, handler: logging.FileHandler) -> None:
+        """
+        Mark a segment's handler as about to write, evicting the least recently used handlers over the limit.
+        Args:
+            name: The segregate folder name.
+            handler: The file handler for the segregate folder.
+
+        Returns:
+
+        """
+        if name in self.open_handlers:
+            self.open_handlers.move_to_end(name)
+            self.hits += 1
+            return
+
+        if name in self.evicted:
+            self.evicted.discard(name)
+            self.reopens += 1
+        self.open_handlers[name] = handler
+
+        while len(self.open_handlers) > self.max_open:
+            evicted_name, evicted_handler = self.open_handlers.popitem(last=False)
+            _close_stream(evicted_handler)
+            self.evicted.add(evicted_name)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'open': len(self.open_handlers),
+            'hits': self.hits,
+            'evictions': self.evictions,
+            'reopens': self.reopens,
+        }
+
+
+def _close_stream(handler: logging.FileHandler) -> None:
+    """
+    This function commits anything a handler has buffered and closes its file without closing the handler.
+    Args:
+        handler: The file handler to release the file of.
+
+    Returns:
+
+    """
+    handler.acquire()
+    try:
+        handler.flush()
+        if handler.stream:
+            handler.stream.close()
+            handler.stream = None
+    finally:
+        handler.release()
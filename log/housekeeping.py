@@ -0,0 +1,263 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import time
+import shutil
+import datetime
+import threading
+
+from threading import Thread
+
+from typing import List, Optional, Tuple
+
+# Written to the log directory when a run starts, to name the directory once the run is archived.
+RUN_MARKER = '.run_started'
+RUN_NAME_FORMAT = '%Y%m%d-%H%M%S'
+
+# Entries deleted between pauses of the background deletion, so it doesn't compete with the run for the disk.
+DELETE_BATCH = 100
+DELETE_PAUSE = 0.01
+
+
+def trash_dir(log_dir: str) -> str:
+    """
+    This function gets the folder that directories are moved to before they are deleted. It is next to the log
+    directory, so moving a directory there is a rename on the same file system.
+    Args:
+        log_dir: The [Logger] log_dir.
+
+    Returns: The trash folder.
+
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(log_dir)), '.trash')
+
+
+def _unique(path: str) -> str:
+    candidate, i = path, 1
+    while os.path.exists(candidate):
+        candidate = f'{path}-{i}'
+        i += 1
+    return candidate
+
+
+def move_to_trash(path: str, trash: str) -> Optional[str]:
+    """
+    This function moves a directory into the trash folder with a rename, so its name is free at once and the deletion
+    can happen in the background.
+    Args:
+        path: The directory to delete.
+        trash: The trash folder.
+
+    Returns: The new path of the directory, or None if it doesn't exist.
+
+    """
+    if not os.path.isdir(path):
+        return None
+    os.makedirs(trash, exist_ok=True)
+    target = _unique(os.path.join(trash, f'{os.path.basename(os.path.abspath(path))}-{time.time_ns()}'))
+    try:
+        os.rename(path, target)
+    except OSError:
+        # The trash is on another file system, delete in place.
+        shutil.rmtree(path, ignore_errors=True)
+        return None
+    return target
+
+
+def mark_run_started(log_dir: str) -> None:
+    """
+    This function records when the run logging to a directory started, to name the directory once it is archived.
+    Args:
+        log_dir: The [Logger] log_dir.
+
+    Returns:
+
+    """
+    with open(os.path.join(log_dir, RUN_MARKER), 'w') as f:
+        f.write(datetime.datetime.now().strftime(RUN_NAME_FORMAT))
+
+
+def _run_name(log_dir: str) -> str:
+    try:
+        with open(os.path.join(log_dir, RUN_MARKER), 'r') as f:
+            name = f.read().strip()
+        datetime.datetime.strptime(name, RUN_NAME_FORMAT)
+        return name
+    except (OSError, ValueError):
+        # Logs written before runs were marked.
+        return datetime.datetime.fromtimestamp(os.path.getmtime(log_dir)).strftime(RUN_NAME_FORMAT)
+
+
+def archive_run(log_dir: str, runs_dir: str) -> Optional[str]:
+    """
+    This function moves the logs of the previous run out of the log directory, into a directory of runs_dir named
+    after the time the run started.
+    Args:
+        log_dir: The [Logger] log_dir.
+        runs_dir: The [Logger] runs_dir.
+
+    Returns: The directory the run was archived to, or None if there was nothing to archive.
+
+    """
+    if not os.path.isdir(log_dir) or not os.listdir(log_dir):
+        return None
+    os.makedirs(runs_dir, exist_ok=True)
+    target = _unique(os.path.join(runs_dir, _run_name(log_dir)))
+    try:
+        os.rename(log_dir, target)
+    except OSError:
+        # runs_dir is on another file system.
+        shutil.move(log_dir, target)
+    return target
+
+
+def list_runs(runs_dir: str) -> List[str]:
+    """
+    This function lists the archived runs.
+    Args:
+        runs_dir: The [Logger] runs_dir.
+
+    Returns: The run directories, newest first.
+
+    """
+    if not os.path.isdir(runs_dir):
+        return []
+    names = [x for x in os.listdir(runs_dir) if not x.startswith('.') and os.path.isdir(os.path.join(runs_dir, x))]
+    return [os.path.join(runs_dir, x) for x in sorted(names, reverse=True)]
+
+
+def _size(path: str) -> int:
+    total = 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(folder, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def expired_runs(runs_dir: str, keep_runs: int = 0, keep_bytes: int = 0) -> List[str]:
+    """
+    This function finds the archived runs outside the retention policy. The newest runs are kept, up to keep_runs runs
+    and up to keep_bytes bytes in total. The newest run is always kept.
+    Args:
+        runs_dir: The [Logger] runs_dir.
+        keep_runs: Most runs kept (0 for no limit).
+        keep_bytes: Most bytes kept across the runs (0 for no limit).
+
+    Returns: The expired run directories, newest first.
+
+    """
+    expired = []
+    total = 0
+    over_bytes = False
+    for i, run in enumerate(list_runs(runs_dir)):
+        # Once the runs kept fill keep_bytes, older runs expire too, even if they are smaller.
+        if (keep_runs > 0 and i >= keep_runs) or over_bytes:
+            expired.append(run)
+            continue
+        if keep_bytes > 0:
+            total += _size(run)
+            if i > 0 and total > keep_bytes:
+                expired.append(run)
+                over_bytes = True
+    return expired
+
+
+def empty_trash(trash: str, batch: int = DELETE_BATCH, pause: float = DELETE_PAUSE) -> Tuple[int, int]:
+    """
+    This function deletes the contents of the trash folder, pausing every batch entries so it yields the disk.
+    Deletion that is interrupted, e.g. by the VM shutting down, carries on the next time.
+    Args:
+        trash: The trash folder.
+        batch: Entries deleted between pauses.
+        pause: Seconds to pause for.
+
+    Returns: The number of files and the number of bytes deleted.
+
+    """
+    files, size = 0, 0
+    if not os.path.isdir(trash):
+        return files, size
+    deleted = 0
+    for folder, directories, names in os.walk(trash, topdown=False):
+        for name in names:
+            path = os.path.join(folder, name)
+            try:
+                size += os.lstat(path).st_size
+                os.remove(path)
+                files += 1
+            except OSError:
+                pass
+            deleted += 1
+            if deleted % batch == 0:
+                time.sleep(pause)
+        for name in directories:
+            path = os.path.join(folder, name)
+            try:
+                if os.path.islink(path):
+                    os.remove(path)
+                else:
+                    os.rmdir(path)
+            except OSError:
+                pass
+    return files, size
+
+
+def _lower_priority() -> None:
+    # Linux schedules threads as tasks of their own, so this only lowers the priority of the calling thread.
+    get_native_id = getattr(threading, 'get_native_id', None)
+    if get_native_id is None or not hasattr(os, 'setpriority'):
+        return
+    try:
+        os.setpriority(os.PRIO_PROCESS, get_native_id(), 19)
+    except OSError:
+        pass
+
+
+class Housekeeper(Thread):
+    """
+    A low priority daemon thread which moves archived runs outside the retention policy to the trash, then empties
+    the trash while the job runs.
+    """
+
+    def __init__(self, trash: str, runs_dir: Optional[str] = None, keep_runs: int = 0, keep_bytes: int = 0):
+        super().__init__(name='log-housekeeping', daemon=True)
+        self.trash = trash
+        self.runs_dir = runs_dir
+        self.keep_runs = keep_runs
+        self.keep_bytes = keep_bytes
+        self.expired: List[str] = []
+        self.deleted_files = 0
+        self.deleted_bytes = 0
+
+    def run(self) -> None:
+        _lower_priority()
+        if self.runs_dir is not None:
+            for run in expired_runs(self.runs_dir, keep_runs=self.keep_runs, keep_bytes=self.keep_bytes):
+                if move_to_trash(run, self.trash) is not None:
+                    self.expired.append(run)
+        self.deleted_files, self.deleted_bytes = empty_trash(self.trash)
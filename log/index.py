@@ -0,0 +1,143 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import json
+import logging
+
+from typing import Dict, List, Optional
+
+INDEX_SUFFIX = '.idx'
+COMPRESSED_SUFFIXES = ['.gz', '.zst']
+
+
+def index_path(log_path: str) -> str:
+    """
+    This function names the sidecar index of a log file. Compressed backups share the index written for them before
+    they were compressed, e.g. scheduled_vm.log.1.gz is indexed by scheduled_vm.log.1.idx.
+    Args:
+        log_path: The path of the log file.
+
+    Returns: The path of its index.
+
+    """
+    for suffix in COMPRESSED_SUFFIXES:
+        if log_path.endswith(suffix):
+            log_path = log_path[:-len(suffix)]
+            break
+    return log_path + INDEX_SUFFIX
+
+
+def read_index(log_path: str) -> List[Dict]:
+    """
+    This function reads the blocks indexed for a log file.
+    Args:
+        log_path: The path of the log file.
+
+    Returns: The blocks, ordered by byte offset. Each has the start and end byte offsets, the first and last record
+             times and the count of records per level name. Empty if the file has no index.
+
+    """
+    try:
+        with open(index_path(log_path), 'r') as f:
+            blocks = [json.loads(line) for line in f if line.strip()]
+    except (OSError, ValueError):
+        return []
+    return sorted(blocks, key=lambda x: x['start'])
+
+
+class LogIndexWriter:
+    """
+    Indexes a log file while it is written. Records are grouped into blocks of at most block_seconds and block_bytes,
+    and each completed block is appended to the sidecar index as a JSON line holding its byte range, time range and
+    level counts. Queries use the index to seek to the blocks they need instead of scanning whole files.
+    """
+
+    def __init__(self, log_path: str, backup_count: int, block_seconds: float, block_bytes: int,
+                 encoding: Optional[str] = None):
+        self.log_path = log_path
+        self.backup_count = backup_count
+        self.block_seconds = block_seconds
+        self.block_bytes = block_bytes
+        self.encoding = encoding or 'utf-8'
+
+        # The file is opened in append mode, so indexing continues from its current size.
+        self.position = os.path.getsize(log_path) if os.path.isfile(log_path) else 0
+        self.block: Optional[Dict] = None
+
+    def add(self, created: float, levelno: int, msg: str) -> None:
+        """
+        Index a record.
+        Args:
+            created: The record's creation time.
+            levelno: The record's level.
+            msg: The text written for the record, including the terminator.
+
+        Returns:
+
+        """
+        size = len(msg) if msg.isascii() else len(msg.encode(self.encoding))
+        block = self.block
+        if block is not None and (created - block['first'] >= self.block_seconds or
+                                  self.position - block['start'] >= self.block_bytes):
+            self.finish_block()
+            block = None
+        if block is None:
+            block = self.block = {'start': self.position, 'end': self.position, 'first': created, 'last': created,
+                                  'levels': {}}
+        self.position += size
+        block['end'] = self.position
+        block['last'] = max(block['last'], created)
+        level_name = logging.getLevelName(levelno)
+        block['levels'][level_name] = block['levels'].get(level_name, 0) + 1
+
+    def finish_block(self) -> None:
+        """
+        Append the current block to the index.
+        Returns:
+
+        """
+        if self.block is None:
+            return
+        with open(index_path(self.log_path), 'a') as f:
+            f.write(json.dumps(self.block, separators=(',', ':')) + '\n')
+        self.block = None
+
+    def rotate(self) -> None:
+        """
+        Shift the indexes along with the log files when the handler rolls over, and start indexing the new file.
+        Returns:
+
+        """
+        self.finish_block()
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                source = index_path(f'{self.log_path}.{i}')
+                if os.path.exists(source):
+                    os.replace(source, index_path(f'{self.log_path}.{i + 1}'))
+            if os.path.exists(index_path(self.log_path)):
+                os.replace(index_path(self.log_path), index_path(f'{self.log_path}.1'))
+        elif os.path.exists(index_path(self.log_path)):
+            os.remove(index_path(self.log_path))
+        self.position = 0
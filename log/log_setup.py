@@ -22,41 +22,97 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-import re
 import os
 import sys
-import shutil
+import time
 
-from threading import Thread
+from threading import Thread, RLock
 
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 from configparser import ConfigParser
+from configurations.settings import LoggerSettings, Settings
 
-from multiprocessing import Queue, Manager, current_process
+from multiprocessing import Queue, current_process, util
 
 from logging import Logger
 import logging
 import logging.handlers
 
 import log.globals
+from log.transport import LogQueue, BatchedLogQueue, LogQueueHandler, BatchingQueueHandler, ShardTransport, \
+    apply_levels, QueueStats, create_logger_queue, parse_levels, unpack
+from log.shards import ShardFileHandler, merge_shards, remove_shards, shard_dir
+from log.records import parse_logseg
+from log.writer import BufferedRotatingFileHandler, BufferedStreamHandler, CompressingRotatingFileHandler, _flusher
+from log.compression import RotationCompressor, get_rotation_compressor
+from log.handle_pool import SegmentFilePool
+from log.housekeeping import Housekeeper, archive_run, mark_run_started, move_to_trash, trash_dir
 
 
 class LoggerManager:
 
-    def __init__(self, logger_thread: Thread):
+    def __init__(self, logger_thread: Optional[Thread], compressor: Optional[RotationCompressor] = None,
+                 queue_stats: Optional[QueueStats] = None, settings: Optional[LoggerSettings] = None,
+                 housekeeper: Optional[Housekeeper] = None):
+        # With the shards transport there is no logger thread, and the settings are kept for the merge.
         self.logger_thread = logger_thread
+        self.compressor = compressor
+        self.queue_stats = queue_stats
+        self.settings = settings
+        # Deletes old logs in the background. It is a daemon thread, deletion left when the program exits resumes on
+        # the next run.
+        self.housekeeper = housekeeper
+        self.terminated = False
 
     def terminate_logger(self):
         """
-        This method terminates the logger thread. It should be called when log is complete during program cleanup.
+        This method terminates the logger thread, or merges the log shards if the shards transport is configured. It
+        should be called when log is complete during program cleanup, after the worker processes have exited.
         Returns:
 
         """
-        # Trigger the logger thread to stop processing from the queue.
-        log.globals.logger_queue.put(None)
-        # Join the thread back to the main thread.
-        self.logger_thread.join()
+        # The logger may already have been terminated.
+        if self.terminated or (self.logger_thread is not None and not self.logger_thread.is_alive()):
+            return
+        self.terminated = True
+
+        # Log what the redirected stdout and stderr still hold.
+        for stream in [sys.stdout, sys.stderr]:
+            if isinstance(stream, BufferedRedirectToLogger):
+                stream.flush_all()
+
+        # Ship anything still buffered by a batching handler in this process.
+        for handler in logging.getLogger().handlers:
+            if isinstance(handler, BatchingQueueHandler):
+                handler.flush()
+
+        if self.logger_thread is not None:
+            # Trigger the logger thread to stop processing from the queue.
+            log.globals.logger_queue.put(None)
+            # Join the thread back to the main thread.
+            self.logger_thread.join()
+        else:
+            # Write out the shard of this process, then merge every shard into the log files.
+            root = logging.getLogger()
+            for handler in list(root.handlers):
+                if isinstance(handler, ShardFileHandler):
+                    handler.close()
+                    root.removeHandler(handler)
+            _merge_log_shards(self.settings, compressor=self.compressor)
+
+        # Summarise what a bounded queue dropped or delayed.
+        if self.queue_stats is not None and self.queue_stats.capacity > 0:
+            summary_logger = logging.getLogger(__name__)
+            if self.queue_stats.dropped:
+                summary_logger.warning(self.queue_stats.summary())
+            else:
+                summary_logger.info(self.queue_stats.summary())
+
+        # Summarise the LOGSEG file pool, if one was used.
+        for handler in logging.getLogger().handlers:
+            if isinstance(handler, CreateFileHandlerHandler) and handler.file_pool is not None:
+                logging.getLogger(__name__).info(f'LOGSEG file pool: {handler.file_pool.stats()}')
 
         # Shut down the handlers
         root = logging.getLogger()
@@ -67,6 +123,10 @@ class LoggerManager:
         # Shutdown logging
         logging.shutdown()
 
+        # Wait for rotated files to finish compressing before the VM shuts down.
+        if self.compressor is not None:
+            self.compressor.shutdown()
+
 
 class RedirectToLogger(object):
     """
@@ -90,16 +150,98 @@ class RedirectToLogger(object):
         return self.value
 
 
+class BufferedRedirectToLogger(RedirectToLogger):
+    """
+    Used in place of RedirectToLogger when [Logger] redirect_buffer_size is set. Partial writes are assembled into
+    complete lines, carriage return progress updates (e.g. tqdm) collapse into their latest state, and bursts of lines
+    are logged as one record once buffer_size characters are pending or flush_interval seconds have passed.
+
+    flush() logs the complete lines only, since progress bars flush after every update. The unfinished line is logged
+    by flush_all(), which runs when the process exits or the logger terminates.
+    """
+
+    def __init__(self, logger, log_level=logging.INFO, buffer_size: int = 65536, flush_interval: float = 1.0):
+        super().__init__(logger, log_level)
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+
+        self.partial = ''
+        self.buffer: List[str] = []
+        self.buffer_len = 0
+        self.last_commit = time.monotonic()
+        self.lock = RLock()
+
+        # Log pending lines on the shared group commit timer, and everything once the process exits. Multiprocessing
+        # children skip atexit but run their finalizers. The priority must be above the one the batching queue
+        # handler flushes with (20), so the lines are logged before the handler ships its last batch.
+        _flusher.register(self)
+        util.Finalize(None, self.flush_all, exitpriority=30)
+
+    @staticmethod
+    def _collapse(text: str) -> str:
+        # Keep the latest non-empty state of a line rewritten with carriage returns.
+        for segment in reversed(text.split('\r')):
+            if segment.strip():
+                return segment
+        return ''
+
+    def write(self, message):
+        self.value = message
+        with self.lock:
+            lines = (self.partial + message).split('\n')
+            self.partial = lines.pop()
+            if '\r' in self.partial:
+                self.partial = self._collapse(self.partial)
+            for line in lines:
+                line = self._collapse(line).rstrip() if '\r' in line else line.rstrip()
+                if line:
+                    self.buffer.append(line)
+                    self.buffer_len += len(line) + 1
+            if self.buffer_len >= self.buffer_size or time.monotonic() - self.last_commit >= self.flush_interval:
+                self.flush()
+        return len(message)
+
+    def flush(self):
+        """
+        Log the pending complete lines as one record.
+        Returns:
+
+        """
+        with self.lock:
+            lines, self.buffer, self.buffer_len = self.buffer, [], 0
+            self.last_commit = time.monotonic()
+        if lines:
+            self.logger.log(self.log_level, '\n'.join(lines))
+
+    def flush_all(self):
+        """
+        Log the pending lines, including the unfinished one.
+        Returns:
+
+        """
+        with self.lock:
+            partial, self.partial = self.partial.rstrip(), ''
+            if partial:
+                self.buffer.append(partial)
+        self.flush()
+
+
 class CreateFileHandlerHandler(logging.Handler):
 
-    def __init__(self, config: ConfigParser):
+    def __init__(self, settings: LoggerSettings, compressor: Optional[RotationCompressor] = None):
         super().__init__()
-        self.config = config
+        self.settings = settings
+        self.compressor = compressor
+        self.log_formatter = _get_log_formatter()
+
+        # Registry of segregate folder name to the logger and handler writing that folder's file.
+        self.segregated_loggers: Dict[str, Tuple[Logger, logging.FileHandler]] = {}
 
-        self.segregate_regex = re.compile('(LOGSEG\(.*?\))')
-        self.seg_name_regex = re.compile('(?<=\()(.*)(?=\))')
+        # Bound the number of segregate files held open at once, if configured.
+        max_open_segments = self.settings.max_open_segments
+        self.file_pool = SegmentFilePool(max_open=max_open_segments) if max_open_segments > 0 else None
 
-    def _process_logseg(self, log: str) -> Tuple[str, str]:
+    def _process_logseg(self, log: str) -> Tuple[str, Optional[str]]:
         """
         This method processes a logseg log record.
         Args:
@@ -108,25 +250,40 @@ class CreateFileHandlerHandler(logging.Handler):
         Returns: A Tuple containing the final message and the segregate folder name for the log string.
 
         """
-        segregate_folder_name = None
-        if re.findall(self.segregate_regex, log):
-            # Determine the segregate folder name defined in the log string.
-            segregate_folder_name = re.findall(
-                self.seg_name_regex,
-                re.findall(self.segregate_regex, log)[0])[0]
-            # Rewrite the log message to not include the segregation tag.
-            final_message = re.sub(self.segregate_regex, '', log)
-        else:
-            final_message = log
-        return final_message, segregate_folder_name
+        return parse_logseg(log)
+
+    def _get_segregated_logger(self, segregate_folder_name: str) -> Logger:
+        """
+        This method gets the logger for a segregate folder, creating it and its file handler on first use.
+        Args:
+            segregate_folder_name: The segregate folder name from the LOGSEG tag.
+
+        Returns: The logger for the segregate folder.
+
+        """
+        entry = self.segregated_loggers.get(segregate_folder_name)
+        if entry is None:
+            logger = logging.getLogger(segregate_folder_name)
+            # Don't propagate to the root logger, this would cause infinite recursion.
+            logger.propagate = False
+            # Add a file handler to the logger instance for the segregate folder.
+            file_handler = _add_file_handler(settings=self.settings, instance=logger,
+                                             log_formatter=self.log_formatter, folder_name=segregate_folder_name,
+                                             compressor=self.compressor)
+            entry = self.segregated_loggers[segregate_folder_name] = (logger, file_handler)
+        logger, file_handler = entry
+
+        if self.file_pool is not None:
+            self.file_pool.use(segregate_folder_name, file_handler)
+        return logger
 
     def emit(self, record):
         """
         Create a file handler, attached to the logger instance.
         """
         try:
-            # Handle logging to separate file, if requested:
-            segregate_folder_name = None
+            # Handle logging to separate file, if requested. Slim records arrive with the tag already parsed.
+            segregate_folder_name = getattr(record, 'logseg', None)
 
             # Handle message property
             if hasattr(record, 'message'):
@@ -139,51 +296,68 @@ class CreateFileHandlerHandler(logging.Handler):
                 segregate_folder_name = name if name else segregate_folder_name
 
             if segregate_folder_name:
-                logger = logging.getLogger(segregate_folder_name)
-                # Don't propagate to the root logger, this would cause infinite recursion.
-                logger.propagate = False
-                # Add a file handler to the logger instance for the segregate folder.
-                _add_file_handler(config=self.config, instance=logger, log_formatter=_get_log_formatter(),
-                                  folder_name=segregate_folder_name)
-                logger.handle(record)
+                self._get_segregated_logger(segregate_folder_name).handle(record)
         except RecursionError:
             raise
         except Exception:
             self.handleError(record)
 
 
-def _add_file_handler(config: ConfigParser, instance, log_formatter, folder_name: Optional[str] = None):
+def _add_file_handler(settings: LoggerSettings, instance, log_formatter, folder_name: Optional[str] = None,
+                      compressor: Optional[RotationCompressor] = None) -> logging.FileHandler:
     """
+    This function adds a rotating file handler writing to the log directory, or to the folder_name subdirectory of it,
+    to a logger instance.
 
     Args:
-        config:
-        instance:
-        log_formatter:
-        folder_name:
+        settings: The [Logger] settings.
+        instance: The logger instance to add the handler to.
+        log_formatter: The formatter for the handler.
+        folder_name: The segregate folder name, or None for the root log file.
+        compressor: Compresses rotated files in the background, if given.
 
-    Returns:
+    Returns: The file handler, or the existing one if the instance already has a handler for folder_name.
 
     """
-    # If the file handler doesn't already exist, create it.
-    if not folder_name or folder_name and folder_name not in [x.name for x in instance.handlers]:
-        # Create the directory for the logs if necessary.
-        base_log_path = config.get('Logger', 'log_dir')
-        if folder_name:
-            log_path = f'{base_log_path}/{folder_name}'
-        else:
-            log_path = base_log_path
-        if not os.path.isdir(log_path):
-            os.makedirs(log_path)
-
-        # Define the file handler.
-        file_handler = logging.handlers.RotatingFileHandler(f"{log_path}/scheduled_vm.log",
-                                                            maxBytes=config.getint('Logger', 'max_bytes'),
-                                                            backupCount=config.getint('Logger', 'backup_count'))
-        file_handler.set_name(folder_name)
-
-        # Add the file handler.
-        file_handler.setFormatter(log_formatter)
-        instance.addHandler(file_handler)
+    # If the file handler already exists, use it.
+    if folder_name:
+        for handler in instance.handlers:
+            if handler.name == folder_name:
+                return handler
+
+    # Create the directory for the logs if necessary.
+    base_log_path = settings.log_dir
+    if folder_name:
+        log_path = f'{base_log_path}/{folder_name}'
+    else:
+        log_path = base_log_path
+    if not os.path.isdir(log_path):
+        os.makedirs(log_path)
+
+    # Define the file handler.
+    if settings.writer_buffer_size > 0:
+        file_handler = BufferedRotatingFileHandler(f"{log_path}/scheduled_vm.log",
+                                                   max_bytes=settings.max_bytes,
+                                                   backup_count=settings.backup_count,
+                                                   buffer_size=settings.writer_buffer_size,
+                                                   flush_interval=settings.writer_flush_interval,
+                                                   compressor=compressor,
+                                                   index_block_seconds=settings.index_block_seconds,
+                                                   index_block_bytes=settings.index_block_bytes)
+    else:
+        file_handler = CompressingRotatingFileHandler(f"{log_path}/scheduled_vm.log",
+                                                      max_bytes=settings.max_bytes,
+                                                      backup_count=settings.backup_count,
+                                                      compressor=compressor,
+                                                      index_block_seconds=settings.index_block_seconds,
+                                                      index_block_bytes=settings.index_block_bytes)
+    file_handler.set_name(folder_name)
+
+    # Add the file handler.
+    file_handler.setFormatter(log_formatter)
+    instance.addHandler(file_handler)
+
+    return file_handler
 
 
 def _get_log_formatter():
@@ -202,94 +376,183 @@ def _get_root_logger():
     return root
 
 
-def _redirect_stdout_stderr():
+def _redirect_stdout_stderr(buffer_size: int = 0, flush_interval: float = 1.0):
     """
     This function redirects the standard out and standard error to logger instances.
+    Args:
+        buffer_size: If above 0, assemble lines and log them in bursts of up to this many characters.
+        flush_interval: The longest a complete line waits to be logged when buffering (seconds).
+
     Returns:
 
     """
+    def redirect(name, log_level):
+        if buffer_size > 0:
+            return BufferedRedirectToLogger(get_logger(name), log_level, buffer_size=buffer_size,
+                                            flush_interval=flush_interval)
+        return RedirectToLogger(get_logger(name), log_level)
+
+    # Workers call this for every get_logger() with a queue, keep the buffered redirects they already have.
+    if buffer_size > 0 and isinstance(sys.stdout, BufferedRedirectToLogger) and \
+            isinstance(sys.stderr, BufferedRedirectToLogger):
+        return
+
+    # Log what the streams being replaced still hold.
+    for stream in [sys.stdout, sys.stderr]:
+        if isinstance(stream, BufferedRedirectToLogger):
+            stream.flush_all()
+
     # Redirect stdout to a logger instance
-    stdout_logger = get_logger('stdout')
-    stdout_logger = RedirectToLogger(stdout_logger, logging.INFO)
-    sys.stdout = stdout_logger
+    sys.stdout = redirect('stdout', logging.INFO)
 
     # Redirect stderr to a logger instance
-    stderr_logger = get_logger('stderr')
-    stderr_logger = RedirectToLogger(stderr_logger, logging.WARNING)
-    sys.stderr = stderr_logger
+    sys.stderr = redirect('stderr', logging.WARNING)
+
+
+def _merge_log_shards(settings: LoggerSettings, compressor: Optional[RotationCompressor] = None) -> int:
+    """
+    This function merges the log shards of a run by record time into the log files, through the same handlers the
+    _lt thread logs to, so the rotation limits, LOGSEG folders, compression and indexes apply as usual. The merge is
+    streamed, so memory doesn't grow with the size of the logs. The shards are removed once merged.
+    Args:
+        settings: The [Logger] settings.
+        compressor: Compresses rotated files in the background, if given.
+
+    Returns: The number of records merged.
+
+    """
+    directory = shard_dir(settings.log_dir)
 
+    # A logger outside the hierarchy, so merged records aren't echoed by the stdout handler of the root logger.
+    merger = logging.Logger(__name__)
+    _add_file_handler(settings, merger, _get_log_formatter(), compressor=compressor)
+    file_handler_handler = CreateFileHandlerHandler(settings=settings, compressor=compressor)
+    merger.addHandler(file_handler_handler)
 
-def _configure_logging_handlers(config: ConfigParser) -> Logger:
+    count = 0
+    for record in merge_shards(directory):
+        merger.handle(record)
+        count += 1
+
+    if file_handler_handler.file_pool is not None:
+        merger.info(f'LOGSEG file pool: {file_handler_handler.file_pool.stats()}')
+
+    for segregated_logger, file_handler in file_handler_handler.segregated_loggers.values():
+        file_handler.close()
+        segregated_logger.removeHandler(file_handler)
+    for handler in list(merger.handlers):
+        handler.close()
+        merger.removeHandler(handler)
+
+    remove_shards(directory)
+    return count
+
+
+def _configure_logging_handlers(settings: LoggerSettings, compressor: Optional[RotationCompressor] = None) -> Logger:
     # Get the root logger.
     root = _get_root_logger()
 
     # Define the formatter.
     log_formatter = _get_log_formatter()
 
-    # Add the file handler
-    _add_file_handler(config, root, log_formatter)
+    if settings.transport == 'shards':
+        # Write to a shard like the workers do, the log files are written when the shards are merged.
+        root.addHandler(ShardFileHandler(shard_dir(settings.log_dir), flush_interval=settings.writer_flush_interval))
+    else:
+        # Add the file handler
+        _add_file_handler(settings, root, log_formatter, compressor=compressor)
 
-    # Create the handler that creates more file handlers.
-    file_handler_handler = CreateFileHandlerHandler(config=config)
-    root.addHandler(file_handler_handler)
+        # Create the handler that creates more file handlers.
+        file_handler_handler = CreateFileHandlerHandler(settings=settings, compressor=compressor)
+        root.addHandler(file_handler_handler)
 
     # Define the stream handler.
-    stdout_handler = logging.StreamHandler(sys.stdout)
+    if settings.writer_buffer_size > 0:
+        stdout_handler = BufferedStreamHandler(sys.stdout, buffer_size=settings.writer_buffer_size,
+                                               flush_interval=settings.writer_flush_interval)
+    else:
+        stdout_handler = logging.StreamHandler(sys.stdout)
     stdout_handler.setFormatter(log_formatter)
     root.addHandler(stdout_handler)
 
     # Redirect stdout and stderr to a logger instance.
-    _redirect_stdout_stderr()
+    _redirect_stdout_stderr(buffer_size=settings.redirect_buffer_size,
+                            flush_interval=settings.redirect_flush_interval)
 
     return root
 
 
-def _lt(queue: Queue):
+def _lt(queue: Queue, stats: Optional[QueueStats] = None):
     """
     This function acts as the thread that listens to the logger queue and sends queued logs to the logger instance.
     Args:
-        queue: A multiprocessing Queue, managed my a multiprocessing Manager.
+        queue: The queue created by logger_init(), carrying single records or batches of records.
+        stats: Adds up what the workers report dropping or delaying when the queue is full.
 
     Returns:
 
     """
     while True:
-        record = queue.get()
-        if record is None:
+        records = unpack(queue.get(), stats)
+        if records is None:
             break
-        logger = logging.getLogger(record.name)
-        logger.handle(record)
+        for record in records:
+            logger = logging.getLogger(record.name)
+            logger.handle(record)
 
 
-def logger_init(config: ConfigParser) -> LoggerManager:
+def logger_init(config: ConfigParser, settings: Optional[Settings] = None) -> LoggerManager:
     """
     This function initializes a logger as well as a thread to process logs produced by concurrent processes. Logs
     from concurrent processes should be passed through the multiprocessing queue stored in log.globals.logger_queue.
 
     Args:
         config: A ConfigParser containing the configuration.
+        settings: The settings loaded from the config, e.g. by configurations.config.get_settings(). They are loaded
+                  from the config if not given, e.g. for a config built by a test.
 
     Returns: A LoggerManager instance which can be used to terminate the logger thread at cleanup time.
 
     """
-    logger_dir = config.get('Logger', 'log_dir')
-
-    # Delete the directory if the config specifies to do so.
-    if config.getboolean('Logger', 'pre_purge'):
-        if os.path.isdir(logger_dir):
-            shutil.rmtree(logger_dir)
+    if settings is None:
+        settings = Settings.from_config(config)
+    logger_settings = settings.logger
+    logger_dir = logger_settings.log_dir
+
+    # Move the logs of the previous run out of the way with a rename, to keep them or to delete them in the background.
+    trash = trash_dir(logger_dir)
+    if logger_settings.run_history:
+        archive_run(logger_dir, logger_settings.runs_dir)
+    elif logger_settings.pre_purge:
+        move_to_trash(logger_dir, trash)
 
     if not os.path.isdir(logger_dir):
         os.makedirs(logger_dir)
+    if logger_settings.run_history:
+        mark_run_started(logger_dir)
+
+    housekeeper = None
+    if logger_settings.run_history or os.path.isdir(trash):
+        housekeeper = Housekeeper(trash, runs_dir=logger_settings.runs_dir if logger_settings.run_history else None,
+                                  keep_runs=logger_settings.keep_runs, keep_bytes=logger_settings.keep_bytes)
+        housekeeper.start()
 
-    log.globals.logger_queue = Manager().Queue()
+    log.globals.logger_queue = create_logger_queue(logger_settings, start_method=settings.pool.start_method)
+    apply_levels(parse_levels(logger_settings.levels))
 
-    _configure_logging_handlers(config)
+    compressor = get_rotation_compressor(logger_settings)
+    _configure_logging_handlers(logger_settings, compressor=compressor)
 
-    logger_thread = Thread(target=_lt, args=(log.globals.logger_queue,))
+    if logger_settings.transport == 'shards':
+        return LoggerManager(logger_thread=None, compressor=compressor, settings=logger_settings,
+                             housekeeper=housekeeper)
+
+    queue_stats = QueueStats(capacity=logger_settings.queue_capacity, overflow_policy=logger_settings.overflow_policy)
+    logger_thread = Thread(target=_lt, args=(log.globals.logger_queue, queue_stats))
     logger_thread.start()
 
-    return LoggerManager(logger_thread=logger_thread)
+    return LoggerManager(logger_thread=logger_thread, compressor=compressor, queue_stats=queue_stats,
+                         housekeeper=housekeeper)
 
 
 def get_logger(name: str, queue: Optional[Queue] = None) -> Logger:
@@ -325,6 +588,20 @@ def get_logger(name: str, queue: Optional[Queue] = None) -> Logger:
             multiprocessing_logger = get_logger(__name__, queue=queue)
             multiprocessing_logger.info('testing logger in multiprocessing')
 
+        The hook sizes its pool with hook.worker_pool.get_worker_pool() instead of mp.cpu_count(), and with [Pool]
+        adaptive = true a PoolSizer adjusts the number of busy workers to the memory and CPU time tasks use.
+
+        partial() pickles the parameters into every task. Publish large numpy arrays with
+        hook.shared_arrays.SharedArrayStore and pass the handles instead, so workers read them without a copy.
+
+        If the [Logger] transport is 'batched', log.globals.logger_queue can't be pickled into pool tasks. Hand it to
+        the workers when they start instead, and call get_logger(__name__) without a queue inside the function.
+
+        e.g.
+        pool = mp.Pool(processes=mp.cpu_count(),
+                       initializer=init_worker_logger,
+                       initargs=(log.globals.logger_queue,))
+
     5) When you are finished logging, close the logger using the LoggerManager returned from logger_init() (step 1)
 
         e.g.
@@ -344,21 +621,57 @@ def get_logger(name: str, queue: Optional[Queue] = None) -> Logger:
         '''
         pass
     elif queue is not None and current_process().name != 'MainProcess':
-        # Set up the queue handler for the logger instance.
-        queue_handler = logging.handlers.QueueHandler(queue)
-        queue_handler.set_name(name=current_process().pid.__str__())
+        handler_name = current_process().pid.__str__()
 
         # Get the root logger instance.
         root = _get_root_logger()
 
         # Redirect stdout to a logger instance
-        _redirect_stdout_stderr()
+        if isinstance(queue, (LogQueue, ShardTransport)):
+            _redirect_stdout_stderr(buffer_size=queue.redirect_buffer_size,
+                                    flush_interval=queue.redirect_flush_interval)
+        else:
+            _redirect_stdout_stderr()
 
         # Add the handler if it doesn't already exist.
-        if queue_handler.name not in [x.name for x in root.handlers]:
+        if handler_name not in [x.name for x in root.handlers]:
+            # Set up the queue handler for the logger instance.
+            if isinstance(queue, ShardTransport):
+                queue_handler = ShardFileHandler(queue.shard_dir, flush_interval=queue.flush_interval)
+                # Write out the shard when the worker process exits. Multiprocessing children skip atexit, but run
+                # their finalizers, after the redirected streams are flushed (30).
+                util.Finalize(None, queue_handler.close, exitpriority=20)
+            elif isinstance(queue, BatchedLogQueue):
+                queue_handler = BatchingQueueHandler(queue)
+            elif isinstance(queue, LogQueue):
+                queue_handler = LogQueueHandler(queue)
+            else:
+                queue_handler = logging.handlers.QueueHandler(queue)
+            # Drop records below the configured thresholds in the worker, before they are pickled and enqueued.
+            if isinstance(queue, (LogQueue, ShardTransport)):
+                apply_levels(queue.levels)
+            queue_handler.set_name(name=handler_name)
+
             # Add the queue handler.
             root.addHandler(queue_handler)
 
     logger = logging.getLogger(name=name)
 
     return logger
+
+
+def init_worker_logger(queue: Queue) -> None:
+    """
+    This function sets up queue logging in a worker process. It is intended to be used as a multiprocessing Pool
+    initializer so that the queue handler is created once per worker, and works with every logger transport.
+
+    e.g.
+    pool = mp.Pool(processes=mp.cpu_count(), initializer=init_worker_logger, initargs=(log.globals.logger_queue,))
+
+    Args:
+        queue: A Queue instance generated by logger_init(), held in the variable log.globals.logger_queue
+
+    Returns:
+
+    """
+    get_logger(current_process().name, queue=queue)
@@ -0,0 +1,287 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import re
+import sys
+import gzip
+import mmap
+import time
+import logging
+import argparse
+
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from log.index import COMPRESSED_SUFFIXES, read_index
+
+LOG_FILE_NAME = 'scheduled_vm.log'
+LOG_FILE_REGEX = re.compile(re.escape(LOG_FILE_NAME) + r'(?:\.(\d+))?(' +
+                            '|'.join(re.escape(x) for x in COMPRESSED_SUFFIXES) + r')?$')
+# The start of a record written with log_setup._get_log_formatter(). Lines which don't match continue a record.
+RECORD_REGEX = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),(\d{3}):\s+(\w+) > ', re.MULTILINE)
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def parse_time(text: str) -> float:
+    """
+    This function parses a time in the format of the log files, with optional milliseconds, as local time.
+    Args:
+        text: e.g. '2021-06-01 13:45:00' or '2021-06-01 13:45:00,250'.
+
+    Returns: The time since the epoch.
+
+    """
+    text, _, milliseconds = text.strip().partition(',')
+    return time.mktime(time.strptime(text, TIME_FORMAT)) + (int(milliseconds) / 1000 if milliseconds else 0)
+
+
+def log_files(folder: str) -> List[str]:
+    """
+    This function lists the log files of a folder, oldest first.
+    Args:
+        folder: The log directory, or a LOGSEG folder in it.
+
+    Returns: The paths of the log files, from the oldest backup to the file being written.
+
+    """
+    files = []
+    for name in os.listdir(folder):
+        match = LOG_FILE_REGEX.match(name)
+        if match:
+            files.append((int(match.group(1) or 0), os.path.join(folder, name)))
+    return [path for _, path in sorted(files, reverse=True)]
+
+
+def segment_folders(log_dir: str) -> Dict[str, str]:
+    """
+    This function finds the LOGSEG folders of a log directory.
+    Args:
+        log_dir: The log directory.
+
+    Returns: A dict of segment name to folder path.
+
+    """
+    folders = {}
+    for folder, _, names in os.walk(log_dir):
+        if folder != log_dir and any(LOG_FILE_REGEX.match(x) for x in names):
+            folders[os.path.relpath(folder, log_dir).replace(os.sep, '/')] = folder
+    return folders
+
+
+def _read(path: str, start: int, end: Optional[int]) -> bytes:
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            f.seek(start)
+            return f.read(-1 if end is None else end - start)
+    if path.endswith('.zst'):
+        import zstandard
+        with open(path, 'rb') as raw, zstandard.ZstdDecompressor().stream_reader(raw) as f:
+            f.seek(start)
+            return f.read(-1 if end is None else end - start)
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if start >= size:
+            return b''
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return mapped[start:size if end is None else end]
+
+
+class LogQuery:
+    """
+    Finds the records of the log files matching a time range, minimum level and text. Blocks of the sidecar index
+    (see log.index) which can't hold a match are skipped without being read, and the rest are read directly. Parts of
+    a file which aren't indexed are read in full.
+    """
+
+    def __init__(self, since: Optional[float] = None, until: Optional[float] = None, level: Optional[int] = None,
+                 text: Optional[str] = None):
+        """
+        Args:
+            since: Only records at or after this time.
+            until: Only records at or before this time.
+            level: Only records at or above this level.
+            text: Only records containing this text.
+        """
+        self.since = since
+        self.until = until
+        self.level = level
+        self.text = text
+
+        self.blocks_read = 0
+        self.blocks_skipped = 0
+        self.bytes_read = 0
+
+    def _block_matches(self, block: Dict) -> bool:
+        if self.since is not None and block['last'] < self.since:
+            return False
+        if self.until is not None and block['first'] > self.until:
+            return False
+        if self.level is not None:
+            levels = [logging.getLevelName(name) for name, count in block['levels'].items() if count]
+            # Custom level names which aren't registered in this process can't be compared, so read the block.
+            return any(not isinstance(level, int) or level >= self.level for level in levels)
+        return True
+
+    def _record_matches(self, match, record: str) -> bool:
+        if self.level is not None:
+            level = logging.getLevelName(match.group(3))
+            if isinstance(level, int) and level < self.level:
+                return False
+        if self.since is not None or self.until is not None:
+            created = parse_time(f'{match.group(1)},{match.group(2)}')
+            # Record times are written to the millisecond.
+            if self.since is not None and created < self.since - 0.001:
+                return False
+            if self.until is not None and created > self.until:
+                return False
+        return self.text is None or self.text in record
+
+    def _regions(self, path: str) -> List[Tuple[int, Optional[int]]]:
+        regions = []
+        position = 0
+        for block in read_index(path):
+            if block['start'] > position:
+                regions.append((position, block['start']))
+            if self._block_matches(block):
+                regions.append((block['start'], block['end']))
+            else:
+                self.blocks_skipped += 1
+            position = max(position, block['end'])
+        # Whatever follows the last indexed block, e.g. the block being written.
+        regions.append((position, None))
+        return regions
+
+    def records(self, path: str) -> Iterator[str]:
+        """
+        Find the matching records of a log file.
+        Args:
+            path: The path of the log file, which may be compressed.
+
+        Returns: An iterator of the matching records, in file order.
+
+        """
+        for start, end in self._regions(path):
+            data = _read(path, start, end)
+            if not data:
+                continue
+            self.blocks_read += 1
+            self.bytes_read += len(data)
+            text = data.decode('utf-8', errors='replace')
+            matches = list(RECORD_REGEX.finditer(text))
+            for i, match in enumerate(matches):
+                record = text[match.start():matches[i + 1].start() if i + 1 < len(matches) else len(text)]
+                if self._record_matches(match, record):
+                    yield record.rstrip('\n')
+
+    def run(self, log_dir: str, segments: Optional[List[str]] = None) -> Iterator[Tuple[Optional[str], str]]:
+        """
+        Find the matching records of a log directory.
+        Args:
+            log_dir: The log directory.
+            segments: The LOGSEG folders to search. None searches the main log files only, and ['*'] searches the
+                      main log files and every LOGSEG folder.
+
+        Returns: An iterator of (segment name or None for the main log, record).
+
+        """
+        folders: List[Tuple[Optional[str], str]] = []
+        if segments is None or '*' in segments:
+            folders.append((None, log_dir))
+        if segments:
+            available = segment_folders(log_dir)
+            names = sorted(available) if '*' in segments else segments
+            folders.extend((name, available.get(name, os.path.join(log_dir, name))) for name in names)
+
+        for segment, folder in folders:
+            if not os.path.isdir(folder):
+                continue
+            for path in log_files(folder):
+                for record in self.records(path):
+                    yield segment, record
+
+
+def summarise(log_dir: str) -> Iterator[str]:
+    """
+    This function summarises the time range and level counts of every indexed log file, from the indexes alone.
+    Args:
+        log_dir: The log directory.
+
+    Returns: An iterator of summary lines.
+
+    """
+    folders = [('', log_dir)] + sorted(segment_folders(log_dir).items())
+    for segment, folder in folders:
+        for path in log_files(folder):
+            blocks = read_index(path)
+            if not blocks:
+                yield f'{path}: not indexed'
+                continue
+            levels: Dict[str, int] = {}
+            for block in blocks:
+                for name, count in block['levels'].items():
+                    levels[name] = levels.get(name, 0) + count
+            first = time.strftime(TIME_FORMAT, time.localtime(min(x['first'] for x in blocks)))
+            last = time.strftime(TIME_FORMAT, time.localtime(max(x['last'] for x in blocks)))
+            counts = ', '.join(f'{name} {count}' for name, count in sorted(levels.items()))
+            yield f'{path}: {first} to {last}, {len(blocks)} blocks, {counts}'
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Query the log files, reading only the indexed blocks that can "
+                                                 "match.")
+    parser.add_argument('log_dir', nargs='?', default='log/logs', help="The log directory, e.g. an unzipped "
+                                                                        "vm_logs.zip.")
+    parser.add_argument('--since', type=parse_time, help="Only records at or after this time, e.g. "
+                                                         "'2021-06-01 13:45:00'.")
+    parser.add_argument('--until', type=parse_time, help="Only records at or before this time.")
+    parser.add_argument('--level', help="Only records at or above this level, e.g. WARNING.")
+    parser.add_argument('--grep', help="Only records containing this text.")
+    parser.add_argument('--segment', action='append', help="Search this LOGSEG folder instead of the main log. "
+                                                           "Repeatable, '*' searches every folder.")
+    parser.add_argument('--stats', action='store_true', help="Summarise the indexes instead of querying.")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.log_dir):
+        parser.error(f"Log directory '{args.log_dir}' does not exist.")
+
+    if args.stats:
+        for line in summarise(args.log_dir):
+            print(line)
+        return 0
+
+    level = None
+    if args.level:
+        level = logging.getLevelName(args.level.upper())
+        if not isinstance(level, int):
+            parser.error(f"Unknown level '{args.level}'.")
+
+    query = LogQuery(since=args.since, until=args.until, level=level, text=args.grep)
+    for segment, record in query.run(args.log_dir, segments=args.segment):
+        print(f'[{segment}] {record}' if segment else record)
+    print(f'Read {query.blocks_read} blocks ({query.bytes_read} bytes), skipped {query.blocks_skipped}.',
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
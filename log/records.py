@@ -0,0 +1,90 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import re
+import logging
+
+from logging import LogRecord
+
+from typing import Optional, Tuple
+
+LOGSEG_PREFIX = 'LOGSEG('
+LOGSEG_REGEX = re.compile(r'LOGSEG\((.*?)\)')
+
+# The slim wire format: (name, levelno, rendered message, created, pid, LOGSEG folder name or None).
+SlimRecord = Tuple[str, int, str, float, int, Optional[str]]
+
+
+def parse_logseg(log: str) -> Tuple[str, Optional[str]]:
+    """
+    This function extracts the LOGSEG(name) tag from a log string. Strings without a tag are returned untouched
+    after a single substring check, so untagged records never reach the regex engine.
+    Args:
+        log: The log string to be processed.
+
+    Returns: A Tuple containing the message without segregation tags and the segregate folder name, or None if the
+             log string is not tagged.
+
+    """
+    if not isinstance(log, str) or LOGSEG_PREFIX not in log:
+        return log, None
+    match = LOGSEG_REGEX.search(log)
+    if match is None:
+        return log, None
+    final_message = log[:match.start()] + log[match.end():]
+    # Rewrite the log message to not include any further segregation tags.
+    if LOGSEG_PREFIX in final_message:
+        final_message = LOGSEG_REGEX.sub('', final_message)
+    return final_message, match.group(1)
+
+
+def encode_record(message: str, record: LogRecord) -> SlimRecord:
+    """
+    This function packs a record into the slim wire format. Only the rendered message travels, so args and exc_info,
+    which can be large or unpicklable, are never pickled.
+    Args:
+        message: The record rendered by the worker's handler, including any traceback.
+        record: The record.
+
+    Returns: The slim record.
+
+    """
+    message, logseg = parse_logseg(message)
+    return record.name, record.levelno, message, record.created, record.process, logseg
+
+
+def decode_record(item: SlimRecord) -> LogRecord:
+    """
+    This function rebuilds a LogRecord from the slim wire format. The LOGSEG folder name is kept on the record's
+    logseg attribute, so the main process doesn't parse the message again.
+    Args:
+        item: The slim record.
+
+    Returns: The LogRecord.
+
+    """
+    name, levelno, message, created, pid, logseg = item
+    return logging.makeLogRecord({'name': name, 'levelno': levelno, 'levelname': logging.getLevelName(levelno),
+                                  'msg': message, 'created': created, 'msecs': (created - int(created)) * 1000,
+                                  'process': pid, 'logseg': logseg})
@@ -0,0 +1,177 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import json
+import heapq
+import shutil
+import tempfile
+
+from contextlib import ExitStack, closing
+
+from typing import Iterable, Iterator, List
+
+import logging
+from logging import LogRecord
+
+from log.records import SlimRecord, decode_record, encode_record
+from log.writer import GroupCommitMixin
+
+# Folder of the log directory holding the shards of a run until terminate_logger() merges them.
+SHARD_FOLDER = '.shards'
+SHARD_SUFFIX = '.jsonl'
+
+# Characters a process buffers before appending them to its shard.
+SHARD_BUFFER_SIZE = 65536
+
+# Most shards merged at once. More are merged in passes, so the merge never runs out of file descriptors.
+MERGE_FAN_IN = 128
+
+
+def shard_dir(log_dir: str) -> str:
+    """
+    This function gets the folder the processes of a run write their log shards to.
+    Args:
+        log_dir: The [Logger] log_dir.
+
+    Returns: The shard folder.
+
+    """
+    return os.path.join(log_dir, SHARD_FOLDER)
+
+
+class ShardFileHandler(GroupCommitMixin, logging.Handler):
+    """
+    A handler which group commits records to a shard file of its own process, {directory}/{pid}.jsonl, one slim record
+    (see log.records.encode_record) per line. The LOGSEG tag is parsed when the record is written, and kept as a field
+    for the merge. A handler inherited by a forked child starts a shard for the child, dropping the parent's buffer.
+    """
+
+    def __init__(self, directory: str, flush_interval: float = 1.0, buffer_size: int = SHARD_BUFFER_SIZE):
+        logging.Handler.__init__(self)
+        self.directory = directory
+        self.pid = os.getpid()
+        self.stream = None
+        self._init_group_commit(buffer_size=buffer_size, flush_interval=flush_interval)
+
+    def format(self, record: LogRecord) -> str:
+        return json.dumps(encode_record(super().format(record), record), ensure_ascii=False)
+
+    def emit(self, record: LogRecord) -> None:
+        if self.pid != os.getpid():
+            self._reset()
+        super().emit(record)
+
+    def _reset(self) -> None:
+        # The buffer and stream belong to the parent process.
+        self.pid = os.getpid()
+        self.stream = None
+        self.buffer, self.buffer_len = [], 0
+
+    def _commit(self, messages: List[str]) -> None:
+        if self.pid != os.getpid():
+            return
+        if self.stream is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.stream = open(os.path.join(self.directory, f'{self.pid}{SHARD_SUFFIX}'), 'a', encoding='utf-8')
+        self.stream.write(''.join(messages))
+        self.stream.flush()
+
+    def close(self) -> None:
+        super().close()
+        if self.stream is not None and self.pid == os.getpid():
+            self.stream.close()
+        self.stream = None
+
+
+def shard_paths(directory: str) -> List[str]:
+    """
+    This function lists the shards in a folder.
+    Args:
+        directory: The shard folder.
+
+    Returns: The paths of the shards, sorted by name.
+
+    """
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, x) for x in sorted(os.listdir(directory)) if x.endswith(SHARD_SUFFIX)]
+
+
+def _read_shard(path: str) -> Iterator[SlimRecord]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            # The last line of a process which was killed mid-write is incomplete.
+            try:
+                yield tuple(json.loads(line))
+            except ValueError:
+                continue
+
+
+def _merge(shards: Iterable[Iterator[SlimRecord]]) -> Iterator[SlimRecord]:
+    # Records of one shard are in time order, ties keep the order of the shards. Slim records hold created at 3.
+    return heapq.merge(*shards, key=lambda x: x[3])
+
+
+def merge_shards(directory: str, fan_in: int = MERGE_FAN_IN) -> Iterator[LogRecord]:
+    """
+    This function merges the shards in a folder by record time, holding one record of each open shard in memory. If
+    there are more than fan_in shards, groups of them are first merged into temporary shards in the same folder.
+    Args:
+        directory: The shard folder.
+        fan_in: Most shards open at once.
+
+    Returns: The records of every shard, oldest first.
+
+    """
+    paths = shard_paths(directory)
+    while len(paths) > fan_in:
+        merged = []
+        for start in range(0, len(paths), fan_in):
+            group = paths[start:start + fan_in]
+            fd, path = tempfile.mkstemp(prefix='merge-', suffix=SHARD_SUFFIX, dir=directory)
+            with open(fd, 'w', encoding='utf-8') as out:
+                for item in _merge(_read_shard(x) for x in group):
+                    out.write(json.dumps(item, ensure_ascii=False) + '\n')
+            for x in group:
+                os.remove(x)
+            merged.append(path)
+        paths = merged
+
+    with ExitStack() as stack:
+        shards = [stack.enter_context(closing(_read_shard(x))) for x in paths]
+        for item in _merge(shards):
+            yield decode_record(item)
+
+
+def remove_shards(directory: str) -> None:
+    """
+    This function removes a shard folder once its records have been merged.
+    Args:
+        directory: The shard folder.
+
+    Returns:
+
+    """
+    shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,305 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import sys
+import json
+import zlib
+import shutil
+import argparse
+
+from typing import Any, Dict, List, Optional
+
+MANIFEST_PATH = '~/.cache/scheduled-vm/log_shipping.json'
+# The head of a file is checksummed to tell a file which was rewritten in place from one which only grew.
+HEAD_BYTES = 4096
+CHUNK_BYTES = 1048576
+
+
+class ShippingTransport:
+    """
+    Where shipped log files go. Names are paths relative to the log directory, using '/' separators.
+    """
+
+    def write(self, name: str, offset: int, data: bytes, truncate: bool = False) -> None:
+        """
+        Write data into a shipped file.
+        Args:
+            name: The file name.
+            offset: The byte offset to write at. Everything before it has already been shipped.
+            data: The bytes to write.
+            truncate: Whether to discard the file's current content first. Only used with an offset of 0.
+
+        Returns:
+
+        """
+        raise NotImplementedError
+
+    def rename(self, source: str, target: str) -> None:
+        raise NotImplementedError
+
+    def delete(self, name: str) -> None:
+        raise NotImplementedError
+
+
+class LocalDirectoryTransport(ShippingTransport):
+    """
+    Ships log files into a directory, which mirrors the log directory.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, name: str) -> str:
+        path = os.path.join(self.root, *name.split('/'))
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        return path
+
+    def write(self, name: str, offset: int, data: bytes, truncate: bool = False) -> None:
+        path = self._path(name)
+        with open(path, 'wb' if truncate or not os.path.exists(path) else 'r+b') as f:
+            f.seek(offset)
+            f.write(data)
+
+    def rename(self, source: str, target: str) -> None:
+        os.replace(self._path(source), self._path(target))
+
+    def delete(self, name: str) -> None:
+        path = self._path(name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class BundleTransport(ShippingTransport):
+    """
+    Records the shipped changes in a bundle directory, to be copied elsewhere and replayed with apply_bundle(). If
+    the bundle already exists, e.g. because it wasn't fetched yet, the changes are appended to it.
+    """
+
+    JOURNAL = 'journal.jsonl'
+
+    def __init__(self, bundle_dir: str):
+        self.bundle_dir = bundle_dir
+        if not os.path.isdir(os.path.join(bundle_dir, 'data')):
+            os.makedirs(os.path.join(bundle_dir, 'data'))
+        self.data_count = len(os.listdir(os.path.join(bundle_dir, 'data')))
+
+    def _record(self, operation: Dict[str, Any]) -> None:
+        with open(os.path.join(self.bundle_dir, self.JOURNAL), 'a') as f:
+            f.write(json.dumps(operation) + '\n')
+
+    def write(self, name: str, offset: int, data: bytes, truncate: bool = False) -> None:
+        data_name = f'{self.data_count:08d}'
+        self.data_count += 1
+        with open(os.path.join(self.bundle_dir, 'data', data_name), 'wb') as f:
+            f.write(data)
+        self._record({'op': 'write', 'name': name, 'offset': offset, 'truncate': truncate, 'data': data_name})
+
+    def rename(self, source: str, target: str) -> None:
+        self._record({'op': 'rename', 'source': source, 'target': target})
+
+    def delete(self, name: str) -> None:
+        self._record({'op': 'delete', 'name': name})
+
+
+def apply_bundle(bundle_dir: str, transport: ShippingTransport) -> int:
+    """
+    This function replays the changes recorded by a BundleTransport.
+    Args:
+        bundle_dir: The bundle directory.
+        transport: Where to apply the changes, e.g. a LocalDirectoryTransport.
+
+    Returns: The number of changes applied.
+
+    """
+    journal = os.path.join(bundle_dir, BundleTransport.JOURNAL)
+    if not os.path.exists(journal):
+        return 0
+    count = 0
+    with open(journal, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            operation = json.loads(line)
+            if operation['op'] == 'write':
+                with open(os.path.join(bundle_dir, 'data', operation['data']), 'rb') as data:
+                    transport.write(operation['name'], operation['offset'], data.read(),
+                                    truncate=operation['truncate'])
+            elif operation['op'] == 'rename':
+                transport.rename(operation['source'], operation['target'])
+            elif operation['op'] == 'delete':
+                transport.delete(operation['name'])
+            count += 1
+    return count
+
+
+def _head_checksum(path: str, size: int) -> int:
+    with open(path, 'rb') as f:
+        return zlib.crc32(f.read(min(size, HEAD_BYTES)))
+
+
+class LogShipper:
+    """
+    Ships a log directory incrementally. A manifest keeps the identity (device and inode), shipped size and head
+    checksum of every file. Each sync only sends the bytes appended since the last one and files which are new. Files
+    renamed by rotation, e.g. scheduled_vm.log to scheduled_vm.log.1, are renamed at the destination instead of being
+    sent again. Delete the manifest to ship everything again.
+
+    e.g.
+    shipper = LogShipper('log/logs', LocalDirectoryTransport('/mnt/log_mirror'))
+    shipper.sync()
+    """
+
+    def __init__(self, log_dir: str, transport: ShippingTransport, manifest_path: str = MANIFEST_PATH):
+        self.log_dir = log_dir
+        self.transport = transport
+        self.manifest_path = os.path.expanduser(manifest_path)
+
+    def _read_manifest(self) -> Dict[str, Dict[str, int]]:
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)['files']
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def _write_manifest(self, files: Dict[str, Dict[str, int]]) -> None:
+        directory = os.path.dirname(self.manifest_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Replace atomically so an interrupted sync never leaves a half written manifest.
+        with open(f'{self.manifest_path}.tmp', 'w') as f:
+            json.dump({'log_dir': os.path.abspath(self.log_dir), 'files': files}, f, indent=2)
+        os.replace(f'{self.manifest_path}.tmp', self.manifest_path)
+
+    def _scan(self) -> Dict[str, os.stat_result]:
+        manifest = os.path.abspath(self.manifest_path)
+        files = {}
+        for folder, _, names in os.walk(self.log_dir):
+            for file_name in names:
+                path = os.path.join(folder, file_name)
+                # Skip compressions which are still being written, they are shipped once renamed into place.
+                if os.path.abspath(path) == manifest or file_name.endswith('.partial'):
+                    continue
+                files[os.path.relpath(path, self.log_dir).replace(os.sep, '/')] = os.stat(path)
+        return files
+
+    def _ship(self, name: str, start: int, end: int) -> int:
+        with open(os.path.join(self.log_dir, *name.split('/')), 'rb') as f:
+            f.seek(start)
+            position = start
+            while True:
+                data = f.read(min(CHUNK_BYTES, end - position))
+                # Files shipped from the start are written even if empty, so they exist at the destination.
+                if data or position == 0:
+                    self.transport.write(name, position, data, truncate=position == 0)
+                position += len(data)
+                if not data or position >= end:
+                    return position
+
+    def sync(self) -> Dict[str, int]:
+        """
+        Ship what changed since the last sync.
+        Returns: A dict of counters: files, renamed, deleted, shipped_files, shipped_bytes and skipped_bytes (already
+                 shipped, so not sent again).
+
+        """
+        previous = self._read_manifest()
+        current = self._scan()
+        by_identity = {(x['dev'], x['ino']): name for name, x in previous.items()}
+        old_names = {name: by_identity.get((stat.st_dev, stat.st_ino)) for name, stat in current.items()}
+
+        moves = [(old_name, name) for name, old_name in old_names.items() if old_name is not None and old_name != name]
+        kept = set(x for x in old_names.values() if x is not None)
+        counters = {'files': len(current), 'renamed': len(moves), 'deleted': 0, 'shipped_files': 0,
+                    'shipped_bytes': 0, 'skipped_bytes': 0}
+
+        # Files which are gone, or whose name now belongs to another file, are removed first.
+        for name in previous:
+            if name not in kept:
+                self.transport.delete(name)
+                counters['deleted'] += 1
+        # Rotation shifts every backup along, so move through temporary names to never overwrite one.
+        for i, (old_name, _) in enumerate(moves):
+            self.transport.rename(old_name, f'{old_name}.shipping-{i}')
+        for i, (old_name, name) in enumerate(moves):
+            self.transport.rename(f'{old_name}.shipping-{i}', name)
+
+        manifest: Dict[str, Dict[str, int]] = {}
+        for name, stat in current.items():
+            path = os.path.join(self.log_dir, *name.split('/'))
+            entry = previous[old_names[name]] if old_names[name] is not None else None
+            # The head differs if the file was rewritten in place or its inode was reused, so ship it again.
+            intact = entry is not None and entry['size'] <= stat.st_size \
+                and _head_checksum(path, entry['size']) == entry['checksum']
+            shipped = entry['size'] if intact else 0
+
+            size = stat.st_size
+            if not intact or shipped < size:
+                size = self._ship(name, shipped, stat.st_size)
+                counters['shipped_files'] += 1
+                counters['shipped_bytes'] += size - shipped
+            counters['skipped_bytes'] += shipped
+            manifest[name] = {'dev': stat.st_dev, 'ino': stat.st_ino, 'size': size,
+                              'checksum': _head_checksum(path, size)}
+
+        self._write_manifest(manifest)
+        return counters
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Ship the log files incrementally, or apply a shipped bundle.")
+    commands = parser.add_subparsers(dest='command')
+    ship = commands.add_parser('ship', help="Ship what changed in the log directory since the last sync.")
+    ship.add_argument('log_dir', nargs='?', default='log/logs')
+    destination = ship.add_mutually_exclusive_group(required=True)
+    destination.add_argument('--to', help="Mirror the log directory into this directory.")
+    destination.add_argument('--bundle', help="Record the changes in this bundle directory, see apply.")
+    ship.add_argument('--manifest', default=MANIFEST_PATH, help="Where to keep what was already shipped.")
+    apply = commands.add_parser('apply', help="Apply a bundle to a mirror of the log directory.")
+    apply.add_argument('bundle_dir')
+    apply.add_argument('mirror_dir')
+    apply.add_argument('--remove', action='store_true', help="Remove the bundle once applied.")
+    args = parser.parse_args(argv)
+
+    if args.command == 'ship':
+        transport = LocalDirectoryTransport(args.to) if args.to else BundleTransport(args.bundle)
+        counters = LogShipper(args.log_dir, transport, manifest_path=args.manifest).sync()
+        print(f"Shipped {counters['shipped_bytes']} bytes from {counters['shipped_files']} of {counters['files']} "
+              f"files, skipped {counters['skipped_bytes']} bytes already shipped. Renamed {counters['renamed']}, "
+              f"deleted {counters['deleted']}.")
+    elif args.command == 'apply':
+        count = apply_bundle(args.bundle_dir, LocalDirectoryTransport(args.mirror_dir))
+        if args.remove:
+            shutil.rmtree(args.bundle_dir)
+        print(f"Applied {count} changes to {args.mirror_dir}.")
+    else:
+        parser.print_help()
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
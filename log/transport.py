@@ -0,0 +1,395 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import time
+
+from queue import Empty, Full
+from threading import Thread, Lock, Event
+from dataclasses import dataclass, field
+
+from typing import Dict, List, Optional, Sequence
+
+from configurations.settings import LoggerSettings
+
+from multiprocessing import Queue, Manager, get_all_start_methods, get_context, util
+
+from logging import LogRecord
+import logging.handlers
+
+from log.records import decode_record, encode_record
+from log.shards import shard_dir
+
+
+@dataclass
+class QueueReport:
+    """
+    The records a worker dropped, or had to wait to enqueue, because the logger queue was full. Sent through the queue
+    for the _lt thread to add up in a QueueStats.
+    """
+    pid: int
+    dropped: Dict[str, int] = field(default_factory=dict)
+    delayed: int = 0
+
+
+class QueueStats:
+    """
+    Adds up the QueueReports of every worker, for the summary logged by terminate_logger().
+    """
+
+    def __init__(self, capacity: int, overflow_policy: str):
+        self.capacity = capacity
+        self.overflow_policy = overflow_policy
+        self.dropped: Dict[str, int] = {}
+        self.delayed = 0
+
+    def add(self, report: QueueReport) -> None:
+        for level_name, count in report.dropped.items():
+            self.dropped[level_name] = self.dropped.get(level_name, 0) + count
+        self.delayed += report.delayed
+
+    def summary(self) -> str:
+        by_level = ', '.join(f'{name} {count}' for name, count in sorted(self.dropped.items()))
+        return f"Logger queue (capacity {self.capacity}, {self.overflow_policy}): dropped " \
+               f"{sum(self.dropped.values())}{f' ({by_level})' if by_level else ''}, delayed {self.delayed}."
+
+
+def _levelno(record) -> int:
+    # Slim records are tuples of (name, levelno, ...), see encode_record().
+    return record[1] if isinstance(record, tuple) else record.levelno
+
+
+def parse_levels(levels: Sequence[str]) -> Dict[str, int]:
+    """
+    This function parses per-logger level thresholds.
+    Args:
+        levels: Entries of the form 'logger.name:LEVEL'. 'root' names the root logger.
+
+    Returns: A dict of logger name to level number.
+
+    """
+    parsed = {}
+    for entry in levels:
+        name, _, level = entry.rpartition(':')
+        level_number = logging.getLevelName(level.strip().upper())
+        if not name.strip() or not isinstance(level_number, int):
+            raise ValueError(f"Invalid logger level '{entry}'. Expected 'logger.name:LEVEL', e.g. 'urllib3:WARNING'.")
+        parsed[name.strip()] = level_number
+    return parsed
+
+
+def apply_levels(levels: Dict[str, int]) -> None:
+    """
+    This function sets the level thresholds on the loggers of the current process, so that records below them are
+    dropped by the logger before a record is even created.
+    Args:
+        levels: A dict of logger name to level number, from parse_levels().
+
+    Returns:
+
+    """
+    for name, level in levels.items():
+        logging.getLogger(None if name == 'root' else name).setLevel(level)
+
+
+class LogQueue:
+    """
+    Wraps the queue produced by logger_init(), carrying the settings worker processes need to log through it: the
+    per-logger level thresholds, the wire format of records, the buffering of redirected stdout and stderr, and what
+    to do when the queue is full.
+    """
+
+    def __init__(self, queue, levels: Optional[Dict[str, int]] = None, wire_format: str = 'full',
+                 redirect_buffer_size: int = 0, redirect_flush_interval: float = 1.0, capacity: int = 0,
+                 overflow_policy: str = 'block', sample_rate: int = 10):
+        self.queue = queue
+        self.capacity = capacity
+        self.overflow_policy = overflow_policy
+        self.sample_rate = sample_rate
+        self.levels = levels or {}
+        self.wire_format = wire_format
+        self.redirect_buffer_size = redirect_buffer_size
+        self.redirect_flush_interval = redirect_flush_interval
+
+    def put(self, item) -> None:
+        self.queue.put(item)
+
+    def put_nowait(self, item) -> None:
+        self.queue.put_nowait(item)
+
+    def get(self):
+        return self.queue.get()
+
+    def qsize(self) -> int:
+        return self.queue.qsize()
+
+
+class BatchedLogQueue(LogQueue):
+    """
+    Wraps the queue produced by logger_init() when the batched transport is configured. Worker processes receiving
+    this object in get_logger() buffer their records locally and ship them to the _lt thread in batches.
+    """
+
+    def __init__(self, queue: Queue, batch_size: int, batch_interval: float, **kwargs):
+        super().__init__(queue, **kwargs)
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+
+
+class ShardTransport:
+    """
+    Stored in log.globals.logger_queue in place of a LogQueue when the shards transport is configured. There is no
+    queue: worker processes receiving this object in get_logger() write their records to a shard file of their own in
+    shard_dir, and terminate_logger() merges the shards by time (see log.shards). It carries the same level and
+    redirect settings as a LogQueue.
+    """
+
+    def __init__(self, shard_dir: str, flush_interval: float, levels: Optional[Dict[str, int]] = None,
+                 redirect_buffer_size: int = 0, redirect_flush_interval: float = 1.0):
+        self.shard_dir = shard_dir
+        self.flush_interval = flush_interval
+        self.levels = levels or {}
+        self.redirect_buffer_size = redirect_buffer_size
+        self.redirect_flush_interval = redirect_flush_interval
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    A QueueHandler which, with the 'slim' wire format, enqueues a small tuple of the rendered message, level, name,
+    time, pid and LOGSEG folder name instead of the whole LogRecord.
+
+    If the queue has a capacity, the overflow policy applies once it is full:
+    'block': Wait for room.
+    'drop_oldest': Drop the oldest queued item to make room.
+    'drop_below_warning': Drop records below WARNING, and wait for room for the rest.
+    'sample': Keep 1 in sample_rate records below WARNING, and wait for room for the rest.
+    Records at ERROR or above are never dropped. What was dropped or delayed is reported through the queue.
+    """
+
+    def __init__(self, queue: LogQueue):
+        super().__init__(queue.queue)
+        self.slim = queue.wire_format == 'slim'
+        self.capacity = queue.capacity
+        self.overflow_policy = queue.overflow_policy
+        self.sample_rate = queue.sample_rate
+
+        self.report = QueueReport(pid=os.getpid())
+        self._sampled = 0
+        if self.capacity > 0:
+            # Report on exit, after a batching handler's last flush (20) and before the queue is closed (10).
+            util.Finalize(None, self._send_report, args=(True,), exitpriority=15)
+
+    def prepare(self, record: LogRecord):
+        if self.slim:
+            return encode_record(self.format(record), record)
+        return super().prepare(record)
+
+    def enqueue(self, item) -> None:
+        if self.capacity <= 0:
+            self.queue.put_nowait(item)
+            return
+        try:
+            self.queue.put_nowait(item)
+        except Full:
+            self._overflow(item)
+        self._send_report()
+
+    def _drop(self, records: List, below: int, keep_every: int = 0) -> List:
+        kept = []
+        for record in records:
+            if isinstance(record, QueueReport) or _levelno(record) >= below:
+                kept.append(record)
+                continue
+            if keep_every:
+                self._sampled += 1
+                if (self._sampled - 1) % keep_every == 0:
+                    kept.append(record)
+                    continue
+            level_name = logging.getLevelName(_levelno(record))
+            self.report.dropped[level_name] = self.report.dropped.get(level_name, 0) + 1
+        return kept
+
+    def _overflow(self, item) -> None:
+        records = item if isinstance(item, list) else [item]
+        sentinel = False
+        if self.overflow_policy == 'drop_oldest':
+            try:
+                oldest = self.queue.get_nowait()
+            except Empty:
+                oldest = []
+            # The termination sentinel must stay behind every record.
+            sentinel = oldest is None
+            oldest = [] if oldest is None else oldest if isinstance(oldest, list) else [oldest]
+            # Records at ERROR or above taken from the oldest item travel on with this one.
+            records = self._drop(oldest, below=logging.ERROR) + records
+        elif self.overflow_policy == 'drop_below_warning':
+            records = self._drop(records, below=logging.WARNING)
+        elif self.overflow_policy == 'sample':
+            records = self._drop(records, below=logging.WARNING, keep_every=self.sample_rate)
+
+        if records:
+            item = records if isinstance(item, list) or len(records) > 1 else records[0]
+            try:
+                self.queue.put_nowait(item)
+            except Full:
+                self.report.delayed += len(records)
+                self.queue.put(item)
+        if sentinel:
+            self.queue.put(None)
+
+    def _send_report(self, final: bool = False) -> None:
+        if not self.report.dropped and not self.report.delayed:
+            return
+        report, self.report = self.report, QueueReport(pid=os.getpid())
+        try:
+            if final:
+                self.queue.put(report, timeout=5)
+            else:
+                self.queue.put_nowait(report)
+        except Full:
+            # Try again with the next record.
+            self.report = report
+
+
+class BatchingQueueHandler(LogQueueHandler):
+    """
+    A QueueHandler which collects prepared records into a local buffer and enqueues them as a single list, either once
+    the buffer holds batch_size records or once batch_interval seconds have passed since the last flush.
+    """
+
+    def __init__(self, queue: BatchedLogQueue):
+        super().__init__(queue)
+        self.batch_size = queue.batch_size
+        self.batch_interval = queue.batch_interval
+
+        self.buffer: List[LogRecord] = []
+        self.buffer_lock = Lock()
+        self.last_flush = time.monotonic()
+
+        # Flush buffered records on a timer so quiet workers don't hold logs back indefinitely.
+        self._stop_event = Event()
+        self._flush_thread = Thread(target=self._flush_periodically, daemon=True)
+        self._flush_thread.start()
+
+        # Flush when the worker process exits. Multiprocessing children skip atexit, but run their finalizers. The
+        # priority must be above the one multiprocessing uses to close the Queue's feeder thread (10).
+        util.Finalize(None, self.close, exitpriority=20)
+
+    def _flush_periodically(self) -> None:
+        while not self._stop_event.wait(self.batch_interval):
+            if time.monotonic() - self.last_flush >= self.batch_interval:
+                self.flush()
+
+    def emit(self, record: LogRecord) -> None:
+        try:
+            prepared = self.prepare(record)
+            with self.buffer_lock:
+                self.buffer.append(prepared)
+                full = len(self.buffer) >= self.batch_size
+            if full or time.monotonic() - self.last_flush >= self.batch_interval:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self) -> None:
+        """
+        Ship any buffered records to the queue as one batch.
+        Returns:
+
+        """
+        with self.buffer_lock:
+            batch, self.buffer = self.buffer, []
+            self.last_flush = time.monotonic()
+            # Enqueue while holding the lock so that batches from one process arrive in order.
+            if batch:
+                self.enqueue(batch)
+
+    def close(self) -> None:
+        self._stop_event.set()
+        self.flush()
+        super().close()
+
+
+def create_logger_queue(settings: LoggerSettings, start_method: Optional[str] = None):
+    """
+    This function creates the queue used to carry records from worker processes to the _lt thread, based on the
+    'transport' key of the [Logger] config section. The queue is wrapped in a LogQueue carrying the 'levels' and
+    'wire_format', 'redirect_*', 'queue_capacity', 'overflow_policy' and 'sample_rate' keys to the workers.
+
+    'manager' (default): A Manager().Queue() proxy. Each record is a round trip to the manager process, but the proxy
+    can be passed to pool tasks as a plain argument.
+    'batched': A plain multiprocessing Queue carrying batches of records. The queue must be handed to workers when they
+    start (Process args or a Pool initializer, see init_worker_logger()), and be created for their start method: a
+    queue created for fork can't be handed to spawned workers.
+    'shards': No queue, a ShardTransport instead. Every process, the main one included, writes its own shard file, and
+    terminate_logger() merges the shards into the log files by record time. Logging never waits on another process, but
+    the log files are only written once the run ends, and worker records are not echoed to stdout.
+
+    Args:
+        settings: The [Logger] settings.
+        start_method: The start method of the worker processes, see [Pool] start_method. Defaults to the current
+                      multiprocessing start method.
+
+    Returns: The LogQueue, or the ShardTransport, to store in log.globals.logger_queue.
+
+    """
+    worker_settings = dict(levels=parse_levels(settings.levels), wire_format=settings.wire_format,
+                           redirect_buffer_size=settings.redirect_buffer_size,
+                           redirect_flush_interval=settings.redirect_flush_interval,
+                           capacity=settings.queue_capacity, overflow_policy=settings.overflow_policy,
+                           sample_rate=settings.sample_rate)
+    if settings.transport == 'manager':
+        return LogQueue(queue=Manager().Queue(settings.queue_capacity), **worker_settings)
+    elif settings.transport == 'batched':
+        context = get_context(start_method if start_method in get_all_start_methods() else None)
+        return BatchedLogQueue(queue=context.Queue(settings.queue_capacity), batch_size=settings.batch_size,
+                               batch_interval=settings.batch_interval, **worker_settings)
+    elif settings.transport == 'shards':
+        return ShardTransport(shard_dir=shard_dir(settings.log_dir), flush_interval=settings.writer_flush_interval,
+                              levels=parse_levels(settings.levels), redirect_buffer_size=settings.redirect_buffer_size,
+                              redirect_flush_interval=settings.redirect_flush_interval)
+    raise ValueError(f"Unknown logger transport '{settings.transport}'. Expected 'manager', 'batched' or 'shards'.")
+
+
+def unpack(item, stats: Optional[QueueStats] = None) -> Optional[List[LogRecord]]:
+    """
+    This function normalises an item read from the logger queue into a list of records.
+    Args:
+        item: A single record, a list of records or the None sentinel. Records are LogRecords, or tuples in the slim
+              wire format. QueueReports may be mixed in.
+        stats: Adds up the QueueReports, which are not records.
+
+    Returns: A list of LogRecords, or None if the item is the termination sentinel.
+
+    """
+    if item is None:
+        return None
+    records = []
+    for x in item if isinstance(item, list) else [item]:
+        if isinstance(x, QueueReport):
+            if stats is not None:
+                stats.add(x)
+        else:
+            records.append(decode_record(x) if isinstance(x, tuple) else x)
+    return records
@@ -0,0 +1,253 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import time
+import weakref
+
+from threading import Thread, Lock
+
+from typing import List, Optional, Tuple
+
+import logging
+import logging.handlers
+
+from log.compression import RotationCompressor
+from log.index import LogIndexWriter
+
+
+class _GroupCommitFlusher:
+    """
+    A single daemon thread per process which commits the buffers of every group commit handler once their flush
+    interval has passed, so that the number of threads doesn't grow with the number of LOGSEG files. Handlers with a
+    flush interval of 0 commit on every record, so they are not registered.
+    """
+
+    def __init__(self):
+        self.handlers = weakref.WeakSet()
+        self.lock = Lock()
+        self.interval: Optional[float] = None
+        self.thread: Optional[Thread] = None
+
+    def register(self, handler: 'GroupCommitMixin') -> None:
+        # Sleeping 0 seconds between flushes would be a busy loop.
+        if handler.flush_interval <= 0:
+            return
+        with self.lock:
+            self.handlers.add(handler)
+            self.interval = handler.flush_interval if self.interval is None \
+                else min(self.interval, handler.flush_interval)
+            # The thread is not alive in a forked child, so start another one.
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = Thread(target=self._flush_periodically, daemon=True)
+                self.thread.start()
+
+    def unregister(self, handler: 'GroupCommitMixin') -> None:
+        with self.lock:
+            self.handlers.discard(handler)
+
+    def _flush_periodically(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                handlers = list(self.handlers)
+            now = time.monotonic()
+            for handler in handlers:
+                if handler.buffer and now - handler.last_commit >= handler.flush_interval:
+                    handler.flush()
+
+
+_flusher = _GroupCommitFlusher()
+
+
+class GroupCommitMixin:
+    """
+    Mixin for stream based handlers which formats records into an in-memory buffer and commits the buffer with a
+    single write, either once buffer_size characters are pending or once flush_interval seconds have passed since the
+    last commit. Classes using this mixin implement _commit().
+    """
+
+    terminator = '\n'
+
+    def _init_group_commit(self, buffer_size: int, flush_interval: float) -> None:
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+
+        self.buffer: List[str] = []
+        self.buffer_len = 0
+        self.last_commit = time.monotonic()
+
+        # Commit on a timer so that a quiet logger doesn't hold records back indefinitely.
+        _flusher.register(self)
+
+    def _commit(self, messages: List[str]) -> None:
+        raise NotImplementedError
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            msg = self.format(record) + self.terminator
+            self._buffer_record(record, msg)
+            if self.buffer_len >= self.buffer_size or time.monotonic() - self.last_commit >= self.flush_interval:
+                self.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def _buffer_record(self, record: logging.LogRecord, msg: str) -> None:
+        self.buffer.append(msg)
+        self.buffer_len += len(msg)
+
+    def flush(self) -> None:
+        """
+        Commit the pending buffer.
+        Returns:
+
+        """
+        self.acquire()
+        try:
+            messages, self.buffer, self.buffer_len = self.buffer, [], 0
+            self.last_commit = time.monotonic()
+            if messages:
+                self._commit(messages)
+        finally:
+            self.release()
+
+    def close(self) -> None:
+        _flusher.unregister(self)
+        self.flush()
+        super().close()
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    A RotatingFileHandler which hands rotated files to a RotationCompressor, if one is given, and indexes what it
+    writes in a sidecar file if index_block_seconds is above 0 (see log.index).
+    """
+
+    def __init__(self, filename: str, max_bytes: int, backup_count: int,
+                 compressor: Optional[RotationCompressor] = None, index_block_seconds: float = 0,
+                 index_block_bytes: int = 1048576):
+        logging.handlers.RotatingFileHandler.__init__(self, filename, maxBytes=max_bytes, backupCount=backup_count)
+        self.compressor = compressor
+        if compressor is not None:
+            self.namer = compressor.namer
+            self.rotator = compressor.rotator
+
+        self.index: Optional[LogIndexWriter] = None
+        if index_block_seconds > 0:
+            self.index = LogIndexWriter(self.baseFilename, backup_count=backup_count,
+                                        block_seconds=index_block_seconds, block_bytes=index_block_bytes,
+                                        encoding=self.encoding)
+        self._formatted: Optional[str] = None
+
+    def format(self, record: logging.LogRecord) -> str:
+        # Keep the text written for the record, so it can be indexed without formatting the record again.
+        self._formatted = super().format(record)
+        return self._formatted
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self._formatted = None
+        super().emit(record)
+        if self.index is not None and self._formatted is not None:
+            self.index.add(record.created, record.levelno, self._formatted + self.terminator)
+
+    def doRollover(self) -> None:
+        # Backups can only be shifted once the previous backup has its compressed name.
+        if self.compressor is not None:
+            self.compressor.wait_for(self.baseFilename)
+        super().doRollover()
+        if self.index is not None:
+            self.index.rotate()
+
+    def close(self) -> None:
+        if self.index is not None:
+            self.index.finish_block()
+        super().close()
+
+
+class BufferedRotatingFileHandler(GroupCommitMixin, CompressingRotatingFileHandler):
+    """
+    A RotatingFileHandler which group commits records. Rollover is checked at record boundaries while a commit is
+    written, so each file still holds less than max_bytes (unless a single record is larger) and backup_count files
+    are kept.
+    """
+
+    def __init__(self, filename: str, max_bytes: int, backup_count: int, buffer_size: int, flush_interval: float,
+                 compressor: Optional[RotationCompressor] = None, index_block_seconds: float = 0,
+                 index_block_bytes: int = 1048576):
+        CompressingRotatingFileHandler.__init__(self, filename, max_bytes=max_bytes, backup_count=backup_count,
+                                                compressor=compressor, index_block_seconds=index_block_seconds,
+                                                index_block_bytes=index_block_bytes)
+        # (created, levelno) of each buffered record, for the index.
+        self.buffer_records: List[Tuple[float, int]] = []
+        self._init_group_commit(buffer_size=buffer_size, flush_interval=flush_interval)
+
+    def _buffer_record(self, record: logging.LogRecord, msg: str) -> None:
+        super()._buffer_record(record, msg)
+        if self.index is not None:
+            self.buffer_records.append((record.created, record.levelno))
+
+    def _commit(self, messages: List[str]) -> None:
+        if self.stream is None:
+            self.stream = self._open()
+        # See bpo-45401: Never rollover anything other than regular files.
+        rolls_over = self.maxBytes > 0 and os.path.isfile(self.baseFilename)
+
+        # Both emit() and flush() hold the handler lock, so the records match the messages.
+        records, self.buffer_records = self.buffer_records, []
+
+        self.stream.seek(0, 2)
+        position = self.stream.tell()
+        chunk: List[str] = []
+        for i, msg in enumerate(messages):
+            if rolls_over and position + len(msg) >= self.maxBytes:
+                # Write out what fits in the current file before rolling it over.
+                if chunk:
+                    self.stream.write(''.join(chunk))
+                    chunk = []
+                self.doRollover()
+                position = 0
+            chunk.append(msg)
+            position += len(msg)
+            if self.index is not None:
+                self.index.add(records[i][0], records[i][1], msg)
+        if chunk:
+            self.stream.write(''.join(chunk))
+        self.stream.flush()
+
+
+class BufferedStreamHandler(GroupCommitMixin, logging.StreamHandler):
+    """
+    A StreamHandler which group commits records.
+    """
+
+    def __init__(self, stream, buffer_size: int, flush_interval: float):
+        logging.StreamHandler.__init__(self, stream)
+        self._init_group_commit(buffer_size=buffer_size, flush_interval=flush_interval)
+
+    def _commit(self, messages: List[str]) -> None:
+        self.stream.write(''.join(messages))
+        if hasattr(self.stream, 'flush'):
+            self.stream.flush()
@@ -0,0 +1,302 @@
+"""
+MIT License
+
+Copyright (c) 2021 Garett MacGowan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+Throughput and latency benchmark for the log.log_setup pipeline.
+
+Each case starts a fresh process which calls logger_init() on a temporary log directory, starts a pool of workers
+logging through get_logger(__name__, queue=...) and follows the root scheduled_vm.log as it is written. Latency is the
+time from a worker creating a record to its line being readable on disk, so it includes the transport, the _lt
+thread, LOGSEG handling, buffering and rotation. Throughput is measured from the first record created to the last
+record on disk.
+
+Usage (from the repository root):
+    python -m test.benchmark.benchmark_logger --workers 1,4 --message-sizes 64,1024 --output benchmark_results.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import argparse
+import itertools
+import subprocess
+
+from threading import Thread
+
+from typing import Dict, List, Optional
+
+from configparser import ConfigParser
+
+import multiprocessing as mp
+
+import log.globals
+from log.log_setup import get_logger, logger_init, init_worker_logger
+
+MARKER = 'BENCH '
+
+# Logger settings applied to every case, on top of which each case sets its own parameters.
+BASE_LOGGER_CONFIG = {
+    'pre_purge': 'false',
+    'backup_count': '2',
+    'batch_size': '512',
+    'batch_interval': '0.05',
+    'writer_flush_interval': '0.05',
+    'max_open_segments': '0',
+    'compression': 'none',
+    'compression_level': '6',
+}
+
+# Rotation pressure levels, as max_bytes for each log file.
+ROTATION_MAX_BYTES = {
+    'none': 0,
+    'low': 10000000,
+    'high': 100000,
+}
+
+
+class _LogFollower(Thread):
+    """
+    Follows a log file across rotations, recording the latency of each benchmark line as it becomes readable.
+    """
+
+    def __init__(self, path: str, expected: int, timeout: float, poll_interval: float = 0.0005):
+        super().__init__(daemon=True)
+        self.path = path
+        self.expected = expected
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+
+        self.latencies: List[float] = []
+        self.first_created: Optional[float] = None
+        self.last_seen: Optional[float] = None
+
+    def _consume(self, chunk: str, pending: str) -> str:
+        now = time.time()
+        lines = (pending + chunk).split('\n')
+        for line in lines[:-1]:
+            index = line.find(MARKER)
+            if index == -1:
+                continue
+            created = float(line[index + len(MARKER):].split(' ', 3)[2])
+            self.first_created = created if self.first_created is None else min(self.first_created, created)
+            self.latencies.append(now - created)
+            self.last_seen = now
+        return lines[-1]
+
+    def run(self) -> None:
+        deadline = time.monotonic() + self.timeout
+        f = open(self.path, 'r')
+        pending = ''
+        try:
+            while len(self.latencies) < self.expected and time.monotonic() < deadline:
+                chunk = f.read()
+                if chunk:
+                    pending = self._consume(chunk, pending)
+                    continue
+                # Switch to the new file once the handler has rotated the one being followed.
+                try:
+                    rotated = os.stat(self.path).st_ino != os.fstat(f.fileno()).st_ino
+                except FileNotFoundError:
+                    rotated = False
+                if rotated:
+                    pending = self._consume(f.read(), pending)
+                    f.close()
+                    f = open(self.path, 'r')
+                    continue
+                time.sleep(self.poll_interval)
+        finally:
+            f.close()
+
+
+def _produce(worker_index: int, records: int, message_size: int, fanout: int, rate: float) -> None:
+    """
+    This function logs benchmark records from a pool worker.
+    Args:
+        worker_index: The index of the worker, used to spread records over LOGSEG segments.
+        records: The number of records to log.
+        message_size: The number of padding characters in each record.
+        fanout: The number of LOGSEG segments to spread records over, 0 for untagged records.
+        rate: The records per second to log at, 0 for as fast as possible.
+
+    Returns:
+
+    """
+    logger = get_logger(__name__)
+    padding = 'x' * message_size
+    interval = 1 / rate if rate else 0
+    start = time.perf_counter()
+    for seq in range(records):
+        if interval:
+            delay = start + seq * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        tag = f'LOGSEG(segment_{(worker_index * records + seq) % fanout})' if fanout else ''
+        logger.info(f'{tag}{MARKER}{worker_index} {seq} {time.time():.6f} {padding}')
+
+
+def _percentile(values: List[float], percentile: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(percentile / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def _case_config(case: Dict, log_dir: str) -> ConfigParser:
+    config = ConfigParser()
+    config.add_section('Logger')
+    for key, value in BASE_LOGGER_CONFIG.items():
+        config.set('Logger', key, value)
+    config.set('Logger', 'log_dir', log_dir)
+    config.set('Logger', 'transport', case['transport'])
+    config.set('Logger', 'writer_buffer_size', str(case['writer_buffer_size']))
+    config.set('Logger', 'max_bytes', str(ROTATION_MAX_BYTES[case['rotation']]))
+    return config
+
+
+def _run_case(case: Dict, result_queue: mp.Queue) -> None:
+    """
+    This function runs one benchmark case. It runs in its own process so that logging state never leaks between
+    cases.
+    Args:
+        case: The parameters of the case.
+        result_queue: The queue to put the result of the case on.
+
+    Returns:
+
+    """
+    # Keep the stdout handler from flooding the console.
+    sys.stdout = open(os.devnull, 'w')
+
+    log_dir = tempfile.mkdtemp(prefix='log_benchmark_')
+    logger_manager = logger_init(_case_config(case, log_dir))
+
+    expected = case['workers'] * case['records_per_worker']
+    follower = _LogFollower(f'{log_dir}/scheduled_vm.log', expected=expected, timeout=case['timeout'])
+    follower.start()
+
+    pool = mp.Pool(processes=case['workers'], initializer=init_worker_logger, initargs=(log.globals.logger_queue,))
+    pool.starmap(_produce, [(i, case['records_per_worker'], case['message_size'], case['fanout'], case['rate'])
+                            for i in range(case['workers'])])
+    pool.close()
+    pool.join()
+
+    follower.join()
+    logger_manager.terminate_logger()
+    shutil.rmtree(log_dir, ignore_errors=True)
+
+    seen = len(follower.latencies)
+    elapsed = follower.last_seen - follower.first_created if seen else None
+    result_queue.put({
+        **case,
+        'records': expected,
+        'records_lost': expected - seen,
+        'seconds': elapsed,
+        'records_per_second': seen / elapsed if elapsed else None,
+        'latency_p50_ms': _percentile([x * 1000 for x in follower.latencies], 50),
+        'latency_p99_ms': _percentile([x * 1000 for x in follower.latencies], 99),
+    })
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(cases: List[Dict]) -> Dict:
+    """
+    This function runs each benchmark case in a fresh process.
+    Args:
+        cases: The parameters of each case.
+
+    Returns: A JSON serialisable dict holding the environment and the result of each case.
+
+    """
+    context = mp.get_context('spawn')
+    results = []
+    for case in cases:
+        result_queue = context.Queue()
+        process = context.Process(target=_run_case, args=(case, result_queue))
+        process.start()
+        result = result_queue.get()
+        process.join()
+        results.append(result)
+        print(json.dumps(result), file=sys.stderr)
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': mp.cpu_count(),
+        'results': results,
+    }
+
+
+def _csv(cast):
+    return lambda value: [cast(x) for x in value.split(',')]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the log.log_setup pipeline.')
+    parser.add_argument('--transports', type=_csv(str), default=['manager', 'batched'])
+    parser.add_argument('--workers', type=_csv(int), default=[1, 4])
+    parser.add_argument('--message-sizes', type=_csv(int), default=[64, 1024])
+    parser.add_argument('--fanouts', type=_csv(int), default=[0, 100])
+    parser.add_argument('--rotations', type=_csv(str), default=['none', 'high'],
+                        help=f'Rotation pressure levels, from {list(ROTATION_MAX_BYTES)}.')
+    parser.add_argument('--writer-buffer-sizes', type=_csv(int), default=[0])
+    parser.add_argument('--records-per-worker', type=int, default=5000)
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Records per second per worker, 0 to log as fast as possible.')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args(argv)
+
+    cases = [{
+        'transport': transport,
+        'workers': workers,
+        'message_size': message_size,
+        'fanout': fanout,
+        'rotation': rotation,
+        'writer_buffer_size': writer_buffer_size,
+        'records_per_worker': args.records_per_worker,
+        'rate': args.rate,
+        'timeout': args.timeout,
+    } for transport, workers, message_size, fanout, rotation, writer_buffer_size in itertools.product(
+        args.transports, args.workers, args.message_sizes, args.fanouts, args.rotations, args.writer_buffer_sizes)]
+
+    report = run_benchmarks(cases)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
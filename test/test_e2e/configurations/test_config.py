@@ -0,0 +1,80 @@
+import os
+
+from unittest import TestCase
+
+from configparser import ConfigParser
+
+from test.test_utils import common_test_setup, common_test_teardown
+
+import configurations.config
+from configurations.config import get_config, get_settings, clear_config_cache
+from configurations.settings import Settings
+
+
+class TestConfig(TestCase):
+    """
+    This class is responsible for testing the layered config and the typed settings.
+    """
+
+    def setUp(self) -> None:
+        common_test_setup()
+        clear_config_cache()
+        self.environment_vars_path = configurations.config.ENVIRONMENT_VARS_PATH
+        configurations.config.ENVIRONMENT_VARS_PATH = 'test/data/environment-vars'
+
+    def tearDown(self) -> None:
+        configurations.config.ENVIRONMENT_VARS_PATH = self.environment_vars_path
+        for name in ['CONFIG__POOL__PROCESSES', 'CONFIG__LOGGER__BATCH_SIZE']:
+            os.environ.pop(name, None)
+        clear_config_cache()
+        common_test_teardown()
+
+    def test_layered_config(self):
+        with open('test/data/environment-vars', 'w') as f:
+            f.write('export CONFIG__POOL__PROCESSES=3\n'
+                    'export CONFIG__DEADLINES__RUN_TIMEOUT="120"\n'
+                    'export UNRELATED=value\n')
+        os.environ['CONFIG__LOGGER__BATCH_SIZE'] = '16'
+
+        config = get_config()
+        assert config.get('Pool', 'chunk_size') == '1', "Options only in base.config should be layered in."
+        assert config.get('Pool', 'start_method') == 'spawn', "test.config should be read on top of base.config."
+        assert config.get('Pool', 'processes') == '3', "~/.environment-vars should override the files."
+        assert config.get('Logger', 'batch_size') == '16', "The environment should override the files."
+
+        settings = get_settings()
+        assert settings.pool.processes == 3 and settings.deadlines.run_timeout == 120.0, f"{settings}"
+        assert settings.pool.preload_modules == ('numpy',), f"{settings.pool}"
+        assert get_settings() is settings, "Settings should be loaded once per process."
+
+        # Every call returns a copy, so callers can't change each other's config.
+        config.set('Pool', 'processes', '7')
+        assert get_config().get('Pool', 'processes') == '3'
+
+        # Variables exported in the process win over the environment variables file.
+        os.environ['CONFIG__POOL__PROCESSES'] = '5'
+        clear_config_cache()
+        assert get_settings().pool.processes == 5
+
+    def test_settings_validation(self):
+        config = ConfigParser()
+        config.read_dict({'Logger': {'transport': 'carrier pigeon', 'max_bytes': 'lots'},
+                          'Pool': {'processes': '-1'}})
+        with self.assertRaises(ValueError) as context:
+            Settings.from_config(config)
+        message = str(context.exception)
+        for option in ['[Logger] transport', '[Logger] max_bytes', '[Pool] processes']:
+            assert option in message, f"Every invalid option should be reported.\n{message}"
+
+        # Levels valid for zstd are out of range for gzip.
+        for compression, level, valid in [('gzip', '9', True), ('gzip', '19', False), ('zstd', '19', True),
+                                          ('zstd', '23', False), ('none', '19', True)]:
+            config = ConfigParser()
+            config.read_dict({'Logger': {'compression': compression, 'compression_level': level}})
+            if valid:
+                assert Settings.from_config(config).logger.compression_level == int(level)
+                continue
+            with self.assertRaises(ValueError) as context:
+                Settings.from_config(config)
+            assert '[Logger] compression_level must be between 1 and' in str(context.exception) and \
+                f'for {compression}, got {level}.' in str(context.exception), str(context.exception)
@@ -0,0 +1,148 @@
+import time
+import asyncio
+import logging
+import threading
+
+from unittest import TestCase
+
+from test.test_utils import common_test_setup_w_logger, common_test_teardown_w_logger
+
+from log.log_setup import get_logger
+
+from hook.async_engine import AsyncEngine
+from hook.checkpoint import CheckpointStore
+
+
+class TestAsyncEngine(TestCase):
+    """
+    This class is responsible for testing the async engine's scheduling, limits, timeouts and logging.
+    """
+
+    def setUp(self) -> None:
+        self.logger_manager, _ = common_test_setup_w_logger()
+
+    def tearDown(self) -> None:
+        common_test_teardown_w_logger(logger_manager=self.logger_manager)
+
+    def test_dag_results_and_logging(self):
+        handlers = list(logging.getLogger().handlers)
+        counter = _Counter()
+
+        engine = AsyncEngine(concurrency=10)
+        engine.add_task('base', _base)
+        engine.add_task('squares', counter.square, items=range(20), depends_on=['base'], concurrency=3)
+        engine.add_task('total', _total, depends_on=['squares'])
+
+        results = engine.run()
+
+        assert [x.name for x in results] == ['base', 'squares', 'total'], f"Unexpected order.\n{results}"
+        assert all(x.ok for x in results), f"All tasks should succeed.\n{[x.error for x in results]}"
+        assert results[2].result == sum(10 + i * i for i in range(20))
+        assert counter.peak == 3, f"At most 3 calls of the task should run at once. Found {counter.peak}."
+        # The 3 workers of 'squares', the 3 task runners and the run itself, rather than a future per item.
+        assert counter.peak_tasks <= 7, f"Expected at most 7 asyncio tasks. Found {counter.peak_tasks}."
+        assert logging.getLogger().handlers == handlers, "The root handlers should be restored after the run."
+
+        self.logger_manager.terminate_logger()
+        with open('test/data/log/logs/scheduled_vm.log', 'r') as f:
+            content = f.read()
+            assert content.count('async square') == 20, f"Records logged on the loop should be written.\n{content}"
+
+    def test_retries_timeouts_and_deadline(self):
+        attempts = []
+
+        async def flaky():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RuntimeError('first attempt fails')
+            return 'recovered'
+
+        engine = AsyncEngine()
+        engine.add_task('flaky', flaky, retries=1)
+        engine.add_task('slow', _sleep, items=[0.01, 5], timeout=0.2)
+        engine.add_task('after_slow', _base, depends_on=['slow'])
+
+        results = {x.name: x for x in engine.run()}
+
+        assert results['flaky'].ok and results['flaky'].attempts == 2, results['flaky'].error
+        assert not results['slow'].ok and 'TimeoutError' in results['slow'].error, results['slow'].error
+        assert results['after_slow'].error == "Dependency 'slow' failed.", results['after_slow'].error
+
+        engine = AsyncEngine()
+        engine.add_task('slow', _sleep, items=[30])
+        engine.add_task('after', _base, depends_on=['slow'])
+
+        started = time.monotonic()
+        results = {x.name: x for x in engine.run(timeout=0.5)}
+
+        assert time.monotonic() - started < 5, "The run should stop at its deadline."
+        assert engine.timed_out, "The run should stop at its deadline."
+        assert 'deadline' in results['slow'].error, f"Unexpected error.\n{results['slow'].error}"
+        assert 'deadline' in results['after'].error, f"Unexpected error.\n{results['after'].error}"
+
+    def test_checkpoints_recorded_off_the_loop(self):
+        checkpoint = _ThreadRecordingStore('test/data/checkpoints/scheduled_vm.sqlite')
+        counter = _Counter()
+
+        engine = AsyncEngine(concurrency=10, checkpoint=checkpoint)
+        engine.add_task('base', _base)
+        engine.add_task('squares', counter.square, items=range(50), depends_on=['base'])
+        results = engine.run()
+
+        assert all(x.ok for x in results), f"All tasks should succeed.\n{[x.error for x in results]}"
+        assert len(checkpoint.completed('squares')) == 50, "Every call should be checkpointed once the run returns."
+        assert threading.get_ident() not in checkpoint.threads, "Checkpoints should not be written on the loop."
+
+        # A rerun resumes from the checkpoint without calling anything.
+        engine = AsyncEngine(checkpoint=checkpoint)
+        engine.add_task('base', _base)
+        engine.add_task('squares', counter.square, items=range(50), depends_on=['base'])
+        results = engine.run()
+        assert results[1].attempts == 0 and results[1].result == [10 + i * i for i in range(50)], results[1]
+        checkpoint.close()
+
+
+# ---- test_checkpoints_recorded_off_the_loop helpers ---- #
+
+class _ThreadRecordingStore(CheckpointStore):
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.threads = set()
+
+    def record(self, task, units):
+        self.threads.add(threading.get_ident())
+        super().record(task, units)
+
+
+# ---- test_dag_results_and_logging helpers ---- #
+
+class _Counter:
+
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+        self.peak_tasks = 0
+
+    async def square(self, i: int, base: int):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        self.peak_tasks = max(self.peak_tasks, len(asyncio.all_tasks()))
+        await asyncio.sleep(0.01)
+        get_logger('async_test').info(f'async square {i}')
+        self.running -= 1
+        return base + i * i
+
+
+async def _base():
+    return 10
+
+
+async def _total(squares):
+    return sum(squares)
+
+
+# ---- test_retries_timeouts_and_deadline helpers ---- #
+
+async def _sleep(seconds: float):
+    await asyncio.sleep(seconds)
@@ -0,0 +1,47 @@
+import os
+import logging
+
+from unittest import TestCase
+
+from test.test_utils import common_test_setup, common_test_teardown
+
+from hook.bootstrap import bootstrap, log_last_bootstrap
+
+
+class TestBootstrap(TestCase):
+    """
+    This class is responsible for testing that bootstrapping skips pip when the requirements are unchanged.
+    """
+
+    def setUp(self) -> None:
+        common_test_setup()
+        self.requirements = 'test/data/requirements.txt'
+        self.wheelhouse = 'test/data/wheelhouse'
+        self.state = 'test/data/bootstrap.json'
+
+    def tearDown(self) -> None:
+        common_test_teardown()
+
+    def test_skip_unchanged_requirements(self):
+        # pip is always installed, so the offline install succeeds without any wheels.
+        with open(self.requirements, 'w') as f:
+            f.write('pip\n')
+
+        first = bootstrap(self.requirements, self.wheelhouse, self.state)
+        assert first['ok'] and first['path'] == 'wheelhouse', f"The first boot should install. Found {first}"
+        assert os.path.isdir(self.wheelhouse), "The wheelhouse should be created."
+
+        second = bootstrap(self.requirements, self.wheelhouse, self.state)
+        assert second['path'] == 'skipped', f"Unchanged requirements should skip pip. Found {second}"
+
+        with open(self.requirements, 'a') as f:
+            f.write('# changed\n')
+        third = bootstrap(self.requirements, self.wheelhouse, self.state)
+        assert third['path'] == 'wheelhouse', f"Changed requirements should install again. Found {third}"
+
+        forced = bootstrap(self.requirements, self.wheelhouse, self.state, force=True)
+        assert forced['path'] == 'wheelhouse', f"force should install even if unchanged. Found {forced}"
+
+        with self.assertLogs('bootstrap_test', level=logging.INFO) as logs:
+            run = log_last_bootstrap(self.state, logging.getLogger('bootstrap_test'))
+        assert run == forced and "path 'wheelhouse'" in logs.output[0], f"{logs.output}"
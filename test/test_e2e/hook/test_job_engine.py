@@ -0,0 +1,218 @@
+import os
+import time
+import signal
+import pstats
+
+from unittest import TestCase
+
+from test.test_utils import common_test_setup_w_logger, common_test_teardown_w_logger
+
+from hook.job_engine import JobEngine
+from hook.checkpoint import CheckpointStore
+from hook.profiling import ProfileCollector
+
+
+class TestJobEngine(TestCase):
+    """
+    This class is responsible for testing the job engine's scheduling, retries and failure handling.
+    """
+
+    def setUp(self) -> None:
+        self.logger_manager, _ = common_test_setup_w_logger()
+
+    def tearDown(self) -> None:
+        common_test_teardown_w_logger(logger_manager=self.logger_manager)
+
+    def test_dag_results(self):
+        engine = JobEngine(processes=2)
+        engine.add_task('base', _base)
+        engine.add_task('squares', _square, items=range(10), depends_on=['base'], chunk_size=3)
+        engine.add_task('total', _total, depends_on=['squares'], cpus=2, memory_mb=1)
+
+        results = list(engine.run())
+
+        assert [x.name for x in results] == ['base', 'squares', 'total'], f"Unexpected order.\n{results}"
+        assert all(x.ok for x in results), f"All tasks should succeed.\n{[x.error for x in results]}"
+        assert results[1].result == [10 + i * i for i in range(10)]
+        assert results[2].result == sum(10 + i * i for i in range(10))
+
+    def test_retries_and_failures(self):
+        marker = 'test/data/flaky_marker'
+
+        engine = JobEngine(processes=2)
+        engine.add_task('flaky', _flaky, items=[marker], retries=1)
+        engine.add_task('broken', _broken)
+        engine.add_task('after_broken', _base, depends_on=['broken'])
+
+        results = {x.name: x for x in engine.run()}
+
+        assert results['flaky'].ok and results['flaky'].result == ['recovered'], results['flaky'].error
+        assert results['flaky'].attempts == 2, f"Expected one retry. Found {results['flaky'].attempts} attempts."
+        assert not results['broken'].ok and 'ValueError: broken task' in results['broken'].error
+        assert not results['after_broken'].ok and "Dependency 'broken' failed." in results['after_broken'].error
+
+    def test_resume_from_checkpoint(self):
+        # Simulate a run interrupted after the first three items of the map task and the whole base task.
+        checkpoint = CheckpointStore('test/data/checkpoints/scheduled_vm.sqlite')
+        checkpoint.record('base', [('', 10)])
+        checkpoint.record('squares', [('0', 10), ('1', 11), ('2', 14)])
+
+        engine = JobEngine(processes=2, checkpoint=checkpoint)
+        engine.add_task('base', _broken)
+        engine.add_task('squares', _square_after_interruption, items=range(6), depends_on=['base'], chunk_size=2)
+
+        results = {x.name: x for x in engine.run()}
+
+        assert results['base'].ok and results['base'].attempts == 0, results['base'].error
+        assert results['squares'].ok, results['squares'].error
+        assert results['squares'].result == [10 + i * i for i in range(6)]
+        assert results['squares'].attempts == 2, f"Expected two chunks. Found {results['squares'].attempts}."
+        assert len(checkpoint.completed('squares')) == 6, "Every item should be checkpointed."
+
+        checkpoint.clear()
+        assert checkpoint.completed('squares') == {}
+        checkpoint.close()
+
+    def test_checkpoint_namespaces(self):
+        path = 'test/data/checkpoints/scheduled_vm.sqlite'
+        checkpoint = CheckpointStore(path, namespace='2021-06-01')
+        checkpoint.record('squares', [('0', 10), ('1', 11)])
+        checkpoint.close()
+
+        # A rerun of the same run resumes.
+        checkpoint = CheckpointStore(path, namespace='2021-06-01')
+        assert checkpoint.completed('squares') == {'0': 10, '1': 11}, checkpoint.completed('squares')
+        checkpoint.close()
+
+        # A later run on new data doesn't, and the units of the failed run are dropped.
+        checkpoint = CheckpointStore(path, namespace='2021-06-02')
+        assert checkpoint.completed('squares') == {}, "Units of another run should not be restored."
+        engine = JobEngine(processes=2, checkpoint=checkpoint)
+        engine.add_task('base', _base)
+        engine.add_task('squares', _square, items=range(4), depends_on=['base'])
+        results = {x.name: x for x in engine.run()}
+        assert results['squares'].result == [10 + i * i for i in range(4)], results['squares'].error
+        assert results['squares'].attempts == 4, f"Every item should run. Found {results['squares'].attempts}."
+        checkpoint.close()
+
+        checkpoint = CheckpointStore(path, namespace='2021-06-01')
+        assert checkpoint.completed('squares') == {}, "Units of other runs should be deleted."
+        checkpoint.close()
+
+    def test_run_deadline(self):
+        engine = JobEngine(processes=2)
+        engine.add_task('slow', _sleep, items=[0.1, 30])
+        engine.add_task('after', _base, depends_on=['slow'])
+
+        results = {x.name: x for x in engine.run(timeout=2)}
+
+        assert engine.timed_out, "The run should stop at its deadline."
+        assert 'deadline' in results['slow'].error, f"Unexpected error.\n{results['slow'].error}"
+        assert results['after'].error == "Dependency 'slow' failed.", f"Unexpected error.\n{results['after'].error}"
+
+    def test_killed_worker(self):
+        marker = 'test/data/killed_marker'
+
+        engine = JobEngine(processes=2)
+        # Without a deadline, a unit lost with its worker used to block the run forever.
+        engine.add_task('killed_once', _killed_once, items=[marker], retries=1)
+        engine.add_task('always_killed', _always_killed)
+
+        results = {x.name: x for x in engine.run(timeout=60)}
+
+        assert not engine.timed_out, "Lost units should be detected long before the deadline."
+        assert engine.lost_units == 2, f"Expected two lost units. Found {engine.lost_units}."
+        assert results['killed_once'].ok and results['killed_once'].result == ['survived'], \
+            results['killed_once'].error
+        assert results['killed_once'].attempts == 2, f"Expected one retry. Found {results['killed_once'].attempts}."
+        assert not results['always_killed'].ok and 'died while running' in results['always_killed'].error, \
+            f"Unexpected error.\n{results['always_killed'].error}"
+
+    def test_profiling(self):
+        profiler = ProfileCollector(output_dir='test/data/log/logs', trace_memory=True, top_n=10)
+        engine = JobEngine(processes=2, profiler=profiler)
+        engine.add_task('base', _base)
+        engine.add_task('allocate', _allocate, items=range(4), depends_on=['base'])
+
+        results = list(engine.run())
+        assert all(x.ok for x in results), f"All tasks should succeed.\n{[x.error for x in results]}"
+
+        profile_path, report_path = profiler.write()
+        assert profiler.tasks['allocate'][0] == 4, f"Every unit should be profiled. Found {profiler.tasks}"
+
+        # The merged profile loads with pstats and holds the calls made in every worker.
+        stats = pstats.Stats(profile_path).stats
+        calls = [value[1] for key, value in stats.items() if key[2] == '_allocate']
+        assert calls == [4], f"_allocate should be called 4 times across workers. Found {calls}"
+
+        with open(report_path, 'r') as f:
+            report = f.read()
+        assert '_allocate' in report, f"The report should list the hot function.\n{report}"
+        assert 'allocation sites' in report and 'test_job_engine.py' in report, \
+            f"The report should list the retained allocations.\n{report}"
+
+
+# ---- test_dag_results helpers ---- #
+
+def _base():
+    return 10
+
+
+def _square(i: int, base: int):
+    return base + i * i
+
+
+def _total(squares):
+    return sum(squares)
+
+
+# ---- test_run_deadline helpers ---- #
+
+def _sleep(seconds: float):
+    time.sleep(seconds)
+
+
+# ---- test_killed_worker helpers ---- #
+
+def _killed_once(marker: str):
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        # As the OOM killer would.
+        os.kill(os.getpid(), signal.SIGKILL)
+    return 'survived'
+
+
+def _always_killed():
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+# ---- test_profiling helpers ---- #
+
+_retained = []
+
+
+def _allocate(i: int, base: int):
+    # Held by the module so tracemalloc still sees it at the end of the unit.
+    _retained.append(bytearray(1024 * 1024))
+    return sum(range(base * 1000))
+
+
+# ---- test_resume_from_checkpoint helpers ---- #
+
+def _square_after_interruption(i: int, base: int):
+    if i < 3:
+        raise RuntimeError(f'Item {i} was already completed and should have been skipped.')
+    return base + i * i
+
+
+# ---- test_retries_and_failures helpers ---- #
+
+def _flaky(marker: str):
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        raise RuntimeError('first attempt fails')
+    return 'recovered'
+
+
+def _broken():
+    raise ValueError('broken task')
@@ -0,0 +1,79 @@
+import time
+
+from unittest import TestCase
+
+from test.test_utils import common_test_setup_w_logger, common_test_teardown_w_logger
+
+from hook.job_engine import JobEngine
+from configurations.settings import PoolSettings
+
+from hook.pool_sizer import PoolSizer, UnitUsage, _read_available_memory_bytes, max_pool_processes
+
+
+class TestPoolSizer(TestCase):
+    """
+    This class is responsible for testing that the pool is sized by the memory and CPU time units use.
+    """
+
+    def setUp(self) -> None:
+        self.logger_manager, _ = common_test_setup_w_logger()
+
+    def tearDown(self) -> None:
+        common_test_teardown_w_logger(logger_manager=self.logger_manager)
+
+    def test_sizing_decisions(self):
+        # I/O bound units get more workers than cores, up to max_workers.
+        sizer = PoolSizer(min_workers=1, max_workers=16, initial_workers=4, warmup_units=2, interval=0, cpu_count=4)
+        sizer.observe(UnitUsage(peak_rss_bytes=2 ** 20, cpu_seconds=0.1, wall_seconds=1.0))
+        assert sizer.workers == 4, "Nothing should change during the warm-up."
+        sizer.observe(UnitUsage(peak_rss_bytes=2 ** 20, cpu_seconds=0.1, wall_seconds=1.0))
+        assert sizer.workers == 16, f"I/O bound units should grow the pool. Found {sizer.workers}."
+
+        # CPU bound units get one worker per core, at target_cpu.
+        for _ in range(50):
+            sizer.observe(UnitUsage(peak_rss_bytes=2 ** 20, cpu_seconds=1.0, wall_seconds=1.0))
+        assert sizer.workers == 4, f"CPU bound units should use one worker per core. Found {sizer.workers}."
+
+        # Workers which don't fit in the memory above the reserve are shed.
+        available = _read_available_memory_bytes()
+        sizer = PoolSizer(min_workers=2, max_workers=16, initial_workers=8, warmup_units=1, interval=0, cpu_count=4,
+                          reserve_mb=available // 2 ** 20 + 3584)
+        sizer.observe(UnitUsage(peak_rss_bytes=2 ** 30, cpu_seconds=0.1, wall_seconds=1.0))
+        assert sizer.workers == 4, f"Four workers should be shed to keep the reserve. Found {sizer.workers}."
+        sizer.observe(UnitUsage(peak_rss_bytes=2 ** 30, cpu_seconds=0.1, wall_seconds=1.0))
+        assert sizer.workers == 2, f"The pool should not shrink below min_workers. Found {sizer.workers}."
+
+    def test_warmup_and_startup_memory(self):
+        # Without an initial size, the warm-up runs on min_workers rather than one worker per CPU.
+        sizer = PoolSizer(min_workers=2, max_workers=16, cpu_count=8)
+        assert sizer.workers == 2, f"The warm-up should start at min_workers. Found {sizer.workers}."
+
+        # No more workers are started than fit in the available memory.
+        available_mb = _read_available_memory_bytes() // 2 ** 20
+        settings = PoolSettings(adaptive=True, min_processes=2, max_processes=64, memory_reserve_mb=available_mb - 896,
+                                worker_memory_mb=256)
+        assert max_pool_processes(settings) == 3, f"Three workers fit. Found {max_pool_processes(settings)}."
+        settings = PoolSettings(adaptive=True, min_processes=2, max_processes=64, memory_reserve_mb=available_mb)
+        assert max_pool_processes(settings) == 2, "min_processes should always be started."
+        settings = PoolSettings(adaptive=True, max_processes=4, memory_reserve_mb=0, worker_memory_mb=1)
+        assert max_pool_processes(settings) == 4, "max_processes should be kept when memory allows."
+
+    def test_engine_grows_pool_for_io_bound_units(self):
+        sizer = PoolSizer(min_workers=1, max_workers=4, initial_workers=1, warmup_units=2, interval=0, cpu_count=1)
+        engine = JobEngine(processes=4, sizer=sizer)
+        engine.add_task('waits', _wait, items=range(20))
+
+        results = list(engine.run())
+
+        assert results[0].ok, results[0].error
+        assert results[0].result == list(range(20))
+        assert sizer.workers == 4 and sizer.decisions == 1, f"The pool should grow once. Found {sizer.workers}."
+        usage = sizer.recent[-1]
+        assert usage.peak_rss_bytes and usage.cpu_fraction < 0.5, f"Units should be measured. Found {usage}."
+
+
+# ---- test_engine_grows_pool_for_io_bound_units helpers ---- #
+
+def _wait(i: int) -> int:
+    time.sleep(0.05)
+    return i
@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+
+from unittest import TestCase
+
+from test.test_utils import common_test_setup_w_logger, common_test_teardown_w_logger
+
+from hook.job_engine import JobEngine
+from hook.result_sink import ResultSink
+
+
+class TestResultSink(TestCase):
+    """
+    This class is responsible for testing that workers write results to a sink instead of returning them.
+    """
+
+    def setUp(self) -> None:
+        self.logger_manager, _ = common_test_setup_w_logger()
+        self.path = 'test/data/results/squares'
+
+    def tearDown(self) -> None:
+        common_test_teardown_w_logger(logger_manager=self.logger_manager)
+
+    def test_workers_write_shards(self):
+        sink = ResultSink(self.path)
+        engine = JobEngine(processes=2)
+        engine.add_task('squares', _write_squares, items=[(sink, start) for start in range(0, 1000, 100)])
+        results = list(engine.run())
+        assert results[0].ok, results[0].error
+        assert results[0].result == [None] * 10, "Results should be written to the sink, not returned."
+
+        # Shards are readable before the sink is finalised.
+        shards = list(sink.read())
+        assert len(shards) == 20, f"Each unit should write two shards of 50 rows. Found {len(shards)}."
+        ids = np.concatenate([x['id'] for x in shards])
+        squares = np.concatenate([x['square'] for x in shards])
+        assert np.array_equal(ids, np.arange(1000)) and np.array_equal(squares, np.arange(1000) ** 2)
+
+        manifest = sink.finalize(complete=False)
+        assert manifest['rows'] == 1000 and manifest['columns']['square']['dtype'] == np.dtype(np.int64).str
+
+        # An incomplete sink is kept for the next run, which replaces the shards it writes again.
+        sink = ResultSink(self.path)
+        sink.write('000000000000-000000', {'id': np.arange(3), 'square': np.zeros(3, dtype=np.int64)})
+        assert len(sink.shards()) == 20 and sink.shards()[0]['rows'] == 3
+        files = os.listdir(os.path.join(self.path, 'shards'))
+        assert len(files) == 60, f"The replaced shard's files should be removed. Found {len(files)} files."
+
+        sink.finalize(complete=True)
+        assert ResultSink(self.path).shards() == [], "The next run should start from an empty sink."
+
+    def test_invalid_shards(self):
+        sink = ResultSink(self.path)
+        with self.assertRaises(ValueError):
+            sink.write('../escape', {'id': np.arange(3)})
+        with self.assertRaises(ValueError):
+            sink.write('rows', {'id': np.arange(3), 'value': np.arange(4)})
+        with self.assertRaises(ValueError):
+            sink.write('objects', {'id': np.array([{}, []], dtype=object)})
+
+
+# ---- test_workers_write_shards helpers ---- #
+
+def _write_squares(item):
+    sink, start = item
+    with sink.writer(key_prefix=f'{start:012d}', chunk_rows=50) as writer:
+        for i in range(start, start + 100, 10):
+            ids = np.arange(i, i + 10)
+            writer.append({'id': ids, 'square': ids.astype(np.int64) ** 2})
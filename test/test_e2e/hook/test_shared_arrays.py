@@ -0,0 +1,66 @@
+import os
+import pickle
+
+import numpy as np
+
+from unittest import TestCase
+
+from test.test_utils import common_test_setup_w_logger, common_test_teardown_w_logger
+
+from hook.job_engine import JobEngine
+from hook.shared_arrays import SharedArray, SharedArrayStore
+
+
+class TestSharedArrays(TestCase):
+    """
+    This class is responsible for testing that pool workers read published arrays in place.
+    """
+
+    def setUp(self) -> None:
+        self.logger_manager, _ = common_test_setup_w_logger()
+
+    def tearDown(self) -> None:
+        common_test_teardown_w_logger(logger_manager=self.logger_manager)
+
+    def test_publish_to_workers(self):
+        array = np.arange(1000000, dtype=np.float64).reshape(1000, 1000)
+        with SharedArrayStore(directory='test/data') as store:
+            shared = store.publish(array, name='features')
+            assert len(pickle.dumps(shared)) < 1000, "The handle should be small enough to pickle into every task."
+
+            engine = JobEngine(processes=2)
+            engine.add_task('sums', _row_sums, items=[(shared, start) for start in range(0, 1000, 100)])
+            results = list(engine.run())
+            assert results[0].ok, results[0].error
+            assert results[0].result == [float(array[x:x + 100].sum()) for x in range(0, 1000, 100)]
+
+            view = shared.view()
+            assert np.array_equal(view, array) and not view.flags.writeable, "The view should be read only."
+            directory = store.directory
+
+        assert not os.path.exists(directory), "Closing the store should remove the arrays."
+
+    def test_structured_arrays(self):
+        array = np.zeros(10, dtype=[('a', np.int32), ('b', np.float64)])
+        array['a'] = np.arange(10)
+        array['b'] = np.arange(10) / 2
+        with SharedArrayStore(directory='test/data') as store:
+            shared = pickle.loads(pickle.dumps(store.publish(array)))
+            view = shared.view()
+            assert view.dtype == array.dtype, f"The fields should survive pickling. Found {view.dtype}."
+            assert np.array_equal(view['a'], array['a']) and np.array_equal(view['b'], array['b'])
+
+    def test_empty_and_object_arrays(self):
+        with SharedArrayStore(directory='test/data') as store:
+            empty = store.publish(np.zeros((0, 3), dtype=np.int32))
+            assert empty.view().shape == (0, 3)
+            with self.assertRaises(ValueError):
+                store.publish(np.array([{}, []], dtype=object))
+
+
+# ---- test_publish_to_workers helpers ---- #
+
+def _row_sums(item):
+    shared, start = item
+    assert isinstance(shared, SharedArray)
+    return float(shared.view()[start:start + 100].sum())
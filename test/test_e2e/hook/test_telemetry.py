@@ -0,0 +1,52 @@
+import os
+import csv
+
+from unittest import TestCase, skipUnless
+
+from test.test_utils import common_test_setup_w_logger, common_test_teardown_w_logger
+
+from hook.telemetry import ResourceSampler, _read_tree_rss_bytes
+from hook.worker_pool import WorkerPool
+
+
+@skipUnless(os.path.exists('/proc/stat'), "Telemetry reads /proc.")
+class TestTelemetry(TestCase):
+    """
+    This class is responsible for testing the resource telemetry sampler.
+    """
+
+    def setUp(self) -> None:
+        self.logger_manager, _ = common_test_setup_w_logger()
+
+    def tearDown(self) -> None:
+        common_test_teardown_w_logger(logger_manager=self.logger_manager)
+
+    def test_resource_sampler(self):
+        path = 'test/data/log/logs/telemetry.csv'
+        main_rss = _read_tree_rss_bytes(os.getpid())
+
+        with WorkerPool(processes=2, start_method='spawn') as worker_pool:
+            worker_pool.wait_ready(timeout=60)
+            sampler = ResourceSampler(path=path, interval=0.05).start()
+            worker_pool.pool.map(_spin, range(4))
+            summary = sampler.stop()
+
+        assert summary['samples'] >= 2, f"The sampler should sample while work runs. Found {summary}"
+        assert summary['cores'] == os.cpu_count(), f"Every core should be sampled. Found {summary}"
+        assert 0 <= summary['idle_core_fraction'] <= 1, f"Idle fraction should be a fraction. Found {summary}"
+        assert summary['rss_mb_peak'] * 1024 * 1024 > main_rss, f"RSS should include the workers. Found {summary}"
+
+        with open(path, 'r') as f:
+            rows = list(csv.reader(f))
+        assert rows[0][:5] == ['time', 'rss_mb', 'read_mb_s', 'write_mb_s', 'queue_depth'], rows[0]
+        assert len(rows[0]) == 5 + summary['cores'], rows[0]
+        assert len(rows) == summary['samples'] + 1, f"Each sample should be one row. Found {len(rows)}"
+
+
+# ---- test_resource_sampler helpers ---- #
+
+def _spin(i: int) -> int:
+    total = 0
+    for j in range(2_000_000):
+        total += j
+    return total
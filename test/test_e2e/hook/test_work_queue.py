@@ -0,0 +1,122 @@
+import time
+
+from threading import Thread
+
+from unittest import TestCase
+
+from test.test_utils import common_test_setup_w_logger, common_test_teardown_w_logger
+
+from hook.job_engine import JobEngine
+from hook.checkpoint import CheckpointStore
+from hook.work_queue import FileWorkQueue, SQLiteWorkQueue, WorkQueue
+
+
+class TestWorkQueue(TestCase):
+    """
+    This class is responsible for testing that instances split distributed tasks through leases.
+    """
+
+    def setUp(self) -> None:
+        self.logger_manager, _ = common_test_setup_w_logger()
+
+    def tearDown(self) -> None:
+        common_test_teardown_w_logger(logger_manager=self.logger_manager)
+
+    def test_leases_expire_and_are_reclaimed(self):
+        for backend in [SQLiteWorkQueue('test/data/work_queue.sqlite'), FileWorkQueue('test/data/work_queue')]:
+            backend.add('task', [f'unit {i}' for i in range(5)])
+            backend.add('task', [f'unit {i}' for i in range(5)])
+            assert backend.counts('task', 0.5) == {'pending': 5, 'leased': 0, 'done': 0}
+
+            claimed = backend.claim('task', 'a', limit=3, lease_seconds=0.5)
+            assert claimed == ['unit 0', 'unit 1', 'unit 2'], f"Unexpected units claimed. {claimed}"
+            assert backend.claim('task', 'b', limit=5, lease_seconds=0.5) == ['unit 3', 'unit 4']
+            backend.complete('task', 'b', ['unit 3', 'unit 4'])
+            assert backend.claim('task', 'b', limit=5, lease_seconds=0.5) == [], "Leased units can't be claimed."
+
+            time.sleep(0.6)
+            assert backend.counts('task', 0.5) == {'pending': 3, 'leased': 0, 'done': 2}
+            assert backend.claim('task', 'b', limit=5, lease_seconds=0.5) == claimed, "Expired units are reclaimed."
+
+            # The first owner finishing late still counts.
+            backend.complete('task', 'a', ['unit 0'])
+            backend.release('task', 'b')
+            assert backend.counts('task', 0.5) == {'pending': 2, 'leased': 0, 'done': 3}
+            backend.close()
+
+    def test_instances_split_a_task(self):
+        results = {}
+
+        def instance(owner: str):
+            queue = WorkQueue(SQLiteWorkQueue('test/data/work_queue.sqlite'), owner=owner, poll_interval=0.1,
+                              namespace='run')
+            engine = JobEngine(processes=2, work_queue=queue)
+            engine.add_task('squares', _slow_square, items=range(60), distributed=True)
+            results[owner] = list(engine.run())
+            queue.close()
+
+        threads = [Thread(target=instance, args=(owner,)) for owner in ['vm-1', 'vm-2']]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        squares = []
+        for owner, owner_results in results.items():
+            assert owner_results[0].ok, owner_results[0].error
+            assert owner_results[0].result, f"{owner} should process some of the units."
+            squares.extend(owner_results[0].result)
+        assert sorted(squares) == [i * i for i in range(60)], "Every unit should be processed exactly once."
+
+    def test_crashed_instance_units_are_reclaimed(self):
+        backend = FileWorkQueue('test/data/work_queue')
+        backend.add('run/squares', [str(i) for i in range(10)])
+        # An instance which claimed units, then crashed.
+        backend.claim('run/squares', 'crashed', limit=4, lease_seconds=1)
+
+        queue = WorkQueue(FileWorkQueue('test/data/work_queue'), owner='vm-1', lease_seconds=1, poll_interval=0.2,
+                          namespace='run')
+        engine = JobEngine(processes=2, work_queue=queue)
+        engine.add_task('squares', _slow_square, items=range(10), distributed=True)
+        engine.add_task('total', _total, depends_on=['squares'])
+        results = list(engine.run(timeout=30))
+        queue.close()
+
+        assert all(x.ok for x in results), [x.error for x in results]
+        assert results[0].result == [i * i for i in range(10)], "The units of the crashed instance should be reclaimed."
+        assert results[1].result == sum(i * i for i in range(10))
+        assert queue.counts('squares') == {'pending': 0, 'leased': 0, 'done': 10}
+
+    def test_restored_units_are_not_polled_for(self):
+        # An interrupted run of this instance completed the first six items.
+        checkpoint = CheckpointStore('test/data/checkpoints/scheduled_vm.sqlite')
+        checkpoint.record('squares', [(str(i), i * i) for i in range(6)])
+
+        # A claim returning only restored units used to leave the task waiting for the next poll.
+        queue = WorkQueue(SQLiteWorkQueue('test/data/work_queue.sqlite'), owner='vm-1', poll_interval=60,
+                          namespace='run')
+        engine = JobEngine(processes=2, checkpoint=checkpoint, work_queue=queue)
+        engine.add_task('squares', _slow_square, items=range(8), distributed=True)
+        started = time.monotonic()
+        results = list(engine.run(timeout=30))
+        counts = queue.counts('squares')
+        queue.close()
+        checkpoint.close()
+
+        assert results[0].ok, results[0].error
+        assert time.monotonic() - started < 10, "The task should not wait for a poll."
+        assert results[0].result == [i * i for i in range(8)]
+        assert counts == {'pending': 0, 'leased': 0, 'done': 8}, f"Every unit should be done. Found {counts}"
+
+
+# ---- test_instances_split_a_task helpers ---- #
+
+def _slow_square(i: int) -> int:
+    time.sleep(0.05)
+    return i * i
+
+
+# ---- test_crashed_instance_units_are_reclaimed helpers ---- #
+
+def _total(squares):
+    return sum(squares)
@@ -0,0 +1,57 @@
+import os
+import sys
+
+from unittest import TestCase
+
+from test.test_utils import common_test_setup_w_logger, common_test_teardown_w_logger
+
+from hook.job_engine import JobEngine
+from hook.worker_pool import WorkerPool
+
+
+class TestWorkerPool(TestCase):
+    """
+    This class is responsible for testing that the worker pool starts once and is reused across stages.
+    """
+
+    def setUp(self) -> None:
+        self.logger_manager, _ = common_test_setup_w_logger()
+
+    def tearDown(self) -> None:
+        common_test_teardown_w_logger(logger_manager=self.logger_manager)
+
+    def test_shared_warm_pool(self):
+        for start_method in ['spawn', 'forkserver']:
+            with WorkerPool(processes=2, preload_modules=['wave'], start_method=start_method) as worker_pool:
+                startup_seconds = worker_pool.wait_ready(timeout=60)
+                assert len(startup_seconds) == 2, f"Both workers should report. Found {startup_seconds}"
+
+                # Two stages on the same pool run in the same, preloaded workers.
+                pids = set()
+                for stage in range(2):
+                    engine = JobEngine(pool=worker_pool)
+                    engine.add_task('probe', _probe, items=range(4))
+                    result = list(engine.run())[0]
+                    assert result.ok, result.error
+                    assert all(preloaded for _, preloaded in result.result), f"'wave' should be preloaded."
+                    pids.update(pid for pid, _ in result.result)
+                assert pids <= set(startup_seconds), f"Stages should reuse the pool workers. Found {pids}"
+
+        with open('test/data/log/logs/scheduled_vm.log', 'r') as f:
+            content = f.read()
+            assert content.count('ready in') == 4, f"Each worker should log its startup time.\n{content}"
+
+    def test_workers_not_ready(self):
+        # Workers fail to import the preload module, so none ever reports ready.
+        worker_pool = WorkerPool(processes=2, preload_modules=['module_that_does_not_exist'])
+        with self.assertRaises(TimeoutError) as context:
+            worker_pool.wait_ready(timeout=3)
+        message = str(context.exception)
+        assert '2 of 2 pool workers did not report ready within 3s' in message, message
+        assert 'Workers not ready:' in message, message
+
+
+# ---- test_shared_warm_pool helpers ---- #
+
+def _probe(i: int):
+    return os.getpid(), 'wave' in sys.modules
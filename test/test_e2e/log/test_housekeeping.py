@@ -0,0 +1,65 @@
+import os
+
+from unittest import TestCase
+
+from test.test_utils import common_test_setup, common_test_teardown_w_logger
+
+from log.log_setup import get_logger, logger_init
+from log.housekeeping import RUN_MARKER, expired_runs, list_runs
+
+
+class TestHousekeeping(TestCase):
+    """
+    This class is responsible for testing that old logs are archived, expired and deleted in the background.
+    """
+
+    def setUp(self) -> None:
+        self.config = common_test_setup()
+        self.log_dir = 'test/data/log/logs'
+        self.runs_dir = 'test/data/log/runs'
+        self.trash = 'test/data/log/.trash'
+
+    def tearDown(self) -> None:
+        common_test_teardown_w_logger(logger_manager=self.logger_manager)
+
+    def test_background_purge(self):
+        os.makedirs(f'{self.log_dir}/segment_1')
+        for i in range(300):
+            with open(f'{self.log_dir}/segment_1/{i}.log', 'w') as f:
+                f.write('x' * 100)
+
+        self.logger_manager = logger_init(self.config)
+        assert os.listdir(self.log_dir) == ['scheduled_vm.log'], "The previous logs should be moved away at start."
+
+        self.logger_manager.housekeeper.join()
+        assert os.listdir(self.trash) == [], "The trash should be emptied in the background."
+        assert self.logger_manager.housekeeper.deleted_files == 300
+
+    def test_run_history_retention(self):
+        self.config.set('Logger', 'pre_purge', 'false')
+        self.config.set('Logger', 'run_history', 'true')
+        self.config.set('Logger', 'keep_runs', '3')
+
+        # Three archived runs, and the logs of the last run.
+        for name in ['20260101-000000', '20260102-000000', '20260103-000000', '20260104-000000']:
+            folder = f'{self.runs_dir}/{name}' if name != '20260104-000000' else self.log_dir
+            os.makedirs(f'{folder}/segment_1')
+            with open(f'{folder}/segment_1/scheduled_vm.log', 'w') as f:
+                f.write(name * 10)
+        with open(f'{self.log_dir}/{RUN_MARKER}', 'w') as f:
+            f.write('20260104-000000')
+
+        self.logger_manager = logger_init(self.config)
+        get_logger(__name__).info('history run')
+        self.logger_manager.housekeeper.join()
+
+        assert os.path.isfile(f'{self.log_dir}/{RUN_MARKER}'), "The current run should be marked."
+        runs = [os.path.basename(x) for x in list_runs(self.runs_dir)]
+        assert runs == ['20260104-000000', '20260103-000000', '20260102-000000'], f"Unexpected runs kept. {runs}"
+        assert os.listdir(self.trash) == [], "Expired runs should be deleted."
+
+        # Retention by size keeps the newest runs that fit, and always the newest run.
+        runs = list_runs(self.runs_dir)
+        assert expired_runs(self.runs_dir, keep_bytes=1) == runs[1:]
+        assert expired_runs(self.runs_dir, keep_bytes=350) == runs[2:]
+        assert expired_runs(self.runs_dir, keep_bytes=10 ** 9) == []
@@ -1,3 +1,7 @@
+import os
+import sys
+import gzip
+import logging
 import datetime
 
 import numpy as np
@@ -14,7 +18,10 @@ from unittest import TestCase
 from test.test_utils import common_test_setup, common_test_setup_w_logger, common_test_teardown_w_logger
 
 import log.globals
-from log.log_setup import get_logger, logger_init
+from log.log_setup import get_logger, logger_init, init_worker_logger, parse_logseg, CreateFileHandlerHandler
+from log.query import LogQuery, log_files
+from log.transport import LogQueue, ShardTransport
+from log.writer import _flusher
 
 
 class TestLogger(TestCase):
@@ -67,6 +74,289 @@ class TestLogger(TestCase):
             content_len = len(content)
             assert content_len == 1, f'Only one log should be in log file. Found {content_len}.\n{content}'
 
+    def test_multiprocessing_logger_batched_transport(self):
+        # Use custom configurations for this test.
+        config = common_test_setup()
+        config.set('Logger', 'transport', 'batched')
+        config.set('Logger', 'batch_size', '8')
+        config.set('Logger', 'batch_interval', '0.05')
+        # The queue is created for the start method of the workers it is handed to.
+        config.set('Pool', 'start_method', 'spawn')
+        self.logger_manager = logger_init(config)
+
+        _multiprocessing_logger_batched_transport_helper()
+
+        # Flush the listener so that every record is on disk.
+        self.logger_manager.terminate_logger()
+
+        with open('test/data/log/logs/scheduled_vm.log', 'r') as f:
+            content = f.readlines()
+            content_len = len(content)
+            assert content_len == 100, f"100 logs should be in log file. Found {content_len}.\n{content}"
+        with open('test/data/log/logs/batch_5/scheduled_vm.log', 'r') as f:
+            content = f.readlines()
+            content_len = len(content)
+            assert content_len == 10, f"10 logs should be in batch_5 log file. Found {content_len}.\n{content}"
+
+    def test_buffered_writer_file_rotation(self):
+        # Use custom configurations for this test.
+        config = common_test_setup()
+        config.set('Logger', 'max_bytes', '1000')
+        config.set('Logger', 'backup_count', '2')
+        config.set('Logger', 'writer_buffer_size', '4096')
+        config.set('Logger', 'writer_flush_interval', '60')
+        self.logger_manager = logger_init(config)
+
+        sequential_logger = get_logger(__name__)
+        for i in range(40):
+            sequential_logger.info(f'record {i:04d} ' + 'x' * 40)
+
+        # Nothing should be committed until the buffer fills, the interval passes or the logger terminates.
+        assert os.path.getsize('test/data/log/logs/scheduled_vm.log') == 0, "Records were written before commit."
+
+        self.logger_manager.terminate_logger()
+
+        for suffix, first, count in [('.2', 11, 11), ('.1', 22, 11), ('', 33, 7)]:
+            assert os.path.getsize(f'test/data/log/logs/scheduled_vm.log{suffix}') < 1000
+            with open(f'test/data/log/logs/scheduled_vm.log{suffix}', 'r') as f:
+                content = f.readlines()
+                content_len = len(content)
+                assert content_len == count, f"{count} logs should be in log file. Found {content_len}.\n{content}"
+                assert f'record {first:04d} ' in content[0], f"Unexpected first record.\n{content}"
+        assert not os.path.exists('test/data/log/logs/scheduled_vm.log.3'), "Too many backups were kept."
+
+    def test_zero_writer_flush_interval(self):
+        # Use custom configurations for this test.
+        config = common_test_setup()
+        config.set('Logger', 'writer_buffer_size', '4096')
+        config.set('Logger', 'writer_flush_interval', '0')
+        self.logger_manager = logger_init(config)
+
+        sequential_logger = get_logger(__name__)
+        for i in range(5):
+            sequential_logger.info(f'record {i:04d}')
+
+        # Every record is committed as it is logged, rather than by a flusher thread sleeping 0 seconds at a time.
+        with open('test/data/log/logs/scheduled_vm.log', 'r') as f:
+            content = f.read()
+            assert content.count('record 00') == 5, f"Every record should be committed immediately.\n{content}"
+        assert all(x.flush_interval > 0 for x in _flusher.handlers), "Handlers without an interval need no flusher."
+        assert _flusher.interval is None or _flusher.interval > 0, f"The flusher would spin. Found {_flusher.interval}"
+
+        self.logger_manager.terminate_logger()
+
+    def test_segment_file_pool_eviction(self):
+        # Use custom configurations for this test.
+        config = common_test_setup()
+        config.set('Logger', 'max_bytes', '1000')
+        config.set('Logger', 'backup_count', '2')
+        config.set('Logger', 'max_open_segments', '2')
+        self.logger_manager = logger_init(config)
+
+        sequential_logger = get_logger(__name__)
+        for i in range(30):
+            for segment in range(3):
+                sequential_logger.info(f'LOGSEG(segment_{segment})record {i:04d} ' + 'x' * 40)
+
+        file_pool = [x for x in logging.getLogger().handlers if isinstance(x, CreateFileHandlerHandler)][0].file_pool
+        stats = file_pool.stats()
+        assert stats['open'] == 2, f"Only two segment files should be open. Found {stats}"
+        assert stats['evictions'] == 88 and stats['reopens'] == 87, f"Unexpected pool counters. Found {stats}"
+
+        self.logger_manager.terminate_logger()
+
+        # Rotation state must survive the segment files being closed and reopened.
+        for segment in range(3):
+            for suffix, first, count in [('.2', 0, 11), ('.1', 11, 11), ('', 22, 8)]:
+                with open(f'test/data/log/logs/segment_{segment}/scheduled_vm.log{suffix}', 'r') as f:
+                    content = f.readlines()
+                    content_len = len(content)
+                    assert content_len == count, f"{count} logs should be in log file. Found {content_len}.\n{content}"
+                    assert f'record {first:04d} ' in content[0], f"Unexpected first record.\n{content}"
+
+    def test_rotated_file_compression(self):
+        # Use custom configurations for this test.
+        config = common_test_setup()
+        config.set('Logger', 'max_bytes', '1000')
+        config.set('Logger', 'backup_count', '2')
+        config.set('Logger', 'compression', 'gzip')
+        self.logger_manager = logger_init(config)
+
+        sequential_logger = get_logger(__name__)
+        for i in range(40):
+            sequential_logger.info(f'record {i:04d} ' + 'x' * 40)
+
+        # Terminating waits for pending compressions.
+        self.logger_manager.terminate_logger()
+
+        for suffix, first, count in [('.2.gz', 11, 11), ('.1.gz', 22, 11), ('', 33, 7)]:
+            with (gzip.open if suffix else open)(f'test/data/log/logs/scheduled_vm.log{suffix}', 'rt') as f:
+                content = f.readlines()
+                content_len = len(content)
+                assert content_len == count, f"{count} logs should be in log file. Found {content_len}.\n{content}"
+                assert f'record {first:04d} ' in content[0], f"Unexpected first record.\n{content}"
+        assert sorted(os.listdir('test/data/log/logs')) == ['scheduled_vm.log', 'scheduled_vm.log.1.gz',
+                                                            'scheduled_vm.log.2.gz']
+
+    def test_slim_records_and_worker_levels(self):
+        # Use custom configurations for this test.
+        config = common_test_setup()
+        config.set('Logger', 'wire_format', 'slim')
+        config.set('Logger', 'levels', 'noisy:WARNING')
+        self.logger_manager = logger_init(config)
+
+        _slim_records_and_worker_levels_helper()
+
+        # Flush the listener so that every record is on disk.
+        self.logger_manager.terminate_logger()
+
+        with open('test/data/log/logs/scheduled_vm.log', 'r') as f:
+            content = f.read()
+            # The main process handles queued records regardless of level, so these can only be dropped in the worker.
+            assert 'below threshold' not in content, f"Records below the threshold should be dropped.\n{content}"
+            assert content.count('above threshold') == 4, f"4 warnings should be in log file.\n{content}"
+            assert content.count('ZeroDivisionError') == 4, f"Tracebacks should be rendered.\n{content}"
+            assert 'LOGSEG(' not in content, f"Slim records should carry the tag separately.\n{content}"
+        with open('test/data/log/logs/slim_1/scheduled_vm.log', 'r') as f:
+            content = f.readlines()
+            content_len = len(content)
+            assert content_len == 4, f"4 logs should be in slim_1 log file. Found {content_len}.\n{content}"
+
+    def test_buffered_redirects(self):
+        # Use custom configurations for this test.
+        config = common_test_setup()
+        config.set('Logger', 'redirect_buffer_size', '4096')
+        config.set('Logger', 'redirect_flush_interval', '60')
+        self.logger_manager = logger_init(config)
+
+        _buffered_redirects_helper()
+        # The unfinished line is logged when the logger terminates.
+        print('main process, unterminated', end='')
+        self.logger_manager.terminate_logger()
+
+        with open('test/data/log/logs/scheduled_vm.log', 'r') as f:
+            content = f.read()
+            records = [x for x in content.splitlines() if x[:4].isdigit()]
+            assert 'assembled from three writes' in content, f"Partial writes should form a line.\n{content}"
+            assert 'progress 100%' in content and 'progress 50%' not in content, \
+                f"Progress updates should collapse to the last one.\n{content}"
+            assert 'main process, unterminated' in content, f"The unfinished line should be logged.\n{content}"
+            assert len(records) == 2, f"The worker's burst should be one record. Found {len(records)}.\n{content}"
+
+
+    def test_indexed_log_query(self):
+        # Use custom configurations for this test.
+        config = common_test_setup()
+        config.set('Logger', 'max_bytes', '1000')
+        config.set('Logger', 'backup_count', '2')
+        config.set('Logger', 'compression', 'gzip')
+        config.set('Logger', 'index_block_seconds', '60')
+        config.set('Logger', 'index_block_bytes', '200')
+        self.logger_manager = logger_init(config)
+
+        sequential_logger = get_logger(__name__)
+        for i in range(40):
+            log = sequential_logger.warning if i % 10 == 5 else sequential_logger.info
+            log(f'record {i:04d} ' + 'x' * 40)
+        for i in range(5):
+            sequential_logger.info(f'LOGSEG(indexed)segment record {i}')
+
+        # Terminating waits for pending compressions.
+        self.logger_manager.terminate_logger()
+
+        warnings = []
+        for path in log_files('test/data/log/logs'):
+            with (gzip.open if path.endswith('.gz') else open)(path, 'rt') as f:
+                warnings.extend(x.rstrip('\n') for x in f if 'WARNING' in x)
+        assert warnings, "Some warnings should be in the retained log files."
+        assert os.path.exists('test/data/log/logs/scheduled_vm.log.1.idx'), "Backups should keep their index."
+
+        query = LogQuery(level=logging.WARNING)
+        records = [record for _, record in query.run('test/data/log/logs')]
+        assert records == warnings, f"The query should find every warning.\n{records}\n{warnings}"
+        assert query.blocks_skipped > 0, "Blocks without warnings should be skipped."
+
+        query = LogQuery(since=datetime.datetime.now().timestamp() + 3600)
+        records = list(query.run('test/data/log/logs', segments=['*']))
+        assert records == [] and query.blocks_read == 0, f"Nothing should be read.\n{records}"
+
+        query = LogQuery(text='record 3')
+        records = list(query.run('test/data/log/logs', segments=['indexed']))
+        assert [x[0] for x in records] == ['indexed'], f"The query should only search the segment.\n{records}"
+        assert records[0][1].endswith('segment record 3'), f"Unexpected record.\n{records}"
+
+    def test_bounded_queue_overflow(self):
+        # Use custom configurations for this test.
+        config = common_test_setup()
+        config.set('Logger', 'max_bytes', '0')
+        config.set('Logger', 'queue_capacity', '4')
+        config.set('Logger', 'overflow_policy', 'drop_oldest')
+        self.logger_manager = logger_init(config)
+
+        _bounded_queue_overflow_helper()
+        self.logger_manager.terminate_logger()
+
+        stats = self.logger_manager.queue_stats
+        with open('test/data/log/logs/scheduled_vm.log', 'r') as f:
+            content = f.read()
+            errors = content.count('overflow error')
+            infos = content.count('overflow info')
+            assert errors == 20, f"Errors must never be dropped. Found {errors}."
+            assert 'ERROR' not in stats.dropped, f"Errors must never be dropped. Found {stats.dropped}"
+            assert infos + stats.dropped.get('INFO', 0) == 2000, \
+                f"Every record should be written or counted as dropped. Found {infos} and {stats.dropped}"
+            assert 'Logger queue (capacity 4, drop_oldest)' in content, f"The summary should be logged.\n{content}"
+
+    def test_shard_transport_merge(self):
+        # Use custom configurations for this test.
+        config = common_test_setup()
+        config.set('Logger', 'transport', 'shards')
+        config.set('Logger', 'max_bytes', '5000')
+        config.set('Logger', 'backup_count', '50')
+        self.logger_manager = logger_init(config)
+        assert isinstance(log.globals.logger_queue, ShardTransport) and \
+            not isinstance(log.globals.logger_queue, LogQueue), "The shards transport has no queue to put records on."
+
+        get_logger(__name__).info('LOGSEG(shard_main)main started')
+        _shard_transport_merge_helper()
+        assert not os.path.exists('test/data/log/logs/scheduled_vm.log'), "Logs are written when the shards merge."
+        # The shard of the main process is still buffered.
+        assert len(os.listdir('test/data/log/logs/.shards')) == 3, "Each worker should write a shard."
+
+        self.logger_manager.terminate_logger()
+        assert not os.path.exists('test/data/log/logs/.shards'), "The shards should be removed once merged."
+
+        lines = []
+        for path in log_files('test/data/log/logs'):
+            with open(path, 'r') as f:
+                content = f.readlines()
+                assert sum(len(x) for x in content) < 5000, f"Merged files should be rotated. {path} is too large."
+                lines.extend(content)
+        times = [x[:23] for x in lines if x[:4].isdigit()]
+        assert times == sorted(times), "Records should be merged in time order."
+        for i in range(3):
+            records = sum(f'shard record {i} ' in x for x in lines)
+            assert records == 200, f"Every record of worker {i} should be merged. Found {records}."
+        assert sum('shard print' in x for x in lines) == 3, "Redirected prints should be merged."
+
+        with open('test/data/log/logs/shard_main/scheduled_vm.log', 'r') as f:
+            content = f.read()
+            assert content.count('shard segment') == 3 and 'main started' in content, f"Unexpected segment.\n{content}"
+            assert 'LOGSEG' not in content, f"Segment tags should be removed.\n{content}"
+
+
+class TestLogseg(TestCase):
+    """
+    This class is responsible for testing LOGSEG tag parsing.
+    """
+
+    def test_parse_logseg(self):
+        assert parse_logseg('no tag here') == ('no tag here', None)
+        assert parse_logseg('LOGSEG(thread_1)Thread 1 started') == ('Thread 1 started', 'thread_1')
+        assert parse_logseg('a LOGSEG(x)b LOGSEG(y)c') == ('a b c', 'x')
+        assert parse_logseg('LOGSEG(unterminated') == ('LOGSEG(unterminated', None)
+        assert parse_logseg(42) == (42, None)
+
 
 # ---- test_multiprocessing_logger_and_redirects helpers ---- #
 
@@ -147,3 +437,103 @@ def _multiprocessing_logger_file_rotation_process_helper(process_num: int, print
 
     # Print now that the processes are in sync.
     multiprocessing_logger.info(f'Process: {process_num} printing at {datetime.datetime.now()}')
+
+
+# ---- multiprocessing_logger_batched_transport helpers ---- #
+
+def _multiprocessing_logger_batched_transport_helper():
+    # Spawned, so workers don't inherit the main process's file handlers and write every record twice.
+    pool = mp.get_context('spawn').Pool(processes=2, initializer=init_worker_logger,
+                                        initargs=(log.globals.logger_queue,))
+    pool.map(func=_multiprocessing_logger_batched_transport_process_helper, iterable=range(10))
+    pool.close()
+    pool.join()
+
+
+def _multiprocessing_logger_batched_transport_process_helper(i: int):
+    multiprocessing_logger = get_logger(name=__name__)
+    for j in range(10):
+        multiprocessing_logger.info(f'LOGSEG(batch_{j})Task: {i}, record: {j}')
+
+
+# ---- slim_records_and_worker_levels helpers ---- #
+
+def _slim_records_and_worker_levels_helper():
+    # Spawned, so workers don't inherit the main process's file handlers and write every record twice.
+    pool = mp.get_context('spawn').Pool(processes=2, initializer=init_worker_logger,
+                                        initargs=(log.globals.logger_queue,))
+    pool.map(func=_slim_records_and_worker_levels_process_helper, iterable=range(4))
+    pool.close()
+    pool.join()
+
+
+def _slim_records_and_worker_levels_process_helper(i: int):
+    noisy_logger = get_logger(name='noisy')
+    noisy_logger.info(f'below threshold {i}')
+    noisy_logger.warning(f'above threshold {i}')
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        get_logger(name=__name__).exception(f'Task {i} failed')
+    get_logger(name=__name__).info(f'LOGSEG(slim_1)Task: {i}')
+
+
+# ---- buffered_redirects helpers ---- #
+
+def _buffered_redirects_helper():
+    # Spawned, so workers don't inherit the main process's file handlers and write every record twice.
+    pool = mp.get_context('spawn').Pool(processes=1, initializer=init_worker_logger,
+                                        initargs=(log.globals.logger_queue,))
+    pool.apply(func=_buffered_redirects_process_helper)
+    pool.close()
+    pool.join()
+
+
+def _buffered_redirects_process_helper():
+    # Progress bars flush after every update, which must not log the unfinished line.
+    for percent in range(0, 101, 10):
+        sys.stdout.write(f'\rprogress {percent}%')
+        sys.stdout.flush()
+    sys.stdout.write('\n')
+    print('assembled', end='')
+    print(' from three', end='')
+    print(' writes')
+    for i in range(5):
+        print(f'burst line {i}')
+
+
+# ---- bounded_queue_overflow helpers ---- #
+
+def _bounded_queue_overflow_helper():
+    # Spawned, so workers don't inherit the main process's file handlers and write every record twice.
+    pool = mp.get_context('spawn').Pool(processes=4, initializer=init_worker_logger,
+                                        initargs=(log.globals.logger_queue,))
+    pool.map(func=_bounded_queue_overflow_process_helper, iterable=range(4))
+    pool.close()
+    pool.join()
+
+
+def _bounded_queue_overflow_process_helper(i: int):
+    overflow_logger = get_logger(name=__name__)
+    for j in range(500):
+        overflow_logger.info(f'overflow info {i} {j}')
+        if j % 100 == 0:
+            overflow_logger.error(f'overflow error {i} {j}')
+
+
+# ---- shard_transport_merge helpers ---- #
+
+def _shard_transport_merge_helper():
+    pool = mp.Pool(processes=3, initializer=init_worker_logger, initargs=(log.globals.logger_queue,))
+    # One task per worker, so each worker writes one shard.
+    pool.map(func=_shard_transport_merge_process_helper, iterable=range(3), chunksize=1)
+    pool.close()
+    pool.join()
+
+
+def _shard_transport_merge_process_helper(i: int):
+    shard_logger = get_logger(name=__name__)
+    for j in range(200):
+        shard_logger.info(f'shard record {i} {j}')
+    shard_logger.info(f'LOGSEG(shard_main)shard segment {i}')
+    print(f'shard print {i}')
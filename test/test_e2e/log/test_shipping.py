@@ -0,0 +1,99 @@
+import os
+import gzip
+import shutil
+
+from unittest import TestCase
+
+from test.test_utils import common_test_setup, common_test_teardown
+
+from log.shipping import LogShipper, LocalDirectoryTransport, BundleTransport, apply_bundle
+
+
+class TestShipping(TestCase):
+    """
+    This class is responsible for testing that log files are shipped incrementally.
+    """
+
+    def setUp(self) -> None:
+        common_test_setup()
+        self.log_dir = 'test/data/logs'
+        self.mirror = 'test/data/mirror'
+        self.manifest = 'test/data/shipping.json'
+        os.makedirs(f'{self.log_dir}/segment_1')
+
+    def tearDown(self) -> None:
+        common_test_teardown()
+
+    def _write(self, name: str, text: str, mode: str = 'a') -> None:
+        with open(os.path.join(self.log_dir, name), mode) as f:
+            f.write(text)
+
+    def _assert_mirrored(self, mirror: str) -> None:
+        for folder, _, names in os.walk(self.log_dir):
+            for name in names:
+                path = os.path.join(folder, name)
+                with open(path, 'rb') as f, open(os.path.join(mirror, os.path.relpath(path, self.log_dir)), 'rb') as g:
+                    assert f.read() == g.read(), f"{path} should be mirrored."
+        count = sum(len(names) for _, _, names in os.walk(self.log_dir))
+        mirrored = sum(len(names) for _, _, names in os.walk(mirror))
+        assert count == mirrored, f"The mirror should hold {count} files. Found {mirrored}."
+
+    def test_incremental_sync(self):
+        shipper = LogShipper(self.log_dir, LocalDirectoryTransport(self.mirror), manifest_path=self.manifest)
+
+        self._write('scheduled_vm.log', 'a' * 100)
+        self._write('segment_1/scheduled_vm.log', 'b' * 50)
+        counters = shipper.sync()
+        assert counters['shipped_bytes'] == 150 and counters['shipped_files'] == 2, f"{counters}"
+        self._assert_mirrored(self.mirror)
+
+        # Only the appended bytes are shipped.
+        self._write('scheduled_vm.log', 'c' * 10)
+        counters = shipper.sync()
+        assert counters['shipped_bytes'] == 10 and counters['skipped_bytes'] == 150, f"{counters}"
+        self._assert_mirrored(self.mirror)
+
+        # Rotation renames the live file, which shouldn't be sent again.
+        os.replace(f'{self.log_dir}/scheduled_vm.log', f'{self.log_dir}/scheduled_vm.log.1')
+        self._write('scheduled_vm.log', 'd' * 20)
+        counters = shipper.sync()
+        assert counters['renamed'] == 1 and counters['shipped_bytes'] == 20, f"{counters}"
+        self._assert_mirrored(self.mirror)
+
+        # A second rotation shifts the backup along, and compressing a backup replaces it with a new file.
+        os.replace(f'{self.log_dir}/scheduled_vm.log.1', f'{self.log_dir}/scheduled_vm.log.2')
+        os.replace(f'{self.log_dir}/scheduled_vm.log', f'{self.log_dir}/scheduled_vm.log.1')
+        with open(f'{self.log_dir}/scheduled_vm.log.2', 'rb') as f_in, \
+                gzip.open(f'{self.log_dir}/scheduled_vm.log.2.gz', 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(f'{self.log_dir}/scheduled_vm.log.2')
+        self._write('scheduled_vm.log', '')
+        counters = shipper.sync()
+        # The new file may reuse the removed backup's inode, which the head checksum catches.
+        assert counters['shipped_files'] == 2, f"Only the compressed backup and the new file are new. {counters}"
+        assert counters['skipped_bytes'] == 70, f"The shifted backup shouldn't be sent again. {counters}"
+        self._assert_mirrored(self.mirror)
+
+        # A file rewritten in place is shipped again from the start.
+        self._write('segment_1/scheduled_vm.log', 'e' * 60, mode='w')
+        counters = shipper.sync()
+        assert counters['shipped_bytes'] == 60, f"{counters}"
+        self._assert_mirrored(self.mirror)
+
+        counters = shipper.sync()
+        assert counters['shipped_files'] == 0, f"Nothing changed, so nothing should be shipped. {counters}"
+
+    def test_bundle_sync(self):
+        bundle = 'test/data/bundle'
+        shipper = LogShipper(self.log_dir, BundleTransport(bundle), manifest_path=self.manifest)
+
+        self._write('scheduled_vm.log', 'a' * 100)
+        shipper.sync()
+        os.replace(f'{self.log_dir}/scheduled_vm.log', f'{self.log_dir}/scheduled_vm.log.1')
+        self._write('scheduled_vm.log', 'b' * 10)
+        self._write('segment_1/scheduled_vm.log', 'c' * 10)
+        # The bundle wasn't fetched in between, so both syncs are recorded in it.
+        LogShipper(self.log_dir, BundleTransport(bundle), manifest_path=self.manifest).sync()
+
+        assert apply_bundle(bundle, LocalDirectoryTransport(self.mirror)) == 5
+        self._assert_mirrored(self.mirror)
@@ -70,6 +70,9 @@ def common_test_setup_w_logger() -> Tuple[LoggerManager, ConfigParser]:
 def common_test_teardown_w_logger(logger_manager: LoggerManager):
     # Terminate the logger.
     logger_manager.terminate_logger()
+    # Let the background deletion of old logs finish before deleting the test directory.
+    if logger_manager.housekeeper is not None:
+        logger_manager.housekeeper.join()
     # Reload the logger
     reload(logging)
 